@@ -9,10 +9,13 @@ django_asgi_app = get_asgi_application()
 # Now import Channels components
 from channels.routing import ProtocolTypeRouter, URLRouter
 import bus_tracking.routing
+from bus_tracking.middleware import TokenAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": URLRouter(
-        bus_tracking.routing.websocket_urlpatterns
+    "websocket": TokenAuthMiddlewareStack(
+        URLRouter(
+            bus_tracking.routing.websocket_urlpatterns
+        )
     ),
 })
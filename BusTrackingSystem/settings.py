@@ -232,6 +232,16 @@ REST_FRAMEWORK = {
         # DEVELOPMENT: Allow unauthenticated access for testing
         'rest_framework.permissions.AllowAny',
     ],
+    # orjson-backed JSON when installed (pip install orjson), stdlib otherwise; see bus_tracking/fastjson.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'bus_tracking.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'bus_tracking.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.AnonRateThrottle',
         'rest_framework.throttling.UserRateThrottle'
@@ -254,6 +264,12 @@ REST_FRAMEWORK = {
 # Leave empty or set to 'memory' for InMemoryChannelLayer
 REDIS_URL = os.getenv('REDIS_URL', '')
 
+# Redis channel layer flavour when REDIS_URL is set:
+#   core   = RedisChannelLayer (a Redis list per channel, delivery guarantees)
+#   pubsub = RedisPubSubChannelLayer (lighter for broadcast-only traffic,
+#            see scripts/bench_channel_layers.py)
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'core')
+
 # For development without Redis, use in-memory channel layer
 if not REDIS_URL or REDIS_URL == 'memory':
     CHANNEL_LAYERS = {
@@ -261,6 +277,17 @@ if not REDIS_URL or REDIS_URL == 'memory':
             'BACKEND': 'channels.layers.InMemoryChannelLayer',
         },
     }
+elif CHANNEL_LAYER_BACKEND == 'pubsub':
+    # Redis pub/sub: one PUBLISH per group message, fanned out inside each
+    # server process. Best for the position broadcasts (fire-and-forget)
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
 else:
     CHANNEL_LAYERS = {
         'default': {
@@ -273,6 +300,83 @@ else:
         },
     }
 
+# =====================================================================
+# CACHE CONFIGURATION (read cache, initial-data snapshot, tiles)
+# =====================================================================
+#   locmem = per process (default without REDIS_URL; each worker has its own copy)
+#   redis  = shared by every process (default when REDIS_URL is set)
+#   file   = shared through a directory (CACHE_DIR), for single-host deployments
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis' if REDIS_URL and REDIS_URL != 'memory' else 'locmem')
+CACHE_URL = os.getenv('CACHE_URL', REDIS_URL)
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'bts',
+        },
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+# =====================================================================
+# LIVE TRACKING CONFIGURATION (WebSocket fan-out)
+# =====================================================================
+# Size of the spatial grid cells (degrees) used for viewport subscriptions.
+# 0.01° ≈ 1.1 km
+BUS_TRACKING_GRID_CELL_DEG = float(os.getenv('BUS_TRACKING_GRID_CELL_DEG', '0.01'))
+# Viewports covering more cells than this fall back to the whole-fleet group
+BUS_TRACKING_MAX_VIEWPORT_CELLS = int(os.getenv('BUS_TRACKING_MAX_VIEWPORT_CELLS', '400'))
+# Broadcast tick: updates are coalesced (latest state per bus) and sent once per tick.
+# 0 = send every fix immediately (old behaviour)
+BUS_TRACKING_BROADCAST_TICK_MS = int(os.getenv('BUS_TRACKING_BROADCAST_TICK_MS', '500'))
+# Only 1 in N per-client send events is logged (at DEBUG) on the fan-out path
+BUS_TRACKING_LOG_SAMPLE_EVERY = int(os.getenv('BUS_TRACKING_LOG_SAMPLE_EVERY', '1000'))
+# WebSocket token auth cache (per process): seconds a resolved token is trusted, max entries
+BUS_TRACKING_WS_TOKEN_CACHE_TTL = int(os.getenv('BUS_TRACKING_WS_TOKEN_CACHE_TTL', '60'))
+BUS_TRACKING_WS_TOKEN_CACHE_SIZE = int(os.getenv('BUS_TRACKING_WS_TOKEN_CACHE_SIZE', '10000'))
+# Slow WebSocket clients: max buses pending per connection (latest state per bus is kept),
+# and seconds an update may stay undelivered before the connection is closed
+BUS_TRACKING_OUTBOX_MAX_BUSES = int(os.getenv('BUS_TRACKING_OUTBOX_MAX_BUSES', '2000'))
+BUS_TRACKING_STALL_TIMEOUT = int(os.getenv('BUS_TRACKING_STALL_TIMEOUT', '30'))
+# Frames a ?ack=1 WebSocket client may have unacknowledged before updates for it coalesce
+BUS_TRACKING_ACK_WINDOW = int(os.getenv('BUS_TRACKING_ACK_WINDOW', '4'))
+# Broadcasts kept per group for ?resume_from= (120 = about a minute at the default tick)
+BUS_TRACKING_RESUME_BUFFER = int(os.getenv('BUS_TRACKING_RESUME_BUFFER', '120'))
+# initial-data snapshot: max age in seconds (bounds how stale buses' current_location can be)
+BUS_TRACKING_INITIAL_DATA_TTL = int(os.getenv('BUS_TRACKING_INITIAL_DATA_TTL', '30'))
+# Seconds the network version stays cached before it is re-read from the database
+# (how long a process using a per-process cache may miss changes made by another)
+BUS_TRACKING_NETWORK_VERSION_TTL = int(os.getenv('BUS_TRACKING_NETWORK_VERSION_TTL', '5'))
+# initial-data?since=: seconds of the change log re-read below the client's version
+# (covers changes committed out of id order; longest expected admin transaction)
+BUS_TRACKING_NETWORK_CHANGE_OVERLAP = int(os.getenv('BUS_TRACKING_NETWORK_CHANGE_OVERLAP', '60'))
+# /tiles/<z>/<x>/<y>: seconds a generated tile stays cached (tiles are keyed by network version)
+BUS_TRACKING_TILE_TTL = int(os.getenv('BUS_TRACKING_TILE_TTL', '3600'))
+# In-memory network indexes (tiles, nearby stops, search, journeys): max age in seconds,
+# so a change committed out of order is picked up even if the network version did not move
+BUS_TRACKING_NETWORK_INDEX_TTL = int(os.getenv('BUS_TRACKING_NETWORK_INDEX_TTL', '300'))
+# Read cache for bus-lines / bus-stops / buses (see bus_tracking/read_cache.py): max age in seconds
+BUS_TRACKING_READ_CACHE_TTL = int(os.getenv('BUS_TRACKING_READ_CACHE_TTL', '300'))
+# Journey planner (see bus_tracking/journeys.py): mean wait when boarding a bus, in seconds
+BUS_TRACKING_JOURNEY_BOARD_WAIT = int(os.getenv('BUS_TRACKING_JOURNEY_BOARD_WAIT', '300'))
+# Journey planner: longest walk between two stops for a transfer, in meters
+BUS_TRACKING_JOURNEY_MAX_WALK = int(os.getenv('BUS_TRACKING_JOURNEY_MAX_WALK', '400'))
+
 # =====================================================================
 # LOGGING CONFIGURATION (للـ Production)
 # =====================================================================
@@ -87,16 +87,17 @@ extension SearchCategoryExtension on SearchCategory {
     }
   }
 
-  String get apiEndpoint {
+  /// قيمة type في /api/search/
+  String get searchType {
     switch (this) {
       case SearchCategory.all:
-        return 'initial-data'; // نستخدم endpoint واحد
+        return 'all';
       case SearchCategory.busStops:
-        return 'bus-stops';
+        return 'bus_stops';
       case SearchCategory.buses:
         return 'buses';
       case SearchCategory.busLines:
-        return 'bus-lines';
+        return 'bus_lines';
     }
   }
 }
@@ -23,21 +23,14 @@ class SearchService {
         return [];
       }
 
+      // البحث يتم على السيرفر (فهرس مع تطبيع للنص العربي وترتيب للنتائج)
       final List<SearchResult> results = [];
-
-      // نجلب البيانات حسب الفئة
-      if (category == SearchCategory.all) {
-        // نجلب كل البيانات
-        final response = await _fetchData('initial-data');
-        if (response != null) {
-          results.addAll(_parseAllData(response, query));
-        }
-      } else {
-        // نجلب فئة محددة
-        final response = await _fetchData(category.apiEndpoint);
-        if (response != null) {
-          results.addAll(_parseCategory(response, category, query));
-        }
+      final response = await _fetchData('search', {
+        'q': query.trim(),
+        'type': category.searchType,
+      });
+      if (response != null) {
+        results.addAll(_parseSearchResults(response));
       }
 
       return results;
@@ -48,7 +41,10 @@ class SearchService {
   }
 
   /// جلب البيانات من API
-  Future<dynamic> _fetchData(String endpoint) async {
+  Future<dynamic> _fetchData(
+    String endpoint, [
+    Map<String, String>? queryParameters,
+  ]) async {
     try {
       final headers = {
         'Content-Type': 'application/json',
@@ -57,7 +53,9 @@ class SearchService {
         'User-Agent': 'BusTrackingApp/1.0',
       };
 
-      final uri = Uri.parse('$_baseUrl/api/$endpoint/');
+      final uri = Uri.parse(
+        '$_baseUrl/api/$endpoint/',
+      ).replace(queryParameters: queryParameters);
       debugPrint('[SearchService] Fetching: $uri');
 
       final response = await http.get(uri, headers: headers);
@@ -76,77 +74,27 @@ class SearchService {
     }
   }
 
-  /// معالجة كل البيانات
-  List<SearchResult> _parseAllData(dynamic data, String query) {
-    final List<SearchResult> results = [];
+  /// معالجة نتائج البحث (مرتبة من السيرفر حسب درجة التطابق)
+  List<SearchResult> _parseSearchResults(dynamic data) {
+    final List<MapEntry<num, SearchResult>> scored = [];
 
-    // محطات الباص
-    if (data['bus_stops'] != null) {
-      for (var item in data['bus_stops']) {
-        if (_matchesQuery(item['stop_name'], query)) {
-          results.add(SearchResult.fromBusStop(item));
-        }
-      }
+    for (var item in data['bus_stops'] ?? []) {
+      scored.add(MapEntry(item['score'] ?? 0, SearchResult.fromBusStop(item)));
     }
-
-    // الباصات
-    if (data['buses'] != null) {
-      for (var item in data['buses']) {
-        if (_matchesQuery(item['license_plate'], query)) {
-          results.add(SearchResult.fromBus(item));
-        }
-      }
+    for (var item in data['buses'] ?? []) {
+      scored.add(MapEntry(item['score'] ?? 0, SearchResult.fromBus(item)));
     }
-
-    // خطوط الباصات
-    if (data['bus_lines'] != null) {
-      for (var item in data['bus_lines']) {
-        if (_matchesQuery(item['route_name'], query)) {
-          results.add(SearchResult.fromBusLine(item));
-        }
-      }
+    for (var item in data['bus_lines'] ?? []) {
+      scored.add(MapEntry(item['score'] ?? 0, SearchResult.fromBusLine(item)));
     }
 
-    return results;
-  }
-
-  /// معالجة فئة محددة
-  List<SearchResult> _parseCategory(
-    dynamic data,
-    SearchCategory category,
-    String query,
-  ) {
-    final List<SearchResult> results = [];
-
-    if (data is List) {
-      for (var item in data) {
-        bool matches = false;
-        SearchResult? result;
-
-        switch (category) {
-          case SearchCategory.busStops:
-            matches = _matchesQuery(item['stop_name'], query);
-            if (matches) result = SearchResult.fromBusStop(item);
-            break;
-          case SearchCategory.buses:
-            matches = _matchesQuery(item['license_plate'], query);
-            if (matches) result = SearchResult.fromBus(item);
-            break;
-          case SearchCategory.busLines:
-            matches = _matchesQuery(item['route_name'], query);
-            if (matches) result = SearchResult.fromBusLine(item);
-            break;
-          default:
-            break;
-        }
-
-        if (result != null) {
-          results.add(result);
-        }
-      }
-    }
-
-    return results;
+    // ترتيب ثابت: الأعلى درجة أولاً مع الحفاظ على ترتيب السيرفر عند التساوي
+    final indexed = scored.asMap().entries.toList()
+      ..sort((a, b) {
+        final byScore = b.value.key.compareTo(a.value.key);
+        return byScore != 0 ? byScore : a.key.compareTo(b.key);
+      });
+    return indexed.map((entry) => entry.value.value).toList();
   }
 
   /// تحقق من تطابق النص مع الاستعلام
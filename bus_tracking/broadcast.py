@@ -0,0 +1,369 @@
+# bus_tracking/broadcast.py
+"""
+Producer side of the live location pipeline.
+
+Location ingest calls ``broadcast_bus_location`` once per accepted fix. The
+state is recorded in the live state store and pushed to:
+- ``bus_locations``: clients that want the whole fleet (default)
+- ``bus_cell_<row>_<col>``: clients whose viewport covers the bus's grid cell
+
+Fixes are not sent one by one. The ``BroadcastScheduler`` keeps the latest
+state per bus for each group and, every tick, emits a single
+``bus_locations_batch`` message per group (latest wins). Setting
+``BUS_TRACKING_BROADCAST_TICK_MS = 0`` restores one message per fix.
+Messages are serialized here, once, rather than in every consumer: a batch
+carries only the ready-made batch frame (``text``), which batch clients get
+as-is. The per-bus legacy frames and the fixed-point records for the
+compact/binary formats are rebuilt from it once per process (see
+``message_entries``) instead of travelling in the message: the channel layer
+copies or serializes each message for every subscriber, so every extra
+field is paid per client. The producer's ``origin`` travels along so other
+processes can keep their live state store current: ``LiveStateFollower``
+subscribes once per process to the fleet group for that.
+Every group message carries a sequence number (``seq``) and is kept in the
+per-topic history so reconnecting clients can resume (see ``history.py``).
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import fastjson
+from .history import history
+from .live_state import live_state
+from .spatial import cell_for, cell_group_name
+from .wire import quantize_state
+
+logger = logging.getLogger(__name__)
+
+FLEET_GROUP = 'bus_locations'
+
+# Group messages whose frames/records are kept decoded; every consumer of a
+# process receives the same few recent messages, only the first decodes them
+DECODED_MESSAGES = 64
+
+
+def broadcast_tick_seconds() -> float:
+    return max(0, int(getattr(settings, 'BUS_TRACKING_BROADCAST_TICK_MS', 500))) / 1000.0
+
+
+class BroadcastScheduler:
+    """
+    Coalesces bus states per group and flushes them on a fixed tick.
+
+    ``publish`` is thread-safe and cheap (a dict assignment), so it can be
+    called from sync views. The flush loop runs as a task on the ASGI server's
+    event loop; it is started by the first WebSocket consumer that connects.
+    """
+
+    def __init__(self, tick_seconds: Optional[float] = None, channel_layer=None):
+        self._tick_seconds = tick_seconds
+        self._channel_layer = channel_layer
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[int, dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.frames_sent = 0
+
+    @property
+    def tick_seconds(self) -> float:
+        if self._tick_seconds is None:
+            return broadcast_tick_seconds()
+        return self._tick_seconds
+
+    @property
+    def channel_layer(self):
+        return self._channel_layer or get_channel_layer()
+
+    def publish(self, groups: Iterable[str], state: dict) -> None:
+        bus_id = state['bus_id']
+        with self._lock:
+            for group in groups:
+                self._pending.setdefault(group, {})[bus_id] = state
+
+    def is_running(self) -> bool:
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._loop is not None
+            and self._loop.is_running()
+        )
+
+    async def ensure_running(self) -> None:
+        """
+        Starts the flush loop on the current event loop if it is not running.
+        """
+        if self.is_running() or self.tick_seconds <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._loop = None
+
+    async def flush(self) -> int:
+        """
+        Sends one batch per group with everything published since the last
+        flush. Returns the number of group messages sent.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        channel_layer = self.channel_layer
+        if not channel_layer:
+            return 0
+
+        # The same state object usually sits in several groups (fleet + cell)
+        encoded = {}
+        sent = 0
+        for group, states in pending.items():
+            try:
+                message = batch_message(list(states.values()), encoded, seq=history.next_seq())
+                history.record(group, message)
+                await channel_layer.group_send(group, message)
+                sent += 1
+            except Exception as e:
+                logger.error(f"WebSocket batch broadcast error for group {group}: {e}")
+        self.frames_sent += sent
+        return sent
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Broadcast scheduler flush failed: {e}")
+
+
+scheduler = BroadcastScheduler()
+
+
+class LiveStateFollower:
+    """
+    Applies the fleet broadcasts of other processes to this process's live
+    state store.
+
+    A single channel per process subscribes to ``bus_locations``, so each
+    message is applied once however many clients are connected. Like the
+    scheduler, it runs on the ASGI server's event loop and is started by the
+    first WebSocket consumer or SSE stream.
+    """
+
+    def __init__(self, channel_layer=None):
+        self._channel_layer = channel_layer
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.applied = 0
+
+    @property
+    def channel_layer(self):
+        return self._channel_layer or get_channel_layer()
+
+    def is_running(self) -> bool:
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._loop is not None
+            and self._loop.is_running()
+        )
+
+    async def ensure_running(self) -> None:
+        if self.is_running() or not self.channel_layer:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._loop = None
+
+    async def _run(self) -> None:
+        channel_layer = self.channel_layer
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(FLEET_GROUP, channel)
+        try:
+            while True:
+                message = await channel_layer.receive(channel)
+                if message.get('origin') == live_state.origin:
+                    continue
+                try:
+                    self.applied += live_state.apply_states(message_states(message))
+                except Exception as e:
+                    logger.error(f"Live state follower failed to apply a broadcast: {e}")
+        finally:
+            try:
+                await channel_layer.group_discard(FLEET_GROUP, channel)
+            except Exception as e:
+                logger.error(f"Live state follower cleanup error: {e}")
+
+
+follower = LiveStateFollower()
+
+
+def _seq_field(seq: Optional[int]) -> str:
+    return '' if seq is None else '"seq": ' + str(seq) + ', '
+
+
+def update_frame(data_json: str, seq: Optional[int] = None) -> str:
+    """
+    Legacy ``bus_location_update`` frame around an already encoded state.
+    """
+    return '{"type": "bus_location_update", ' + _seq_field(seq) + '"data": ' + data_json + '}'
+
+
+def frame_data_json(frame: str) -> str:
+    """
+    The encoded state inside a frame built by ``update_frame``.
+    """
+    return frame[frame.index('"data": ') + len('"data": '):-1]
+
+
+def batch_frame(data_json: List[str], seq: Optional[int] = None) -> str:
+    """
+    ``bus_locations_batch`` frame around already encoded states.
+    """
+    return '{"type": "bus_locations_batch", ' + _seq_field(seq) + '"updates": [' + ', '.join(data_json) + ']}'
+
+
+def batch_message(updates: List[dict], encoded: Optional[dict] = None, seq: Optional[int] = None) -> dict:
+    """
+    Builds a pre-serialized ``bus_locations_batch`` channel-layer message.
+
+    ``encoded`` memoizes the state json per state object across the groups
+    of one flush, so each state is encoded exactly once.
+    """
+    if encoded is None:
+        encoded = {}
+    data_json = []
+    for state in updates:
+        text = encoded.get(id(state))
+        if text is None:
+            text = encoded[id(state)] = fastjson.dumps(state)
+        data_json.append(text)
+    return {
+        'type': 'bus_locations_batch',
+        'seq': seq,
+        'text': batch_frame(data_json, seq),
+        'origin': live_state.origin,
+    }
+
+
+_decoded: "OrderedDict[Tuple[str, str], Tuple[List[dict], list]]" = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def message_states(message: dict) -> List[dict]:
+    """
+    The bus states carried by a group message. Shared between callers:
+    treat them as read-only.
+    """
+    return _decode(message)[0]
+
+
+def message_entries(message: dict) -> list:
+    """
+    ``(bus_id, (legacy frame, record))`` for every update in a group
+    message, as consumed by WebSocket and SSE clients.
+    """
+    return _decode(message)[1]
+
+
+def _decode(message: dict) -> Tuple[List[dict], list]:
+    # Keyed on the frame text itself: it is always present and identifies
+    # the content, whatever process or seq the message came from
+    text = message.get('text')
+    if not text:
+        return _decode_message(message)
+    key = (message.get('type'), text)
+    with _decoded_lock:
+        decoded = _decoded.get(key)
+    if decoded is None:
+        decoded = _decode_message(message)
+        with _decoded_lock:
+            _decoded[key] = decoded
+            if len(_decoded) > DECODED_MESSAGES:
+                _decoded.popitem(last=False)
+    return decoded
+
+
+def _decode_message(message: dict) -> Tuple[List[dict], list]:
+    seq = message.get('seq')
+    if message.get('type') == 'bus_location_update':
+        data = message.get('data', {})
+        text = message.get('text') or json.dumps({'type': 'bus_location_update', 'data': data})
+        record = quantize_state(data)
+        return [data], [(record[0], (text, record))]
+
+    if message.get('text'):
+        states = fastjson.loads(message['text'])['updates']
+    else:
+        states = message.get('updates', [])
+    entries = []
+    for state in states:
+        record = quantize_state(state)
+        entries.append((record[0], (update_frame(fastjson.dumps(state), seq), record)))
+    return states, entries
+
+
+def broadcast_bus_location(state: dict) -> None:
+    """
+    Records the bus state and queues it for every interested group.
+    Errors are logged, never raised: a broadcast failure must not fail ingest.
+    """
+    previous_cell = live_state.update(state)
+    cell = cell_for(state['latitude'], state['longitude'])
+
+    groups = [FLEET_GROUP, cell_group_name(cell)]
+    if previous_cell is not None and previous_cell != cell:
+        # Viewers of the old cell need to see the bus leave it.
+        groups.append(cell_group_name(previous_cell))
+
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+
+    try:
+        if scheduler.tick_seconds <= 0:
+            seq = history.next_seq()
+            message = {'type': 'bus_location_update', 'seq': seq, 'data': state,
+                       'text': update_frame(fastjson.dumps(state), seq), 'origin': live_state.origin}
+            for group in groups:
+                history.record(group, message)
+            async_to_sync(_send_to_groups)(channel_layer, groups, message)
+            return
+
+        scheduler.publish(groups, state)
+        if not scheduler.is_running():
+            # No flush loop in this process (e.g. a plain WSGI worker, or no
+            # WebSocket client has connected yet): deliver right away.
+            async_to_sync(scheduler.flush)()
+    except Exception as e:
+        logger.error(f"WebSocket broadcast error for bus {state.get('bus_id')}: {e}")
+
+
+async def _send_to_groups(channel_layer, groups, message):
+    for group in groups:
+        await channel_layer.group_send(group, message)
@@ -1,14 +1,33 @@
 # bus_tracking/consumers.py
 
-import json
+import asyncio
+import itertools
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from rest_framework.authtoken.models import Token
-from django.contrib.auth.models import User
+from django.conf import settings
+
+from . import fastjson
+from .broadcast import FLEET_GROUP, batch_frame, follower, frame_data_json, message_entries, scheduler
+from .history import history
+from .live_state import live_state
+from .outbox import Outbox, stats as outbox_stats
+from .spatial import bbox_cell_count, cells_for_bbox, cell_group_name, parse_bbox
+from .wire import FORMAT_VERBOSE, DeltaEncoder, negotiate_format, quantize_state, quantize_states
 
 logger = logging.getLogger(__name__)
 
+# Per-message logging on the fan-out path is sampled: with N clients every
+# broadcast would otherwise produce N log lines.
+_LOG_SAMPLE_EVERY = max(1, int(getattr(settings, 'BUS_TRACKING_LOG_SAMPLE_EVERY', 1000)))
+_log_counter = itertools.count()
+
+
+def _log_sampled(msg, *args):
+    if next(_log_counter) % _LOG_SAMPLE_EVERY == 0 and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args)
+
 
 class BusLocationConsumer(AsyncWebsocketConsumer):
     """
@@ -19,9 +38,37 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
     - Secure WebSocket (wss://) support
     - Real-time bus location broadcasting
     - Group-based message routing (bus_locations group)
+    - Viewport subscriptions: after ``set_viewport`` the client only receives
+      buses inside its bounding box (grid cell groups instead of bus_locations)
+    - Batched delivery: updates are coalesced server-side every broadcast tick.
+      Clients connecting with ``?batch=1`` receive one ``bus_locations_batch``
+      frame per tick; older clients still get one ``bus_location_update`` per bus.
+    - Wire formats: ``?format=compact`` (short-key JSON deltas) or
+      ``?format=binary`` (packed binary deltas), see ``bus_tracking/wire.py``.
+      Verbose JSON stays the default.
+    - Snapshots: right after connecting (and after every subscription change)
+      the client receives the current state of the buses it now follows, read
+      from the live state store, so it can render without extra HTTP calls.
+      ``?snapshot=0`` disables the connect snapshot; ``?bbox=s,w,n,e`` sets a
+      viewport at connect time so only that area is sent.
+    - Backpressure: group handlers only queue updates in a per-connection
+      outbox (latest state per bus, bounded); a writer task sends them as fast
+      as the client accepts. A lagging client gets fewer, fresher updates
+      instead of a growing backlog, and is disconnected (code 4008) once an
+      update has been waiting longer than ``BUS_TRACKING_STALL_TIMEOUT``.
+      How fast the client "accepts" is only visible under an ASGI server
+      whose send waits for the socket (uvicorn); under Daphne, clients
+      connecting with ``?ack=1`` send ``{"type": "ack", "seq": <seq>}`` for
+      what they received, and at most ``BUS_TRACKING_ACK_WINDOW`` frames
+      stay unacknowledged.
+    - Resume: every update and snapshot carries ``seq``. Reconnecting with
+      ``?resume_from=<highest seq seen>`` replays only the missed updates
+      (after a ``resumed`` message); if they are no longer in the server's
+      history the client gets the usual snapshot instead.
     
     Connection URL: wss://api.example.com/ws/bus-locations/
     Header: Authorization: Token <user-token>
+    (resolved to scope['user'] by bus_tracking.middleware.TokenAuthMiddleware)
     """
 
     async def connect(self):
@@ -29,23 +76,22 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         Handle WebSocket connection with authentication.
         Client يجب يرسل token في الـ headers أو URL.
         """
+        self.viewport_cells = None  # None = whole fleet (bus_locations group)
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.wire_format = negotiate_format(params.get('format', [None])[0])
+        self.encoder = DeltaEncoder(self.wire_format) if self.wire_format != FORMAT_VERBOSE else None
+        self.batch_frames = params.get('batch', ['0'])[0] in ('1', 'true')
+        ack_window = 0
+        if params.get('ack', ['0'])[0] in ('1', 'true'):
+            ack_window = max(1, int(getattr(settings, 'BUS_TRACKING_ACK_WINDOW', 4)))
+        self.outbox = Outbox(getattr(settings, 'BUS_TRACKING_OUTBOX_MAX_BUSES', 2000), ack_window)
+        self.writer_task = None
+        self.stalled = False
         try:
-            # الحصول على token من الـ query params أو headers
-            token = self.scope.get('query_string', b'').decode().split('token=')[-1] if 'token=' in self.scope.get('query_string', b'').decode() else None
-            
-            if not token:
-                # محاولة الحصول من headers
-                headers = dict(self.scope.get('headers', []))
-                auth_header = headers.get(b'authorization', b'').decode()
-                if auth_header.startswith('Bearer '):
-                    token = auth_header.split(' ')[1]
-                elif auth_header.startswith('Token '):
-                    token = auth_header.split(' ')[1]
-            
-            # التحقق من token (optional in development)
-            if token and await self.authenticate_token(token):
-                # إضافة المستخدم للنطاق
-                self.user = await self.get_user_from_token(token)
+            # المصادقة تتم في TokenAuthMiddleware (token من الـ query params أو headers)
+            user = self.scope.get('user')
+            if user is not None and user.is_authenticated:
+                self.user = user
                 logger.info(f"WebSocket connected for user: {self.user.username}")
             else:
                 # Allow anonymous connections in development
@@ -54,10 +100,29 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
             
             # قبول الاتصال
             await self.accept()
+            self.writer_task = asyncio.ensure_future(self.write_outbox())
+            outbox_stats['connections'] += 1
             
             # الانضمام إلى مجموعة bus_locations
-            await self.channel_layer.group_add('bus_locations', self.channel_name)
+            await self.channel_layer.group_add(FLEET_GROUP, self.channel_name)
             logger.info(f"Client joined bus_locations group")
+
+            # Make sure the coalescing flush loop and the live state follower
+            # run on this server's event loop
+            await scheduler.ensure_running()
+            await follower.ensure_running()
+
+            # Initial state: viewport from ?bbox= or the whole fleet,
+            # as missed updates when resuming or else as a snapshot
+            bbox = params.get('bbox', [None])[0]
+            resume_from = params.get('resume_from', [None])[0]
+            if bbox:
+                await self.set_viewport(bbox.split(','), resume_from=resume_from)
+            elif resume_from is not None:
+                if not await self.resume(resume_from):
+                    await self.send_fleet_snapshot()
+            elif params.get('snapshot', ['1'])[0] not in ('0', 'false'):
+                await self.send_fleet_snapshot()
             
         except Exception as e:
             logger.error(f"Connection error: {str(e)}")
@@ -67,9 +132,19 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         """
         Handle WebSocket disconnection and cleanup.
         """
+        writer_task = getattr(self, 'writer_task', None)
+        if writer_task is not None:
+            writer_task.cancel()
+            self.writer_task = None
+            self.outbox.close()
+            outbox_stats['connections'] -= 1
         try:
             # مغادرة المجموعة
-            await self.channel_layer.group_discard('bus_locations', self.channel_name)
+            if getattr(self, 'viewport_cells', None) is None:
+                await self.channel_layer.group_discard(FLEET_GROUP, self.channel_name)
+            else:
+                for cell in self.viewport_cells:
+                    await self.channel_layer.group_discard(cell_group_name(cell), self.channel_name)
             logger.info(f"User {getattr(self, 'user', 'Unknown')} disconnected (code: {close_code})")
         except Exception as e:
             logger.error(f"Disconnect error: {str(e)}")
@@ -80,72 +155,255 @@ class BusLocationConsumer(AsyncWebsocketConsumer):
         يمكن استخدامه للمستقبل (مثلاً: subscribe to specific bus)
         """
         try:
-            data = json.loads(text_data)
+            data = fastjson.loads(text_data)
             message_type = data.get('type')
             
             if message_type == 'subscribe_bus':
                 # Subscribe to specific bus updates
                 bus_id = data.get('bus_id')
                 await self.channel_layer.group_add(f'bus_{bus_id}', self.channel_name)
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=fastjson.dumps({
                     'type': 'subscription_confirmed',
                     'bus_id': bus_id
                 }))
-                logger.info(f"User {self.user.username} subscribed to bus {bus_id}")
+                await self.send_bus_snapshot(bus_id)
+                logger.info(f"User {self.user} subscribed to bus {bus_id}")
             
+            elif message_type == 'set_viewport':
+                await self.set_viewport(data.get('bbox'))
+
+            elif message_type == 'clear_viewport':
+                await self.clear_viewport()
+
+            elif message_type == 'ack':
+                # Flow control for ?ack=1 clients: frames up to seq arrived
+                seq = data.get('seq')
+                if isinstance(seq, int):
+                    self.outbox.acknowledge(seq)
+
             elif message_type == 'heartbeat':
                 # Simple heartbeat to keep connection alive
-                await self.send(text_data=json.dumps({'type': 'heartbeat_ack'}))
+                await self.send(text_data=fastjson.dumps({'type': 'heartbeat_ack'}))
             
             else:
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=fastjson.dumps({
                     'type': 'error',
                     'message': f'Unknown message type: {message_type}'
                 }))
-        except json.JSONDecodeError:
+        except fastjson.JSONDecodeError:
             logger.warning("Invalid JSON received from WebSocket")
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid JSON'}))
+            await self.send(text_data=fastjson.dumps({'type': 'error', 'message': 'Invalid JSON'}))
         except Exception as e:
             logger.error(f"Receive error: {str(e)}")
 
     async def bus_location_update(self, event):
         """
-        Receive message from group and send to WebSocket client.
+        Receive message from group and queue it for the WebSocket client.
         يتم استدعاؤها عند بث تحديث موقع الحافلة.
         """
         try:
-            logger.info(f"[Consumer] Sending bus location update to client: {event.get('data', {})}")
-            # إرسال البيانات إلى WebSocket
-            await self.send(text_data=json.dumps({
-                'type': 'bus_location_update',
-                'data': event.get('data', {})
-            }))
-            logger.info(f"[Consumer] Successfully sent update to client")
+            await self.queue_updates(event, message_entries(event))
         except Exception as e:
-            logger.error(f"Error sending location update: {str(e)}")
+            logger.error(f"Error queueing location update: {str(e)}")
+
+    async def bus_locations_batch(self, event):
+        """
+        Receive a coalesced batch (latest state per bus) from a group.
+        The producer has already serialized every variant of the frame.
+        """
+        try:
+            await self.queue_updates(event, message_entries(event))
+        except Exception as e:
+            logger.error(f"Error queueing location batch: {str(e)}")
+
+    # =====================================================================
+    # Outbox (per-connection backpressure)
+    # =====================================================================
+
+    async def queue_updates(self, event, entries):
+        if self.stalled:
+            return
+        self.outbox.put_message(event, entries)
+        stall_timeout = getattr(settings, 'BUS_TRACKING_STALL_TIMEOUT', 30)
+        if stall_timeout and self.outbox.stalled_for() > stall_timeout:
+            self.stalled = True
+            outbox_stats['stalled_disconnects'] += 1
+            logger.warning(
+                f"Closing stalled WebSocket for user {self.user}: "
+                f"{len(self.outbox)} buses pending, {self.outbox.dropped} dropped"
+            )
+            await self.close(code=4008)  # Custom close code: Client too slow
+
+    async def write_outbox(self):
+        """
+        Writer task: sends pending updates as fast as the client takes them.
+        """
+        while True:
+            message, entries, seq = await self.outbox.take()
+            try:
+                await self.deliver(message, entries, seq)
+                _log_sampled("[Consumer] Sent %s updates to client (%s format)", len(entries), self.wire_format)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error sending location updates: {str(e)}")
+            self.outbox.sent(seq)
+
+    async def deliver(self, message, entries, seq=None):
+        """
+        Send queued updates in the client's format. ``message`` is the group
+        message they came from when nothing was coalesced, so its ready-made
+        frame can be forwarded untouched.
+        """
+        if self.encoder:
+            await self.send_frame(self.encoder.encode([record for _, record in entries], seq))
+        elif self.batch_frames:
+            if message is not None and message.get('text'):
+                await self.send(text_data=message['text'])
+            else:
+                await self.send(text_data=batch_frame([frame_data_json(text) for text, _ in entries], seq))
+        else:
+            for text, _ in entries:
+                await self.send(text_data=text)
+
+    async def send_frame(self, frame):
+        """
+        Send an encoded compact (text) or binary (bytes) frame, if any.
+        """
+        if frame is None:
+            return
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
     # =====================================================================
-    # Helper Methods
+    # Viewport Subscriptions
     # =====================================================================
 
-    @database_sync_to_async
-    def authenticate_token(self, token: str) -> bool:
+    async def set_viewport(self, bbox, resume_from=None):
         """
-        التحقق من صحة الـ token (Token-based authentication).
+        Replace the client's subscription with the grid cells covering ``bbox``
+        and send a snapshot of buses in the cells that just became visible
+        (or, when resuming, the updates missed in those cells).
         """
         try:
-            Token.objects.get(key=token)
-            return True
-        except Token.DoesNotExist:
-            return False
+            south, west, north, east = parse_bbox(bbox)
+        except ValueError as e:
+            await self.send(text_data=fastjson.dumps({'type': 'error', 'message': str(e)}))
+            return
 
-    @database_sync_to_async
-    def get_user_from_token(self, token: str) -> User:
+        max_cells = getattr(settings, 'BUS_TRACKING_MAX_VIEWPORT_CELLS', 400)
+        if bbox_cell_count(south, west, north, east) > max_cells:
+            # Zoomed out too far for cell routing to pay off: stream the whole fleet.
+            await self.clear_viewport(resume_from=resume_from)
+            return
+
+        new_cells = cells_for_bbox(south, west, north, east)
+        old_cells = self.viewport_cells
+        if old_cells is None:
+            await self.channel_layer.group_discard(FLEET_GROUP, self.channel_name)
+            old_cells = set()
+
+        added = new_cells - old_cells
+        for cell in added:
+            await self.channel_layer.group_add(cell_group_name(cell), self.channel_name)
+        for cell in old_cells - new_cells:
+            await self.channel_layer.group_discard(cell_group_name(cell), self.channel_name)
+        self.viewport_cells = new_cells
+
+        if resume_from is not None and await self.resume(resume_from):
+            return
+
+        await self.ensure_live_state()
+        seq = history.last_seq
+        buses = live_state.snapshot(added)
+        self.outbox.discard(bus['bus_id'] for bus in buses)
+        if self.encoder:
+            await self.send_frame(self.encoder.encode(quantize_states(buses), seq))
+            return
+        await self.send(text_data=fastjson.dumps({
+            'type': 'viewport_snapshot',
+            'seq': seq,
+            'bbox': [south, west, north, east],
+            'buses': buses,
+        }))
+
+    async def clear_viewport(self, resume_from=None):
         """
-        الحصول على المستخدم من الـ token.
+        Drop any viewport and go back to receiving the whole fleet.
+        """
+        if self.viewport_cells is not None:
+            for cell in self.viewport_cells:
+                await self.channel_layer.group_discard(cell_group_name(cell), self.channel_name)
+            await self.channel_layer.group_add(FLEET_GROUP, self.channel_name)
+            self.viewport_cells = None
+        await self.send(text_data=fastjson.dumps({'type': 'viewport_cleared'}))
+        if resume_from is None or not await self.resume(resume_from):
+            await self.send_fleet_snapshot()
+
+    # =====================================================================
+    # Snapshots
+    # =====================================================================
+    # Compact/binary clients get snapshots as ordinary delta frames: buses
+    # they have not seen yet arrive with every field. A snapshot supersedes
+    # any update still pending in the outbox for the same buses.
+
+    async def ensure_live_state(self):
+        if not live_state.loaded:
+            await database_sync_to_async(live_state.ensure_loaded)()
+
+    async def send_fleet_snapshot(self):
+        await self.ensure_live_state()
+        seq = history.last_seq
+        self.outbox.discard()
+        if self.encoder:
+            await self.send_frame(self.encoder.encode(quantize_states(live_state.snapshot()), seq))
+            return
+        await self.send(text_data=(
+            '{"type": "fleet_snapshot", "seq": ' + str(seq)
+            + ', "buses": ' + live_state.snapshot_json() + '}'
+        ))
+
+    async def send_bus_snapshot(self, bus_id):
+        try:
+            bus_id = int(bus_id)
+        except (TypeError, ValueError):
+            return
+        await self.ensure_live_state()
+        seq = history.last_seq
+        state = live_state.get(bus_id)
+        if state is None:
+            return
+        self.outbox.discard([bus_id])
+        if self.encoder:
+            await self.send_frame(self.encoder.encode([quantize_state(state)], seq))
+            return
+        await self.send(text_data=fastjson.dumps({'type': 'bus_snapshot', 'seq': seq, 'buses': [state]}))
+
+    async def resume(self, resume_from):
+        """
+        Queue the updates missed since ``resume_from`` on the groups this
+        connection follows. Returns False (nothing sent) when the history
+        cannot cover the gap and a snapshot is needed instead.
         """
         try:
-            token_obj = Token.objects.get(key=token)
-            return token_obj.user
-        except Token.DoesNotExist:
-            return None
\ No newline at end of file
+            resume_from = int(resume_from)
+        except (TypeError, ValueError):
+            return False
+        if self.viewport_cells is None:
+            topics = [FLEET_GROUP]
+        else:
+            topics = [cell_group_name(cell) for cell in self.viewport_cells]
+        missed = history.since(topics, resume_from)
+        if missed is None:
+            return False
+
+        await self.send(text_data=fastjson.dumps({
+            'type': 'resumed',
+            'resume_from': resume_from,
+            'missed': len(missed),
+        }))
+        for message in missed:
+            self.outbox.put_message(message, message_entries(message))
+        return True
@@ -0,0 +1,95 @@
+# bus_tracking/fastjson.py
+"""
+Fast JSON encoding for high-volume responses and live frames.
+
+Uses orjson when it is installed (``pip install orjson``) and falls back to
+the standard library otherwise, with the same output apart from whitespace:
+``dumps`` always produces compact JSON (no spaces after ``,`` and ``:``).
+
+- ``dumps`` / ``loads``: drop-in for ``json.dumps`` / ``json.loads`` in the
+  WebSocket consumer and the broadcast pipeline.
+- ``FastJSONRenderer`` / ``FastJSONParser``: DRF renderer and parser, set as
+  defaults in ``REST_FRAMEWORK`` (settings.py). Indented output (browsable
+  API, ``; indent=`` in Accept) still goes through DRF's own renderer.
+
+Types orjson does not know (Decimal, lazy translation strings, ...) are
+converted by DRF's encoder, as with the stdlib path.
+"""
+
+import json
+from typing import Any
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError is a subclass
+
+_drf_encoder = JSONEncoder()
+_stdlib_encoder = JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_drf_encoder.default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits: let the stdlib try (or raise TypeError)
+            return _stdlib_encoder.encode(obj).encode()
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode()
+
+    loads = orjson.loads
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return _stdlib_encoder.encode(obj).encode()
+
+    def dumps(obj: Any) -> str:
+        return _stdlib_encoder.encode(obj)
+
+    loads = json.loads
+
+
+def is_available() -> bool:
+    return orjson is not None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson (compact) when available.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = dumps_bytes(data)
+        # Like JSONRenderer: keep the output safe to embed in <script>
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that decodes UTF-8 bodies with orjson when available.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
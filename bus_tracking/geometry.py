@@ -0,0 +1,143 @@
+# bus_tracking/geometry.py
+"""
+Route geometry helpers: line simplification and encoded polylines.
+
+Route segments store their road geometry as ``[lat, lon]`` points (used for
+projecting buses onto the route). For drawing, clients get Google encoded
+polylines (precision 5, ~1 m) instead: a few bytes per point and a fast
+decoder on every platform. Each segment keeps one encoding per zoom level in
+``RouteSegment.encoded_polylines``, simplified with Douglas-Peucker to about
+half a screen pixel at that zoom, so they are computed once per segment save
+and never per request.
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence
+
+import polyline
+
+EARTH_RADIUS_M = 6371000.0
+
+# Zoom levels with a simplified encoding; anything above the last one gets
+# the full geometry ("full")
+GEOMETRY_ZOOMS = (10, 12, 14)
+FULL_LEVEL = 'full'
+
+# initial-data ships street-level geometry; /api/bus-lines/<id>/geometry/
+# serves the other levels
+SNAPSHOT_ZOOM = 14
+
+
+def meters_per_pixel(zoom: int, lat: float) -> float:
+    """
+    Ground resolution of a 256 px Web Mercator tile at ``zoom`` and ``lat``.
+    """
+    return 156543.03392 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def simplify(points: Sequence[Sequence[float]], tolerance_m: float) -> List[Sequence[float]]:
+    """
+    Douglas-Peucker: drops every point closer than ``tolerance_m`` meters to
+    the simplified line. Endpoints are always kept.
+    """
+    return [points[index] for index in simplify_indexes(points, tolerance_m)]
+
+
+def simplify_indexes(points: Sequence[Sequence[float]], tolerance_m: float) -> List[int]:
+    """
+    Indexes of the points ``simplify`` keeps (to carry along per-point data
+    such as timestamps).
+    """
+    count = len(points)
+    if count < 3 or tolerance_m <= 0:
+        return list(range(count))
+
+    # Local equirectangular projection around the first point (meters)
+    ref_cos = math.cos(math.radians(points[0][0]))
+    xy = [
+        (math.radians(lon) * EARTH_RADIUS_M * ref_cos, math.radians(lat) * EARTH_RADIUS_M)
+        for lat, lon in (point[:2] for point in points)
+    ]
+    tolerance_sq = tolerance_m * tolerance_m
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay = xy[start]
+        bx, by = xy[end]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        max_dist_sq, index = -1.0, None
+        for i in range(start + 1, end):
+            px, py = xy[i]
+            if length_sq == 0:
+                dist_sq = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+                dist_sq = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if dist_sq > max_dist_sq:
+                max_dist_sq, index = dist_sq, i
+        if index is not None and max_dist_sq > tolerance_sq:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [index for index, kept in enumerate(keep) if kept]
+
+
+def encode(points: Sequence[Sequence[float]]) -> str:
+    return polyline.encode([(point[0], point[1]) for point in points])
+
+
+def decode(encoded: str) -> List[List[float]]:
+    return [[lat, lon] for lat, lon in polyline.decode(encoded)]
+
+
+def encode_levels(points: Sequence[Sequence[float]]) -> Dict[str, str]:
+    """
+    ``{"10": ..., "12": ..., "14": ..., "full": ...}`` encodings of a segment.
+    """
+    if not points:
+        return {}
+    levels = {FULL_LEVEL: encode(points)}
+    lat = points[0][0]
+    for zoom in GEOMETRY_ZOOMS:
+        levels[str(zoom)] = encode(simplify(points, meters_per_pixel(zoom, lat) / 2))
+    return levels
+
+
+def bounding_box(points: Sequence[Sequence[float]]) -> Optional[List[float]]:
+    """
+    ``[min_lat, min_lon, max_lat, max_lon]`` of a segment, None without points.
+    """
+    if not points:
+        return None
+    lats = [point[0] for point in points]
+    lons = [point[1] for point in points]
+    return [min(lats), min(lons), max(lats), max(lons)]
+
+
+def level_for_zoom(zoom: Optional[int]) -> str:
+    """
+    Key of the coarsest stored encoding that is still detailed enough for ``zoom``.
+    """
+    if zoom is None:
+        return FULL_LEVEL
+    for level in GEOMETRY_ZOOMS:
+        if zoom <= level:
+            return str(level)
+    return FULL_LEVEL
+
+
+def parse_zoom(value) -> Optional[int]:
+    """
+    Parses a ``zoom`` query parameter (0-22). Raises ValueError on bad input.
+    """
+    if value in (None, ''):
+        return None
+    zoom = int(value)
+    if not 0 <= zoom <= 22:
+        raise ValueError('zoom must be between 0 and 22')
+    return zoom
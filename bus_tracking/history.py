@@ -0,0 +1,124 @@
+# bus_tracking/history.py
+"""
+Sequence numbers and recent-update history for resuming live streams.
+
+Every group message sent by the broadcast pipeline is stamped with a
+process-wide, monotonically increasing ``seq`` and kept in a ring buffer per
+topic (channel-layer group). A client that reconnects with
+``?resume_from=<seq>`` (the highest ``seq`` it saw) gets the messages it
+missed replayed from these buffers; if they no longer reach back that far it
+gets a snapshot instead.
+
+Sequence numbers follow the clock: each one is the current time in
+microseconds, or the previous one plus one if that is not above it, so they
+keep growing across restarts. Seqs of different processes still interleave,
+so ``since`` only honours a ``resume_from`` that this history issued: the
+seq it started at, the latest one, or the seq of a message still in one of
+its buffers. Anything else (a seq from an earlier process, from another
+worker behind the same load balancer, or long gone from the buffers) is
+refused rather than mistaken for a position in this history, and the client
+gets a snapshot instead.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+
+def resume_buffer_size() -> int:
+    return max(1, int(getattr(settings, 'BUS_TRACKING_RESUME_BUFFER', 120)))
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+class _Topic:
+    __slots__ = ('messages', 'floor')
+
+    def __init__(self, maxlen: int, floor: int):
+        self.messages = deque(maxlen=maxlen)
+        # Every message of this topic with seq <= floor is gone from the buffer
+        self.floor = floor
+
+
+class UpdateHistory:
+    """
+    Per-topic ring buffers of ``(seq, message)``.
+    """
+
+    def __init__(self, max_messages: Optional[int] = None, start: Optional[int] = None):
+        self._max_messages = max_messages
+        self._start = _now_us() if start is None else start
+        self._last_seq = self._start
+        self._topics: Dict[str, _Topic] = {}
+        # seq -> number of topic buffers holding its message (or it as their floor)
+        self._held: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self) -> int:
+        """
+        The most recently issued sequence number (what a snapshot is worth).
+        """
+        return self._last_seq
+
+    def next_seq(self) -> int:
+        with self._lock:
+            self._last_seq = max(self._last_seq + 1, _now_us())
+            return self._last_seq
+
+    def record(self, topic: str, message: dict) -> None:
+        """
+        Keeps a sent message (already stamped with ``seq``) for ``topic``.
+        """
+        seq = message['seq']
+        with self._lock:
+            entry = self._topics.get(topic)
+            if entry is None:
+                maxlen = self._max_messages or resume_buffer_size()
+                entry = self._topics[topic] = _Topic(maxlen, self._start)
+            if len(entry.messages) == entry.messages.maxlen:
+                # The evicted message's seq stays held as the new floor:
+                # resuming from it is still a full replay
+                self._release(entry.floor)
+                entry.floor = entry.messages[0][0]
+            entry.messages.append((seq, message))
+            self._held[seq] = self._held.get(seq, 0) + 1
+
+    def _release(self, seq: int) -> None:
+        count = self._held.pop(seq, 0) - 1
+        if count > 0:
+            self._held[seq] = count
+
+    def since(self, topics: Iterable[str], seq: int) -> Optional[List[dict]]:
+        """
+        Messages of ``topics`` with a sequence number above ``seq``, oldest
+        first. Returns None when they cannot all be replayed: ``seq`` was
+        not issued by this history (another process, the future), or a
+        buffer has already dropped part of the gap.
+        """
+        with self._lock:
+            if seq != self._start and seq != self._last_seq and seq not in self._held:
+                return None
+            missed = []
+            for topic in topics:
+                entry = self._topics.get(topic)
+                if entry is None:
+                    continue  # nothing sent to this topic since start
+                if seq < entry.floor:
+                    return None
+                missed.extend(item for item in entry.messages if item[0] > seq)
+        missed.sort(key=lambda item: item[0])
+        return [message for _, message in missed]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._topics.clear()
+            self._held.clear()
+
+
+history = UpdateHistory()
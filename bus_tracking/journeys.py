@@ -0,0 +1,295 @@
+# bus_tracking/journeys.py
+"""
+Journey planner: how to get from one stop to another by bus.
+
+    GET /api/journeys/?from=<stop_id>&to=<stop_id>[&max_transfers=<0-5, default 3>]
+
+Round-based search in the style of RAPTOR over a graph compiled from the
+network: each bus line is a route through its stops in ``BusLineStop`` order
+(a line runs in that direction only, as for the ETA), with the time between
+consecutive stops taken from ``RouteSegment.typical_duration_seconds``, else
+its ``distance_meters``, else the straight-line distance, at
+``DEFAULT_BUS_SPEED_KMH``. There are no timetables, so boarding a bus costs a
+fixed mean wait (``BUS_TRACKING_JOURNEY_BOARD_WAIT``). Walking transfers
+between stops up to ``BUS_TRACKING_JOURNEY_MAX_WALK`` meters apart are
+precomputed with the stop grid index (spatial.StopIndex).
+
+Round k finds the fastest arrival at every stop with at most k rides, so a
+query scans each line at most once per round instead of expanding
+``BusLineStop`` rows per request. The result is the Pareto set of journeys:
+the fastest one, and each journey with fewer rides that is still faster than
+all the ones with fewer rides than itself.
+
+The compiled graph is held per process and rebuilt when the network version
+changes and at least every ``BUS_TRACKING_NETWORK_INDEX_TTL`` seconds (see
+``network.index_is_current``).
+"""
+
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .network import index_is_current
+from .spatial import StopIndex
+
+DEFAULT_BUS_SPEED_KMH = 30.0
+WALK_SPEED_MS = 1.2  # ~4.3 km/h
+MAX_TRANSFERS = 5
+
+_INF = float('inf')
+
+
+def board_wait_seconds() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_JOURNEY_BOARD_WAIT', 300))
+
+
+def max_walk_meters() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_JOURNEY_MAX_WALK', 400))
+
+
+def _straight_line_m(lat1, lon1, lat2, lon2) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2)
+    return 2 * 6371000.0 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class _Route:
+    __slots__ = ('line_id', 'name', 'stops', 'times')
+
+    def __init__(self, line_id, name, stops, times):
+        self.line_id = line_id
+        self.name = name
+        self.stops = stops  # stop positions in JourneyGraph.stop_ids
+        self.times = times  # cumulative seconds from the first stop
+
+
+class JourneyGraph:
+    """
+    Routes, per-stop route lists and walking transfers of one network version.
+
+    ``stops``: ``(stop_id, name, lat, lon)``; ``lines``: ``(line_id, name,
+    [stop_id, ...], [seconds between consecutive stops or None, ...])``.
+    """
+
+    def __init__(self, version: int, stops: Iterable[tuple], lines: Iterable[tuple],
+                 board_wait: Optional[int] = None, max_walk: Optional[int] = None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.board_wait = board_wait if board_wait is not None else board_wait_seconds()
+        max_walk = max_walk if max_walk is not None else max_walk_meters()
+
+        self.stop_ids: List[int] = []
+        self.stop_names: List[str] = []
+        self.position: Dict[int, int] = {}
+        coords = []
+        for stop_id, name, lat, lon in stops:
+            if lat is None or lon is None:
+                continue
+            self.position[stop_id] = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+            self.stop_names.append(name)
+            coords.append((lat, lon))
+
+        speed_ms = DEFAULT_BUS_SPEED_KMH / 3.6
+        self.routes: List[_Route] = []
+        # stop position -> [(route index, index of the stop in the route), ...]
+        self.stop_routes: List[List[Tuple[int, int]]] = [[] for _ in self.stop_ids]
+        for line_id, name, stop_ids, seconds in lines:
+            stops_in_line = [self.position[stop_id] for stop_id in stop_ids if stop_id in self.position]
+            if len(stops_in_line) < 2 or len(stops_in_line) != len(stop_ids):
+                continue
+            times = [0.0]
+            for index, duration in enumerate(seconds):
+                if duration is None:
+                    (lat1, lon1), (lat2, lon2) = coords[stops_in_line[index]], coords[stops_in_line[index + 1]]
+                    duration = _straight_line_m(lat1, lon1, lat2, lon2) / speed_ms
+                times.append(times[-1] + duration)
+            route_index = len(self.routes)
+            self.routes.append(_Route(line_id, name, stops_in_line, times))
+            for index, stop in enumerate(stops_in_line):
+                self.stop_routes[stop].append((route_index, index))
+
+        # Walking transfers: stop position -> [(other stop position, seconds, meters), ...]
+        self.transfers: List[List[Tuple[int, float, float]]] = [[] for _ in self.stop_ids]
+        if max_walk > 0:
+            grid = StopIndex(version, ((pos, None, None, lat, lon) for pos, (lat, lon) in enumerate(coords)))
+            for pos, (lat, lon) in enumerate(coords):
+                self.transfers[pos] = [
+                    (row[0], distance / WALK_SPEED_MS, distance)
+                    for distance, row in grid.nearby(lat, lon, max_walk, len(coords))
+                    if row[0] != pos
+                ]
+
+    @classmethod
+    def load(cls, version: int) -> 'JourneyGraph':
+        from .models import BusLine, BusLineStop, BusStop, RouteSegment
+
+        stops = BusStop.objects.values_list('stop_id', 'stop_name', 'location__latitude', 'location__longitude')
+        segment_seconds = {}
+        for line_id, from_id, to_id, seconds, meters in RouteSegment.objects.values_list(
+                'bus_line_id', 'from_stop_id', 'to_stop_id', 'typical_duration_seconds', 'distance_meters'):
+            if seconds is None and meters:
+                seconds = meters / (DEFAULT_BUS_SPEED_KMH / 3.6)
+            segment_seconds[(line_id, from_id, to_id)] = seconds
+
+        line_stops: Dict[int, List[int]] = {}
+        for line_id, stop_id in BusLineStop.objects.order_by('bus_line_id', 'order', 'id').values_list(
+                'bus_line_id', 'bus_stop_id'):
+            line_stops.setdefault(line_id, []).append(stop_id)
+
+        lines = []
+        for line_id, name in BusLine.objects.values_list('route_id', 'route_name'):
+            stop_ids = line_stops.get(line_id, [])
+            lines.append((line_id, name, stop_ids, [
+                segment_seconds.get((line_id, a, b)) for a, b in zip(stop_ids, stop_ids[1:])
+            ]))
+        return cls(version, stops, lines)
+
+    # --- queries ---
+
+    def plan(self, from_stop_id: int, to_stop_id: int, max_transfers: int = 3) -> List[dict]:
+        """
+        Pareto-optimal journeys (fewer rides vs. faster), fastest last.
+        Raises KeyError for unknown stop ids.
+        """
+        origin, target = self.position[from_stop_id], self.position[to_stop_id]
+        rounds = max_transfers + 1
+        stop_count = len(self.stop_ids)
+
+        # arrival[k][s]: earliest arrival at s with at most k rides, walking included,
+        # and arrived_by[k][s] how it was set in round k (None: by ride, else the walk).
+        # ride_arrival[k][s]: arrival by a ride of round k; walks only start from
+        # those, so a stop reached earlier on foot still lets a ride walk on from it
+        arrival = [[_INF] * stop_count]
+        arrived_by: List[Dict[int, Optional[tuple]]] = [{} for _ in range(rounds + 1)]
+        ride_arrival: List[Dict[int, float]] = [{} for _ in range(rounds + 1)]
+        ride_parent: List[Dict[int, tuple]] = [{} for _ in range(rounds + 1)]
+        best = [_INF] * stop_count
+        best_ride = [_INF] * stop_count
+
+        ride_arrival[0][origin] = arrival[0][origin] = best[origin] = best_ride[origin] = 0.0
+        arrived_by[0][origin] = None
+        marked = {origin} | self._walk(0, [origin], arrival, arrived_by, ride_arrival, best, target)
+
+        for k in range(1, rounds + 1):
+            previous = arrival[k - 1]
+            current = previous[:]
+            arrival.append(current)
+            # Earliest index per route at which a stop improved last round
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                for route_index, index in self.stop_routes[stop]:
+                    if index < queue.get(route_index, len(self.routes[route_index].stops)):
+                        queue[route_index] = index
+            if not queue:
+                break
+
+            marked, rode = set(), set()
+            for route_index, start in queue.items():
+                route = self.routes[route_index]
+                times = route.times
+                boarded = None  # (index of the boarding stop, departure cost minus its offset)
+                for index in range(start, len(route.stops)):
+                    stop = route.stops[index]
+                    if boarded is not None:
+                        board_index, base = boarded
+                        arrive = base + times[index]
+                        if arrive < best_ride[stop] and arrive < best[target]:
+                            ride_arrival[k][stop] = best_ride[stop] = arrive
+                            ride_parent[k][stop] = (route_index, board_index, index)
+                            rode.add(stop)
+                            if arrive < best[stop]:
+                                current[stop] = best[stop] = arrive
+                                arrived_by[k][stop] = None
+                                marked.add(stop)
+                    if previous[stop] < _INF:
+                        base = previous[stop] + self.board_wait - times[index]
+                        if boarded is None or base < boarded[1]:
+                            boarded = (index, base)
+
+            marked |= self._walk(k, rode, arrival, arrived_by, ride_arrival, best, target)
+            if not marked:
+                break
+
+        journeys = []
+        fastest = _INF
+        for k in range(len(arrival)):
+            if arrival[k][target] < fastest:
+                fastest = arrival[k][target]
+                journeys.append(self._journey(k, origin, target, arrival, arrived_by, ride_parent))
+        return journeys
+
+    def _walk(self, k, sources, arrival, arrived_by, ride_arrival, best, target) -> set:
+        reached = set()
+        for stop in sources:
+            start = ride_arrival[k][stop]
+            for other, seconds, meters in self.transfers[stop]:
+                arrive = start + seconds
+                if arrive < best[other] and arrive < best[target]:
+                    arrival[k][other] = best[other] = arrive
+                    arrived_by[k][other] = (stop, seconds, meters)
+                    reached.add(other)
+        return reached
+
+    def _stop(self, position: int) -> dict:
+        return {'stop_id': self.stop_ids[position], 'stop_name': self.stop_names[position]}
+
+    def _journey(self, k, origin, target, arrival, arrived_by, ride_parent) -> dict:
+        legs = []
+        stop, total = target, arrival[k][target]
+        while stop != origin:
+            # A label may have been copied from an earlier round
+            while stop not in arrived_by[k]:
+                k -= 1
+            walk = arrived_by[k][stop]
+            if walk is not None:
+                from_stop, seconds, meters = walk
+                legs.append({
+                    'type': 'walk', 'from_stop': self._stop(from_stop), 'to_stop': self._stop(stop),
+                    'duration_s': round(seconds), 'distance_m': round(meters),
+                })
+                stop = from_stop
+                if stop == origin:
+                    break
+            route_index, board_index, alight_index = ride_parent[k][stop]
+            route = self.routes[route_index]
+            legs.append({
+                'type': 'ride',
+                'line': {'route_id': route.line_id, 'route_name': route.name},
+                'from_stop': self._stop(route.stops[board_index]),
+                'to_stop': self._stop(route.stops[alight_index]),
+                'stops': [self.stop_ids[position] for position in route.stops[board_index:alight_index + 1]],
+                'wait_s': self.board_wait,
+                'duration_s': round(route.times[alight_index] - route.times[board_index]),
+            })
+            stop, k = route.stops[board_index], k - 1
+        legs.reverse()
+        return {
+            'duration_s': round(total),
+            'rides': sum(1 for leg in legs if leg['type'] == 'ride'),
+            'legs': legs,
+        }
+
+
+_lock = threading.Lock()
+_graph: Optional[JourneyGraph] = None
+
+
+def get_graph(version: int) -> JourneyGraph:
+    """
+    The per-process JourneyGraph, rebuilt when the network version changes
+    and at least every ``BUS_TRACKING_NETWORK_INDEX_TTL`` seconds.
+    """
+    global _graph
+    graph = _graph
+    if index_is_current(graph, version):
+        return graph
+    with _lock:
+        if not index_is_current(_graph, version):
+            _graph = JourneyGraph.load(version)
+        return _graph
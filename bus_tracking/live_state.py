@@ -0,0 +1,185 @@
+# bus_tracking/live_state.py
+"""
+In-process store of the latest known state of every bus.
+
+The store is updated by the location ingest path before anything is broadcast,
+so WebSocket consumers can answer snapshot requests (e.g. when a map client
+pans to new cells) from memory instead of querying the database.
+
+Ingest may run in another process than the consumers (a WSGI worker, another
+ASGI server behind a shared channel layer). Every broadcast message therefore
+carries its producer's ``origin``, and one subscriber per process
+(``broadcast.LiveStateFollower``) hands the states of other processes'
+messages to ``apply_states`` so each process's store follows the fleet, not
+only the fixes it ingested itself.
+"""
+
+import threading
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from . import fastjson
+from .spatial import Cell, cell_for
+
+
+class LiveStateStore:
+    """
+    Latest state per bus, indexed by grid cell.
+
+    Each state is the same dict that is broadcast to clients
+    (bus_id, license_plate, latitude, longitude, speed, timestamp, ...).
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._buses: Dict[int, dict] = {}
+        self._bus_cell: Dict[int, Cell] = {}
+        self._cells: Dict[Cell, set] = defaultdict(set)
+        self._loaded = False
+        self._version = 0
+        self._snapshot_json = (-1, '[]')
+
+    def update(self, state: dict) -> Optional[Cell]:
+        """
+        Stores a new bus state. Returns the cell the bus was in before the
+        update (None if it was unknown) so callers can notify viewers of the
+        cell it just left.
+        """
+        with self._lock:
+            return self._store(state)
+
+    def apply_states(self, states: Iterable[dict]) -> int:
+        """
+        Stores states broadcast by another process. States older than the
+        stored one for the same bus are skipped. Returns the number stored.
+        """
+        applied = 0
+        with self._lock:
+            for state in states:
+                current = self._buses.get(state['bus_id'])
+                if (current is not None and current.get('timestamp') and state.get('timestamp')
+                        and state['timestamp'] < current['timestamp']):
+                    continue
+                self._store(state)
+                applied += 1
+        return applied
+
+    def _store(self, state: dict) -> Optional[Cell]:
+        bus_id = state['bus_id']
+        cell = cell_for(state['latitude'], state['longitude'])
+        previous_cell = self._bus_cell.get(bus_id)
+        if previous_cell is not None and previous_cell != cell:
+            self._discard_from_cell(bus_id, previous_cell)
+        self._buses[bus_id] = state
+        self._bus_cell[bus_id] = cell
+        self._cells[cell].add(bus_id)
+        self._version += 1
+        return previous_cell
+
+    def remove(self, bus_id: int) -> None:
+        with self._lock:
+            self._buses.pop(bus_id, None)
+            cell = self._bus_cell.pop(bus_id, None)
+            if cell is not None:
+                self._discard_from_cell(bus_id, cell)
+            self._version += 1
+
+    def get(self, bus_id: int) -> Optional[dict]:
+        with self._lock:
+            return self._buses.get(bus_id)
+
+    def snapshot(self, cells: Optional[Iterable[Cell]] = None) -> List[dict]:
+        """
+        Returns the current states, optionally restricted to the given cells.
+        """
+        with self._lock:
+            if cells is None:
+                return list(self._buses.values())
+            return [
+                self._buses[bus_id]
+                for cell in cells
+                for bus_id in self._cells.get(cell, ())
+            ]
+
+    def snapshot_json(self) -> str:
+        """
+        The whole fleet as a JSON array. The encoded text is reused until the
+        next update, so a burst of (re)connecting clients serializes it once.
+        """
+        with self._lock:
+            version, text = self._snapshot_json
+            if version == self._version:
+                return text
+            version = self._version
+            buses = list(self._buses.values())
+        text = fastjson.dumps(buses)
+        self._snapshot_json = (version, text)
+        return text
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buses.clear()
+            self._bus_cell.clear()
+            self._cells.clear()
+            self._loaded = False
+            self._version += 1
+
+    @property
+    def loaded(self) -> bool:
+        with self._lock:
+            return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """
+        Seeds the store from ``Bus.current_location`` the first time it is used,
+        so a freshly started process can serve snapshots before buses report.
+        Must be called from a sync context (it touches the ORM).
+        """
+        from .models import Bus
+
+        # One loader at a time; the query runs outside ``_lock`` so live
+        # updates are not held up by it
+        with self._load_lock:
+            with self._lock:
+                if self._loaded:
+                    return
+            buses = list(Bus.objects.select_related('current_location').filter(current_location__isnull=False))
+            with self._lock:
+                for bus in buses:
+                    if bus.bus_id in self._buses:
+                        # A live update arrived while we were loading; it wins.
+                        continue
+                    self._store(state_from_bus(bus))
+                self._loaded = True
+
+    def _discard_from_cell(self, bus_id: int, cell: Cell) -> None:
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(bus_id)
+            if not members:
+                del self._cells[cell]
+
+    def __len__(self):
+        return len(self._buses)
+
+
+def state_from_bus(bus, speed=None, timestamp=None) -> dict:
+    """
+    Builds the broadcast state for a bus from its current location.
+    """
+    location = bus.current_location
+    return {
+        'bus_id': bus.bus_id,
+        'license_plate': bus.license_plate,
+        'bus_line_id': bus.bus_line_id,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'speed': speed,
+        'timestamp': timestamp.isoformat() if timestamp else None,
+    }
+
+
+live_state = LiveStateStore()
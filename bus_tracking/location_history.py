@@ -0,0 +1,213 @@
+# bus_tracking/location_history.py
+"""
+Queries over the location history (``BusLocationLog``).
+
+The table grows by one row per position fix, so every read goes through
+``history_queryset``: filtered by bus and time range and ordered on
+``(bus, timestamp)``, which the ``bus_tracking_log_bus_ts_idx`` index serves
+directly. Rows are read as flat values (no Bus/Location instances).
+
+Exports (``iter_history`` + ``export_chunks``) walk the range in keyset
+batches instead of one big query: constant memory on every backend,
+including SQL Server, where mssql-django cannot stream a result set
+(``QuerySet.iterator()`` would still fetch every row at once).
+
+Tracks (``simplified_track``) are Douglas-Peucker-simplified paths for
+replay; the simplification of a past day never changes, so it is computed
+once per (bus, day, tolerance) and cached.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime, time, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import fastjson
+from .geometry import simplify_indexes
+from .models import Bus, BusLocationLog
+
+# Flat row layout shared by the history API and the exports
+HISTORY_FIELDS = ('id', 'bus_id', 'timestamp', 'latitude', 'longitude', 'speed')
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_BATCH_SIZE = 2000
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parses an ISO 8601 query parameter (naive values are in the server's
+    time zone). Raises ValueError on malformed input.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value.replace(' ', '+'))  # '+' arrives as ' ' when not URL-encoded
+    if parsed is None:
+        raise ValueError(f'Invalid timestamp: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_history_params(params) -> Tuple[Optional[int], Optional[datetime], Optional[datetime]]:
+    """
+    ``(bus_id, since, until)`` from ``?bus=&since=&until=``. Raises ValueError.
+    """
+    bus_id = params.get('bus')
+    if bus_id not in (None, ''):
+        try:
+            bus_id = int(bus_id)
+        except ValueError:
+            raise ValueError('bus must be a bus id')
+    else:
+        bus_id = None
+    since = parse_timestamp(params.get('since'))
+    until = parse_timestamp(params.get('until'))
+    if since and until and since > until:
+        raise ValueError('since must not be after until')
+    return bus_id, since, until
+
+
+def history_queryset(bus_id: Optional[int] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None):
+    """
+    Location logs of a bus (or all buses) with ``since <= timestamp < until``.
+    """
+    queryset = BusLocationLog.objects.all()
+    if bus_id is not None:
+        queryset = queryset.filter(bus_id=bus_id)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset
+
+
+def history_rows(queryset):
+    """
+    The queryset as flat dicts with ``HISTORY_FIELDS`` (one join with Location).
+    """
+    return queryset.annotate(
+        latitude=F('location__latitude'), longitude=F('location__longitude'),
+    ).values(*HISTORY_FIELDS)
+
+
+def iter_history(bus_id: Optional[int] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """
+    Every history row in the range, ordered by bus, timestamp and id, read
+    ``batch_size`` rows at a time (each batch is an index range scan that
+    starts after the last row of the previous one).
+    """
+    if bus_id is not None:
+        bus_ids = [bus_id]
+    else:
+        bus_ids = list(Bus.objects.order_by('bus_id').values_list('bus_id', flat=True))
+
+    for current_bus in bus_ids:
+        rows = history_rows(history_queryset(current_bus, since, until)).order_by('timestamp', 'id')
+        last = None
+        while True:
+            batch = rows
+            if last is not None:
+                batch = batch.filter(
+                    Q(timestamp__gt=last['timestamp']) | Q(timestamp=last['timestamp'], id__gt=last['id'])
+                )
+            batch = list(batch[:batch_size])
+            yield from batch
+            if len(batch) < batch_size:
+                break
+            last = batch[-1]
+
+
+def export_chunks(rows: Iterable[dict], fmt: str, rows_per_chunk: int = 500) -> Iterator[str]:
+    """
+    ``rows`` as NDJSON or CSV (with a header line), in chunks of
+    ``rows_per_chunk`` rows.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(EXPORT_FORMATS)}')
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n') if fmt == 'csv' else None
+    if writer:
+        writer.writerow(HISTORY_FIELDS)
+    count = 0
+    for row in rows:
+        row = dict(row, timestamp=row['timestamp'].isoformat())
+        if writer:
+            writer.writerow([row[field] for field in HISTORY_FIELDS])
+        else:
+            buffer.write(fastjson.dumps(row))
+            buffer.write('\n')
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """
+    Gzip-compresses a stream of text chunks on the fly.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+TRACK_KEY = 'bus_tracking:track:{bus_id}:{day}:{tolerance}'
+# A closed day's history does not change; keep its simplified track a week
+TRACK_CACHE_TTL = 7 * 24 * 3600
+
+# (latitude, longitude, epoch seconds)
+TrackPoint = Tuple[float, float, int]
+
+
+def _simplify_range(bus_id: int, since: datetime, until: datetime, tolerance_m: float) -> List[TrackPoint]:
+    rows = [
+        (row['latitude'], row['longitude'], int(row['timestamp'].timestamp()))
+        for row in iter_history(bus_id, since, until)
+    ]
+    return [rows[index] for index in simplify_indexes(rows, tolerance_m)]
+
+
+def _day_start(day) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def simplified_track(bus_id: int, since: datetime, until: datetime, tolerance_m: float) -> List[TrackPoint]:
+    """
+    The bus's path in ``[since, until)`` simplified to ``tolerance_m`` meters.
+    Whole past days (server time zone) come from the cache; the rest is
+    simplified on the fly. Day boundaries are always kept as vertices.
+    """
+    now = timezone.now()
+    track: List[TrackPoint] = []
+    start = since
+    while start < until:
+        day = timezone.localtime(start).date()
+        day_end = _day_start(day + timedelta(days=1))
+        end = min(day_end, until)
+        if start == _day_start(day) and end == day_end and day_end <= now:
+            key = TRACK_KEY.format(bus_id=bus_id, day=day.isoformat(), tolerance=tolerance_m)
+            points = cache.get(key)
+            if points is None:
+                points = _simplify_range(bus_id, start, end, tolerance_m)
+                cache.set(key, points, timeout=TRACK_CACHE_TTL)
+        else:
+            points = _simplify_range(bus_id, start, end, tolerance_m)
+        track.extend(points)
+        start = end
+    return track
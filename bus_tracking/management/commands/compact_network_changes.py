@@ -0,0 +1,47 @@
+"""
+Django management command to compact the network change log.
+
+Usage:
+    python manage.py compact_network_changes [--keep-days=30]
+
+Deletes NetworkChange rows older than --keep-days. Clients whose
+network_version is older than the remaining log get the full snapshot from
+initial-data?since= instead of a delta. The newest row is always kept: its
+id is the current network version.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bus_tracking.models import NetworkChange
+
+
+class Command(BaseCommand):
+    help = 'Delete old entries of the network change log (initial-data delta sync)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=30,
+            help='Keep changes from the last N days (default: 30)',
+        )
+
+    def handle(self, *args, **options):
+        keep_days = options['keep_days']
+        if keep_days < 0:
+            raise CommandError('--keep-days must be >= 0')
+
+        latest = NetworkChange.objects.order_by('-id').values_list('id', flat=True).first()
+        if latest is None:
+            self.stdout.write('Change log is empty')
+            return
+
+        cutoff = timezone.now() - timedelta(days=keep_days)
+        deleted, _ = NetworkChange.objects.filter(changed_at__lt=cutoff, id__lt=latest).delete()
+        remaining = NetworkChange.objects.count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} change(s), {remaining} kept (network version {latest})'
+        ))
@@ -0,0 +1,64 @@
+"""
+Django management command to export the location history.
+
+Usage:
+    python manage.py export_location_history [--bus=X] [--since=ISO] [--until=ISO]
+        [--format=ndjson|csv] [--output=FILE] [--gzip]
+
+Writes BusLocationLog rows (id, bus_id, timestamp, latitude, longitude,
+speed) ordered by bus and time, reading them in batches so memory stays
+constant however large the range is. Writes to stdout unless --output is
+given; --gzip (or an --output ending in .gz) compresses on the fly.
+Same data as GET /api/export/location-logs/.
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bus_tracking.location_history import (EXPORT_BATCH_SIZE, EXPORT_FORMATS, export_chunks, gzip_chunks,
+                                           iter_history, parse_timestamp)
+
+
+class Command(BaseCommand):
+    help = 'Export bus location history as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bus', type=int, help='Only this bus ID (default: all buses)')
+        parser.add_argument('--since', type=str, help='From this ISO 8601 timestamp (inclusive)')
+        parser.add_argument('--until', type=str, help='Up to this ISO 8601 timestamp (exclusive)')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--output', type=str, help='Output file (default: stdout)')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE,
+                            help=f'Rows per database query (default: {EXPORT_BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_timestamp(options['since'])
+            until = parse_timestamp(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+
+        output = options['output']
+        compress = options['gzip'] or bool(output and output.endswith('.gz'))
+        rows = iter_history(options['bus'], since, until, batch_size=options['batch_size'])
+        chunks = export_chunks(rows, options['format'])
+
+        if output:
+            stream = open(output, 'wb')
+        else:
+            stream = sys.stdout.buffer
+        try:
+            for data in (gzip_chunks(chunks) if compress else (chunk.encode() for chunk in chunks)):
+                stream.write(data)
+        finally:
+            if output:
+                stream.close()
+            else:
+                stream.flush()
+
+        if output:
+            self.stderr.write(self.style.SUCCESS(f'Exported location history to {output}'))
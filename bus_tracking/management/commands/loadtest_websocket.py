@@ -0,0 +1,383 @@
+"""
+Django management command to load-test the live location fan-out.
+
+Usage:
+    python manage.py loadtest_websocket --clients 5000 --duration 60 \
+        --ingest-rate 20 --token <driver-token> [--server-pid <daphne pid>]
+
+Opens N concurrent WebSocket clients against a running ASGI server (daphne),
+drives a synthetic ingest rate through POST /api/buses/<id>/update-location/
+and reports:
+- delivery latency p50/p95/p99 (server ingest timestamp -> client receive)
+- message loss: after a drain period, every fleet client must hold the
+  latest position of every bus that reported (updates may be coalesced,
+  so intermediate fixes are not counted as lost)
+- server CPU and memory, when --server-pid is given (psutil if installed,
+  otherwise /proc on Linux)
+
+Raise the open-files limit first for large runs, e.g. ``ulimit -n 65535``.
+"""
+
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from bus_tracking.wire import decode_binary_frame
+
+
+def _iso_to_ms(value) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class ProcessSampler:
+    """
+    CPU time and RSS of the server process.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+
+    def cpu_seconds(self) -> float:
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        import os
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def rss_bytes(self) -> int:
+        if self._process is not None:
+            return self._process.memory_info().rss
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def watch(self, stop: asyncio.Event, interval: float = 1.0):
+        while not stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+class ClientStats:
+    def __init__(self, fleet: bool):
+        self.fleet = fleet
+        self.connected = False
+        self.messages = 0
+        self.updates = 0
+        self.latest: Dict[int, int] = {}  # bus_id -> newest timestamp (ms) received
+
+
+class Command(BaseCommand):
+    help = 'Load-test WebSocket fan-out with many concurrent clients and a synthetic ingest rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='HTTP base URL of the server')
+        parser.add_argument('--ws-url', help='WebSocket URL (default: derived from --base-url)')
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--ramp', type=int, default=500, help='new connections per second')
+        parser.add_argument('--duration', type=float, default=30.0, help='seconds of ingest after all clients connected')
+        parser.add_argument('--drain', type=float, default=5.0, help='seconds to wait for in-flight updates')
+        parser.add_argument('--format', choices=('verbose', 'compact', 'binary'), default='verbose')
+        parser.add_argument('--batch', action='store_true', help='connect with ?batch=1')
+        parser.add_argument('--bbox', help='viewport for every client: south,west,north,east (default: whole fleet)')
+        parser.add_argument('--viewport-share', type=float, default=1.0,
+                            help='fraction of clients that use --bbox (the rest follow the whole fleet)')
+        parser.add_argument('--ingest-rate', type=float, default=10.0, help='location fixes per second (0 = none)')
+        parser.add_argument('--bus-ids', help='comma separated bus ids to move (default: all from /api/buses/)')
+        parser.add_argument('--center', default='33.5138,36.2765', help='lat,lon the synthetic buses move around')
+        parser.add_argument('--token', help='API token used for update-location')
+        parser.add_argument('--server-pid', type=int, help='PID of the ASGI server, for CPU/memory figures')
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise CommandError('The "websockets" package is required (pip install -r requirements.txt)')
+        asyncio.run(self.run(options))
+
+    # ------------------------------------------------------------------
+    # Clients
+    # ------------------------------------------------------------------
+
+    def client_url(self, options, fleet: bool) -> str:
+        url = options['ws_url'] or (
+            options['base_url'].replace('http://', 'ws://').replace('https://', 'wss://').rstrip('/')
+            + '/ws/bus-locations/'
+        )
+        params = []
+        if options['format'] != 'verbose':
+            params.append(f"format={options['format']}")
+        if options['batch']:
+            params.append('batch=1')
+        if not fleet:
+            params.append(f"bbox={options['bbox']}")
+        return url + ('?' + '&'.join(params) if params else '')
+
+    async def run_client(self, url: str, stats: ClientStats, stop: asyncio.Event, latencies: List[float]):
+        import websockets
+
+        try:
+            async with websockets.connect(url, max_size=None, open_timeout=30) as ws:
+                stats.connected = True
+                while not stop.is_set():
+                    try:
+                        frame = await asyncio.wait_for(ws.recv(), 1.0)
+                    except asyncio.TimeoutError:
+                        continue
+                    received_ms = time.time() * 1000
+                    stats.messages += 1
+                    for bus_id, ts_ms, is_update in self.parse_frame(frame):
+                        if ts_ms is None:
+                            continue
+                        if ts_ms > stats.latest.get(bus_id, 0):
+                            stats.latest[bus_id] = ts_ms
+                        if is_update:
+                            stats.updates += 1
+                            latencies.append(received_ms - ts_ms)
+        except Exception as e:
+            if not stats.connected:
+                self.connect_errors.append(str(e))
+
+    @staticmethod
+    def parse_frame(frame):
+        """
+        Yields (bus_id, timestamp ms, is_update) for every bus in a frame.
+        Snapshots count towards the latest state but not towards latency.
+        """
+        if isinstance(frame, bytes):
+            _, updates = decode_binary_frame(frame)
+            for update in updates:
+                yield update['i'], update.get('t'), True
+            return
+        message = json.loads(frame)
+        if message.get('k') == 'b':  # compact
+            for update in message['u']:
+                yield update['i'], update.get('t'), True
+            return
+        kind = message.get('type')
+        if kind == 'bus_location_update':
+            states, is_update = [message['data']], True
+        elif kind == 'bus_locations_batch':
+            states, is_update = message['updates'], True
+        elif kind in ('fleet_snapshot', 'viewport_snapshot', 'bus_snapshot'):
+            states, is_update = message['buses'], False
+        else:
+            return
+        for state in states:
+            yield state['bus_id'], _iso_to_ms(state.get('timestamp')), is_update
+
+    # ------------------------------------------------------------------
+    # Ingest
+    # ------------------------------------------------------------------
+
+    def load_bus_ids(self, options) -> List[int]:
+        if options['bus_ids']:
+            return [int(bus_id) for bus_id in options['bus_ids'].split(',')]
+        response = requests.get(f"{options['base_url'].rstrip('/')}/api/buses/", headers=self.auth_headers(options), timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if isinstance(data, dict):  # paginated
+            data = data.get('results', [])
+        return [bus['bus_id'] for bus in data]
+
+    @staticmethod
+    def auth_headers(options) -> dict:
+        return {'Authorization': f"Token {options['token']}"} if options['token'] else {}
+
+    async def run_ingest(self, options, bus_ids, stop: asyncio.Event, counters: dict):
+        rate = options['ingest_rate']
+        if rate <= 0 or not bus_ids:
+            await stop.wait()
+            return
+        lat0, lon0 = (float(value) for value in options['center'].split(','))
+        positions = {bus_id: [lat0 + random.uniform(-0.02, 0.02), lon0 + random.uniform(-0.02, 0.02)] for bus_id in bus_ids}
+        base_url = options['base_url'].rstrip('/')
+        headers = self.auth_headers(options)
+        session = requests.Session()
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=min(32, max(4, int(rate))))
+
+        def post(bus_id, lat, lon):
+            try:
+                response = session.post(
+                    f'{base_url}/api/buses/{bus_id}/update-location/',
+                    json={'latitude': lat, 'longitude': lon, 'speed': round(random.uniform(10, 50), 1)},
+                    headers=headers, timeout=30,
+                )
+                counters['ok' if response.status_code in (200, 201) else 'failed'] += 1
+            except requests.RequestException:
+                counters['failed'] += 1
+
+        pending = set()
+        interval = 1.0 / rate
+        next_at = time.monotonic()
+        while not stop.is_set():
+            bus_id = random.choice(bus_ids)
+            position = positions[bus_id]
+            position[0] += random.uniform(-0.0005, 0.0005)
+            position[1] += random.uniform(-0.0005, 0.0005)
+            counters['sent'] += 1
+            future = loop.run_in_executor(executor, post, bus_id, position[0], position[1])
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        if pending:
+            await asyncio.wait(pending)
+        executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+
+    async def run(self, options):
+        self.connect_errors = []
+        bus_ids = self.load_bus_ids(options) if options['ingest_rate'] > 0 else []
+        if options['ingest_rate'] > 0 and not bus_ids:
+            raise CommandError('No buses to move: create some or pass --bus-ids')
+        if options['ingest_rate'] > 0 and not options['token']:
+            self.stdout.write(self.style.WARNING('No --token given: update-location may reject the fixes'))
+
+        sampler = ProcessSampler(options['server_pid']) if options['server_pid'] else None
+        if sampler:
+            try:
+                sampler.cpu_seconds()
+            except Exception as e:
+                raise CommandError(f"Cannot read process {options['server_pid']}: {e}")
+        stop_clients = asyncio.Event()
+        stop_ingest = asyncio.Event()
+        stop_sampler = asyncio.Event()
+        latencies: List[float] = []
+        clients: List[ClientStats] = []
+        tasks = []
+
+        sampler_task = asyncio.ensure_future(sampler.watch(stop_sampler)) if sampler else None
+
+        # Ramp up
+        viewport_clients = int(options['clients'] * options['viewport_share']) if options['bbox'] else 0
+        self.stdout.write(f"Connecting {options['clients']} clients ({viewport_clients} with a viewport)...")
+        delay = 1.0 / max(1, options['ramp'])
+        for index in range(options['clients']):
+            fleet = index >= viewport_clients
+            stats = ClientStats(fleet)
+            clients.append(stats)
+            tasks.append(asyncio.ensure_future(
+                self.run_client(self.client_url(options, fleet), stats, stop_clients, latencies)
+            ))
+            await asyncio.sleep(delay)
+        await asyncio.sleep(1.0)
+        connected = sum(1 for stats in clients if stats.connected)
+        self.stdout.write(f"Connected {connected}/{options['clients']}")
+
+        # Ingest
+        counters = {'sent': 0, 'ok': 0, 'failed': 0}
+        cpu_start = sampler.cpu_seconds() if sampler else None
+        started = time.monotonic()
+        latencies.clear()  # connect snapshots are not part of the measurement
+        ingest_task = asyncio.ensure_future(self.run_ingest(options, bus_ids, stop_ingest, counters))
+        await asyncio.sleep(options['duration'])
+        stop_ingest.set()
+        await ingest_task
+        ingest_seconds = time.monotonic() - started
+        ingest_end_ms = time.time() * 1000
+
+        # Drain, then read the reference state (latest fix per bus) from a fresh snapshot
+        await asyncio.sleep(options['drain'])
+        cpu_seconds = (sampler.cpu_seconds() - cpu_start) if sampler else None
+        wall = time.monotonic() - started
+        reference = await self.fetch_reference(options)
+
+        stop_clients.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if sampler_task:
+            stop_sampler.set()
+            await sampler_task
+
+        self.report(options, clients, latencies, counters, ingest_seconds, ingest_end_ms,
+                    reference, sampler, cpu_seconds, wall)
+
+    async def fetch_reference(self, options) -> Dict[int, int]:
+        """
+        Latest timestamp per bus according to the server (a fresh fleet snapshot).
+        """
+        import websockets
+
+        stats = ClientStats(fleet=True)
+        try:
+            async with websockets.connect(self.client_url(dict(options, format='verbose', batch=False), True),
+                                          max_size=None, open_timeout=30) as ws:
+                while True:
+                    frame = await asyncio.wait_for(ws.recv(), 10)
+                    if json.loads(frame).get('type') == 'fleet_snapshot':
+                        for bus_id, ts_ms, _ in self.parse_frame(frame):
+                            if ts_ms is not None:
+                                stats.latest[bus_id] = ts_ms
+                        break
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Could not read the reference snapshot: {e}'))
+        return stats.latest
+
+    def report(self, options, clients, latencies, counters, ingest_seconds, ingest_end_ms,
+               reference, sampler, cpu_seconds, wall):
+        connected = [stats for stats in clients if stats.connected]
+        latencies.sort()
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS('=== WebSocket fan-out load test ==='))
+        self.stdout.write(f"clients:   {len(connected)}/{len(clients)} connected"
+                          f" ({len(self.connect_errors)} failed)"
+                          f", format={options['format']}{' batch' if options['batch'] else ''}")
+        if self.connect_errors:
+            self.stdout.write(f"           first error: {self.connect_errors[0]}")
+        self.stdout.write(f"ingest:    {counters['ok']}/{counters['sent']} fixes accepted in {ingest_seconds:.1f}s"
+                          f" ({counters['ok'] / max(ingest_seconds, 1e-9):.1f}/s, {counters['failed']} failed)")
+        updates = sum(stats.updates for stats in connected)
+        messages = sum(stats.messages for stats in connected)
+        self.stdout.write(f"delivery:  {messages} frames, {updates} bus updates"
+                          f" ({updates / max(len(connected), 1):.1f} per client)")
+        self.stdout.write(f"latency:   p50={_percentile(latencies, 50):.1f}ms  p95={_percentile(latencies, 95):.1f}ms"
+                          f"  p99={_percentile(latencies, 99):.1f}ms  max={latencies[-1] if latencies else float('nan'):.1f}ms")
+
+        # Loss: fleet clients that do not hold the server's latest state of a bus
+        # that moved during the test (older positions may legitimately be coalesced away)
+        moved = {bus_id: ts for bus_id, ts in reference.items() if ts >= ingest_end_ms - ingest_seconds * 1000}
+        fleet = [stats for stats in connected if stats.fleet]
+        if moved and fleet:
+            stale = sum(1 for stats in fleet for bus_id, ts in moved.items() if stats.latest.get(bus_id, 0) < ts)
+            total = len(moved) * len(fleet)
+            self.stdout.write(f"loss:      {stale}/{total} (client, bus) pairs missing the latest position"
+                              f" ({100.0 * stale / total:.3f}%)")
+        else:
+            self.stdout.write('loss:      n/a (no fleet clients or no moved buses)')
+
+        if sampler:
+            self.stdout.write(f"server:    cpu={100.0 * cpu_seconds / wall:.1f}% of one core"
+                              f"  peak rss={sampler.peak_rss / 1024 / 1024:.1f} MB (pid {sampler.pid})")
@@ -0,0 +1,147 @@
+# bus_tracking/middleware.py
+"""
+Channels middleware for WebSocket token authentication.
+
+Resolves ``?token=<key>`` or an ``Authorization: Token|Bearer <key>`` header
+to ``scope['user']`` with a single database query, and keeps the result in an
+in-process TTL/LRU cache so reconnect storms do not turn into database storms.
+Cache entries are dropped when the token is deleted or recreated, or when
+its user is saved, for example on deactivation (see ``bus_tracking/signals.py``).
+Other processes pick these changes up within the TTL.
+
+Usage (asgi.py):
+    "websocket": TokenAuthMiddlewareStack(URLRouter(...))
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+
+_MISSING = object()
+
+
+class TokenCache:
+    """
+    Thread-safe LRU cache of token key -> user (or None for unknown tokens),
+    with a per-entry time-to-live.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, negative_ttl: float = 10.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, user) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id) -> None:
+        with self._lock:
+            stale = [
+                key for key, (user, _) in self._entries.items()
+                if user is not None and user.pk == user_id
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, 'BUS_TRACKING_WS_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'BUS_TRACKING_WS_TOKEN_CACHE_TTL', 60),
+)
+
+
+def get_token_from_scope(scope) -> Optional[str]:
+    """
+    Extracts the token from the query string or the Authorization header.
+    """
+    params = parse_qs(scope.get('query_string', b'').decode())
+    token = params.get('token', [None])[0]
+    if token:
+        return token
+
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] in ('Token', 'Bearer'):
+                return parts[1]
+    return None
+
+
+@database_sync_to_async
+def _load_user(key: str):
+    from rest_framework.authtoken.models import Token
+
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+async def get_user_for_token(key: str):
+    """
+    Returns the active user owning ``key`` or None, hitting the database at
+    most once per key per TTL.
+    """
+    user = token_cache.get(key)
+    if user is _MISSING:
+        user = await _load_user(key)
+        token_cache.set(key, user)
+    return user
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Populates ``scope['user']`` (AnonymousUser when no valid token is given)
+    and ``scope['auth_token']``. Anonymous connections are not rejected here;
+    each consumer decides whether it requires authentication.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        token = get_token_from_scope(scope)
+        user = await get_user_for_token(token) if token else None
+        scope['user'] = user or AnonymousUser()
+        scope['auth_token'] = token if user else None
+        return await super().__call__(scope, receive, send)
+
+
+def TokenAuthMiddlewareStack(inner):
+    return TokenAuthMiddleware(inner)
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0002_routesegment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('stop', 'Bus stop'), ('line', 'Bus line'), ('bus', 'Bus')], max_length=10)),
+                ('entity_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Inserted or updated'), ('delete', 'Deleted')], default='upsert', max_length=10)),
+                ('changed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
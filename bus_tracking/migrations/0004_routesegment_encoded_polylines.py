@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 12:52
+
+from django.db import migrations, models
+
+
+def encode_existing_segments(apps, schema_editor):
+    from bus_tracking.geometry import encode_levels
+
+    RouteSegment = apps.get_model('bus_tracking', 'RouteSegment')
+    for segment in RouteSegment.objects.iterator():
+        if not segment.polyline_points:
+            continue
+        segment.encoded_polylines = encode_levels(segment.polyline_points)
+        segment.save(update_fields=['encoded_polylines'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0003_networkchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routesegment',
+            name='encoded_polylines',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(encode_existing_segments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0004_routesegment_encoded_polylines'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='buslocationlog',
+            index=models.Index(fields=['bus', 'timestamp'], name='bus_tracking_log_bus_ts_idx'),
+        ),
+    ]
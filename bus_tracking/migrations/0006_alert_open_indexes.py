@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0005_buslocationlog_bus_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['-timestamp'], name='bus_tracking_alert_open_ix'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['bus', 'alert_type'], name='bus_tracking_alert_bus_open_ix'),
+        ),
+    ]
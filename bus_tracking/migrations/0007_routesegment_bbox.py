@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 13:32
+
+from django.db import migrations, models
+
+
+def bound_existing_segments(apps, schema_editor):
+    from bus_tracking.geometry import bounding_box
+
+    RouteSegment = apps.get_model('bus_tracking', 'RouteSegment')
+    for segment in RouteSegment.objects.iterator():
+        if not segment.polyline_points:
+            continue
+        segment.bbox = bounding_box(segment.polyline_points)
+        segment.save(update_fields=['bbox'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0006_alert_open_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routesegment',
+            name='bbox',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(bound_existing_segments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bus_tracking', '0007_routesegment_bbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='networkchange',
+            name='entity',
+            field=models.CharField(choices=[('stop', 'Bus stop'), ('line', 'Bus line'), ('line_part', 'Line stops or route segments'), ('bus', 'Bus')], max_length=10),
+        ),
+    ]
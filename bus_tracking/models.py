@@ -68,6 +68,11 @@ class RouteSegment(models.Model):
     # Polyline data (stores intermediate points along the road)
     # Format: JSON array of [lat, lon] pairs
     polyline_points = models.JSONField(default=list, blank=True, help_text="Array of [lat, lon] points along the road")
+    # Encoded polylines of polyline_points per zoom level, for drawing (see geometry.py)
+    # Format: {"10": "...", "12": "...", "14": "...", "full": "..."}; filled in by save()
+    encoded_polylines = models.JSONField(default=dict, blank=True, editable=False)
+    # [min_lat, min_lon, max_lat, max_lon] of polyline_points, for tiles; filled in by save()
+    bbox = models.JSONField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['bus_line', 'order']
@@ -79,6 +84,20 @@ class RouteSegment(models.Model):
     def __str__(self):
         return f"{self.bus_line.route_name}: {self.from_stop.stop_name} → {self.to_stop.stop_name}"
     
+    def save(self, *args, **kwargs):
+        from .geometry import bounding_box, encode_levels
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'polyline_points' in update_fields:
+            self.encoded_polylines = encode_levels(self.polyline_points)
+            self.bbox = bounding_box(self.polyline_points)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'encoded_polylines', 'bbox'}
+        super().save(*args, **kwargs)
+
+    def encoded_polyline(self, level='full'):
+        return self.encoded_polylines.get(level, '')
+
     def get_distance_km(self):
         """Return distance in kilometers"""
         return self.distance_meters / 1000.0
@@ -107,6 +126,12 @@ class BusLocationLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     speed = models.FloatField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # History queries: one bus over a time range (see location_history.py)
+            models.Index(fields=['bus', 'timestamp'], name='bus_tracking_log_bus_ts_idx'),
+        ]
+
     def __str__(self):
         return f"Log for Bus {self.bus} at {self.timestamp}"
 
@@ -127,5 +152,50 @@ class Alert(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     is_resolved = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Partial indexes: only unresolved alerts, which is what is read
+            # (dashboard list, newest first; off-route check per bus in update_location)
+            models.Index(fields=['-timestamp'], condition=models.Q(is_resolved=False),
+                         name='bus_tracking_alert_open_ix'),
+            models.Index(fields=['bus', 'alert_type'], condition=models.Q(is_resolved=False),
+                         name='bus_tracking_alert_bus_open_ix'),
+        ]
+
+    def __str__(self):
+        return f"Alert for Bus {self.bus}: {self.message}"
+
+class NetworkChange(models.Model):
+    """
+    Change log of the static network, used for initial-data delta sync.
+    The id of the latest row is the network version clients sync against.
+    Written by signal handlers (see signals.py); old rows are removed with
+    ``manage.py compact_network_changes``.
+    """
+    ENTITY_STOP = 'stop'
+    ENTITY_LINE = 'line'
+    ENTITY_LINE_PART = 'line_part'  # entity_id is the line
+    ENTITY_BUS = 'bus'
+    ENTITIES = (
+        (ENTITY_STOP, 'Bus stop'),
+        (ENTITY_LINE, 'Bus line'),
+        (ENTITY_LINE_PART, 'Line stops or route segments'),
+        (ENTITY_BUS, 'Bus'),
+    )
+    ACTION_UPSERT = 'upsert'
+    ACTION_DELETE = 'delete'
+    ACTIONS = (
+        (ACTION_UPSERT, 'Inserted or updated'),
+        (ACTION_DELETE, 'Deleted'),
+    )
+
+    entity = models.CharField(max_length=10, choices=ENTITIES)
+    entity_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS, default=ACTION_UPSERT)
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
     def __str__(self):
-        return f"Alert for Bus {self.bus}: {self.message}"
\ No newline at end of file
+        return f"#{self.id} {self.action} {self.entity} {self.entity_id}"
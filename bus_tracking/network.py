@@ -0,0 +1,315 @@
+# bus_tracking/network.py
+"""
+Versioned, pre-serialized snapshot of the transit network for initial-data.
+
+The network (stops, lines, line stops, route segments and the bus roster)
+changes rarely, but ``/api/initial-data/`` is called by every app start and
+every search. Model signals bump a network version (see ``signals.py``); the
+payload is serialized and gzipped once per version and then served as bytes,
+with an ``ETag`` so clients that already have it get a 304.
+
+Buses' ``current_location`` is part of the payload for compatibility, so a
+snapshot is also rebuilt once it is older than ``BUS_TRACKING_INITIAL_DATA_TTL``
+seconds. Live positions come from the WebSocket/SSE streams anyway. The ETag
+is a hash of the content: a rebuild that changes nothing keeps the same ETag.
+
+The network version is the id of the latest ``NetworkChange`` row, mirrored
+in the Django cache so requests do not query it. The cached value expires
+after ``BUS_TRACKING_NETWORK_VERSION_TTL`` seconds and is then re-read from
+the database, so with a per-process cache (locmem) a process sees changes
+made by another one within that time; a shared cache backend sees them at
+once.
+
+Clients that already hold version N can ask for ``initial-data?since=N`` and
+get only what changed (``build_delta``); if the change log no longer reaches
+back to N they get the full snapshot.
+
+Row ids are taken at insert but rows only become visible at commit, so a
+change can appear below a version a client already holds. ``changes_since``
+therefore also re-reads the rows logged up to
+``BUS_TRACKING_NETWORK_CHANGE_OVERLAP`` seconds before N; that is the longest
+a transaction writing network changes is expected to stay open.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from . import fastjson
+
+NETWORK_VERSION_KEY = 'bus_tracking:network_version'
+PUBLISH_LOCK_KEY = 'bus_tracking:network_version:lock'
+PUBLISH_ATTEMPTS = 20
+SNAPSHOT_KEY = 'bus_tracking:initial_data:{version}'
+
+
+def snapshot_ttl() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_INITIAL_DATA_TTL', 30))
+
+
+def version_ttl() -> int:
+    return max(1, int(getattr(settings, 'BUS_TRACKING_NETWORK_VERSION_TTL', 5)))
+
+
+def change_overlap_seconds() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_NETWORK_CHANGE_OVERLAP', 60))
+
+
+def index_ttl() -> int:
+    return max(1, int(getattr(settings, 'BUS_TRACKING_NETWORK_INDEX_TTL', 300)))
+
+
+def index_is_current(index, version: int) -> bool:
+    """
+    Whether a per-process index built from the network (with ``version`` and
+    ``built_at``, a ``time.monotonic()`` value) can still serve ``version``.
+    Indexes are also rebuilt once older than ``BUS_TRACKING_NETWORK_INDEX_TTL``
+    seconds: a change committed below the current version does not move it
+    (see ``changes_since``).
+    """
+    return index is not None and index.version == version and time.monotonic() - index.built_at < index_ttl()
+
+
+def network_version() -> int:
+    version = cache.get(NETWORK_VERSION_KEY)
+    if version is None:
+        from .models import NetworkChange
+
+        version = NetworkChange.objects.aggregate(latest=Max('id'))['latest'] or 0
+        cache.add(NETWORK_VERSION_KEY, version, timeout=version_ttl())
+    return version
+
+
+def _publish_version(version: int) -> None:
+    """
+    Raises the cached network version to ``version`` unless it is already
+    higher (transactions commit in any order). ``cache.add`` is atomic on
+    every backend, so it guards the compare-and-set; if the guard cannot be
+    taken, the cached version is dropped and the next reader reloads it.
+    """
+    for _ in range(PUBLISH_ATTEMPTS):
+        if cache.add(PUBLISH_LOCK_KEY, version, timeout=5):
+            try:
+                if version > (cache.get(NETWORK_VERSION_KEY) or 0):
+                    cache.set(NETWORK_VERSION_KEY, version, timeout=version_ttl())
+            finally:
+                cache.delete(PUBLISH_LOCK_KEY)
+            return
+        time.sleep(0.005)
+    cache.delete(NETWORK_VERSION_KEY)
+
+
+def record_change(entity: str, entity_id: int, action: Optional[str] = None) -> None:
+    """
+    Logs a change of something in the initial-data payload and, once the
+    transaction commits, makes it the current network version.
+    """
+    from .models import NetworkChange
+
+    change = NetworkChange.objects.create(
+        entity=entity, entity_id=entity_id, action=action or NetworkChange.ACTION_UPSERT,
+    )
+    # Not before commit: a snapshot built meanwhile would carry the new
+    # version with the old data
+    transaction.on_commit(lambda: _publish_version(change.id))
+
+
+def changes_since(since: int):
+    """
+    ``NetworkChange`` rows above version ``since``, plus the rows below it
+    logged within the overlap window before it (they may have committed
+    after ``since`` was read, see the module docstring).
+    """
+    from .models import NetworkChange
+
+    anchor = (NetworkChange.objects.filter(id__lte=since).order_by('-id')
+              .values_list('changed_at', flat=True).first())
+    if anchor is None:
+        return NetworkChange.objects.filter(id__gt=since)
+    window_start = anchor - timedelta(seconds=change_overlap_seconds())
+    return NetworkChange.objects.filter(Q(id__gt=since) | Q(id__lt=since, changed_at__gte=window_start))
+
+
+class NetworkSnapshot:
+    """
+    One serialized initial-data payload: JSON bytes, gzipped bytes and ETag.
+    """
+
+    def __init__(self, version: int, payload: dict):
+        content = fastjson.dumps(payload)
+        # The build timestamp is added after hashing so it does not change the ETag
+        self.etag = '"' + hashlib.sha1(content.encode()).hexdigest() + '"'
+        self.body = ('{"timestamp": ' + fastjson.dumps(timezone.now().isoformat()) + ', ' + content[1:]).encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.version = version
+        self.built_at = time.time()
+
+    def is_fresh(self, version: int) -> bool:
+        return self.version == version and time.time() - self.built_at < snapshot_ttl()
+
+
+def _serialize_network(stop_ids=None, bus_ids=None, line_ids=None) -> Tuple[list, list, list]:
+    """
+    Serialized stops, buses and lines (all of them, or only the given ids).
+    """
+    from .models import Bus, BusLine, BusStop
+    from .serializers import BusLineWithStopsSerializer, BusSerializer, BusStopSerializer
+
+    bus_stops = BusStop.objects.select_related('location').all()
+    buses = Bus.objects.select_related('current_location', 'bus_line').all()
+    bus_lines = BusLineWithStopsSerializer.prefetch_stops(BusLine.objects.all())
+    if stop_ids is not None:
+        bus_stops = bus_stops.filter(pk__in=stop_ids) if stop_ids else bus_stops.none()
+        buses = buses.filter(pk__in=bus_ids) if bus_ids else buses.none()
+        bus_lines = bus_lines.filter(pk__in=line_ids) if line_ids else bus_lines.none()
+
+    return (
+        BusStopSerializer(bus_stops, many=True).data,
+        BusSerializer(buses, many=True).data,
+        BusLineWithStopsSerializer(bus_lines, many=True).data,
+    )
+
+
+def build_initial_data() -> dict:
+    """
+    The initial-data payload (bus_stops, buses, bus_lines) straight from the
+    ORM, without the ``timestamp`` (added by NetworkSnapshot).
+    """
+    bus_stops_data, buses_data, bus_lines_data = _serialize_network()
+
+    return {
+        'full': True,
+        'bus_stops': bus_stops_data,
+        'buses': buses_data,
+        'bus_lines': bus_lines_data,
+        'network_version': None,  # filled in by get_snapshot
+        'count': {
+            'bus_stops': len(bus_stops_data),
+            'buses': len(buses_data),
+            'bus_lines': len(bus_lines_data),
+        },
+    }
+
+
+_lock = threading.Lock()
+_local: Optional[NetworkSnapshot] = None
+
+
+def get_snapshot() -> NetworkSnapshot:
+    """
+    The current snapshot: from this process, then the shared cache, and only
+    if neither is fresh, rebuilt from the database.
+    """
+    global _local
+    version = network_version()
+    snapshot = _local
+    if snapshot is not None and snapshot.is_fresh(version):
+        return snapshot
+
+    with _lock:
+        snapshot = cache.get(SNAPSHOT_KEY.format(version=version))
+        if snapshot is None or not snapshot.is_fresh(version):
+            payload = build_initial_data()
+            payload['network_version'] = version
+            snapshot = NetworkSnapshot(version, payload)
+            cache.set(SNAPSHOT_KEY.format(version=version), snapshot, timeout=snapshot_ttl())
+        _local = snapshot
+    return snapshot
+
+
+def clear_snapshot_cache() -> None:
+    """
+    Drops the cached snapshots (the next request rebuilds it).
+    """
+    global _local
+    _local = None
+    cache.delete(SNAPSHOT_KEY.format(version=network_version()))
+
+
+def build_delta(since: int) -> Optional[dict]:
+    """
+    What changed after network version ``since``: stops, buses and lines
+    inserted or updated since then (serialized as in initial-data) and the
+    ids of the deleted ones. Changes from the overlap window are sent again;
+    applying them twice is harmless. Returns None when a full snapshot is needed
+    instead (``since`` is unknown or older than the compacted change log).
+    """
+    from .models import Bus, BusLineStop, NetworkChange
+
+    log = NetworkChange.objects.aggregate(first=Min('id'), last=Max('id'))
+    if since < 0 or since > (log['last'] or 0):
+        return None  # not a version of this network
+    if log['first'] is not None and since < log['first'] - 1:
+        return None  # the log was compacted past the client's version
+
+    latest: Dict[Tuple[str, int], str] = {}
+    version = since
+    for change_id, entity, entity_id, action in (
+        changes_since(since).order_by('id').values_list('id', 'entity', 'entity_id', 'action')
+    ):
+        latest[(entity, entity_id)] = action
+        version = max(version, change_id)
+
+    changed = {entity: set() for entity, _ in NetworkChange.ENTITIES}
+    deleted = {entity: set() for entity, _ in NetworkChange.ENTITIES}
+    for (entity, entity_id), action in latest.items():
+        target = deleted if action == NetworkChange.ACTION_DELETE else changed
+        target[entity].add(entity_id)
+
+    # Buses embed their line's own fields (not its stops): only a change of
+    # the line row itself re-sends them. Lines embed their stops and segments.
+    stop_ids = changed[NetworkChange.ENTITY_STOP]
+    line_ids = changed[NetworkChange.ENTITY_LINE]
+    if line_ids:
+        changed[NetworkChange.ENTITY_BUS] |= set(Bus.objects.filter(bus_line_id__in=line_ids).values_list('bus_id', flat=True))
+    line_ids = line_ids | changed[NetworkChange.ENTITY_LINE_PART]
+    if stop_ids:
+        line_ids |= set(BusLineStop.objects.filter(bus_stop_id__in=stop_ids).values_list('bus_line_id', flat=True))
+    changed[NetworkChange.ENTITY_LINE] = line_ids
+
+    bus_stops_data, buses_data, bus_lines_data = _serialize_network(
+        stop_ids=changed[NetworkChange.ENTITY_STOP],
+        bus_ids=changed[NetworkChange.ENTITY_BUS],
+        line_ids=changed[NetworkChange.ENTITY_LINE],
+    )
+    # Updated and then deleted without a log entry for the delete (e.g. a
+    # bulk queryset delete that bypasses signals): report as deleted
+    for entity, data, key in (
+        (NetworkChange.ENTITY_STOP, bus_stops_data, 'stop_id'),
+        (NetworkChange.ENTITY_BUS, buses_data, 'bus_id'),
+        (NetworkChange.ENTITY_LINE, bus_lines_data, 'route_id'),
+    ):
+        deleted[entity] |= changed[entity] - {item[key] for item in data}
+
+    return {
+        'full': False,
+        'since': since,
+        'network_version': version,
+        'timestamp': timezone.now().isoformat(),
+        'bus_stops': bus_stops_data,
+        'buses': buses_data,
+        'bus_lines': bus_lines_data,
+        'deleted': {
+            'bus_stops': sorted(deleted[NetworkChange.ENTITY_STOP]),
+            'buses': sorted(deleted[NetworkChange.ENTITY_BUS]),
+            'bus_lines': sorted(deleted[NetworkChange.ENTITY_LINE]),
+        },
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag in candidates
@@ -0,0 +1,153 @@
+# bus_tracking/outbox.py
+"""
+Per-connection outbox for live location frames.
+
+Group handlers in the consumer never wait on the client: they drop the
+updates into the connection's outbox and return, so the channel layer keeps
+draining even when a client is slow. The outbox keeps at most one pending
+entry per bus (latest wins) and a bounded number of buses; a writer task
+sends whatever is pending as fast as the client accepts it.
+
+"As fast as the client accepts it" depends on the ASGI server: uvicorn
+(websockets) makes ``send`` wait while the socket's write buffer is full,
+Daphne returns at once and buffers in Twisted, so a slow reader never holds
+the writer up. Clients that acknowledge what they received (``ack_window``)
+get flow control on any server: the writer stops taking updates while that
+many sent frames are unacknowledged, and pending updates coalesce meanwhile.
+
+Counters are kept per outbox and summed in ``stats`` for the whole process.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Iterable, List, Optional, Tuple
+
+# Process-wide counters (see live_stats_view)
+stats = {
+    'connections': 0,
+    'lagging_connections': 0,
+    'coalesced_updates': 0,      # pending update replaced by a newer one for the same bus
+    'overflow_dropped': 0,       # pending update dropped because the outbox was full
+    'stalled_disconnects': 0,    # connections closed for staying stalled too long
+}
+
+# (frame text for verbose clients, fixed-point record)
+Entry = Tuple[str, tuple]
+
+
+class Outbox:
+    """
+    Bounded, latest-wins queue of pending bus updates for one connection.
+    """
+
+    def __init__(self, max_buses: int = 2000, ack_window: int = 0):
+        self.max_buses = max_buses
+        self.ack_window = ack_window
+        self._in_flight: deque = deque()  # seqs sent and not yet acknowledged
+        self._entries: "OrderedDict[int, Entry]" = OrderedDict()
+        self._message: Optional[dict] = None
+        self._seq: Optional[int] = None
+        self._wakeup = asyncio.Event()
+        self.pending_since: Optional[float] = None
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.lagging = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put_message(self, message: dict, entries: List[Tuple[int, Entry]]) -> None:
+        """
+        Queues all updates of one group message. If the writer picks the
+        message up before anything else arrives, its pre-serialized frames
+        are sent as-is.
+        """
+        was_empty = not self._entries
+        dropped = self.dropped
+        for bus_id, entry in entries:
+            if bus_id in self._entries:
+                self.coalesced += 1
+                stats['coalesced_updates'] += 1
+            self._entries[bus_id] = entry
+            self._entries.move_to_end(bus_id)
+        while len(self._entries) > self.max_buses:
+            # Evict the bus that has gone longest without an update
+            self._entries.popitem(last=False)
+            self.dropped += 1
+            stats['overflow_dropped'] += 1
+
+        self._message = message if was_empty and dropped == self.dropped else None
+        seq = message.get('seq')
+        if seq is not None and (self._seq is None or seq > self._seq):
+            self._seq = seq
+        if was_empty and self._entries:
+            self.pending_since = time.monotonic()
+        self.max_depth = max(self.max_depth, len(self._entries))
+        self._set_lagging(not was_empty)
+        self._wakeup.set()
+
+    def discard(self, bus_ids: Optional[Iterable[int]] = None) -> None:
+        """
+        Drops pending updates superseded by a snapshot (all when None).
+        """
+        if bus_ids is None:
+            self._entries.clear()
+        else:
+            for bus_id in bus_ids:
+                self._entries.pop(bus_id, None)
+        self._message = None
+        if not self._entries:
+            self.pending_since = None
+
+    async def take(self) -> Tuple[Optional[dict], List[Entry], Optional[int]]:
+        """
+        Waits for pending updates (and, with an ack window, for room in it)
+        and returns ``(message, entries, seq)``. ``message`` is the original
+        group message when the entries are exactly that message's updates,
+        otherwise None; ``seq`` is the highest sequence number among the
+        messages they came from.
+        """
+        while not self._entries or self._window_full():
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        message, self._message = self._message, None
+        seq, self._seq = self._seq, None
+        entries = list(self._entries.values())
+        self._entries.clear()
+        self.pending_since = None
+        return message, entries, seq
+
+    def sent(self, seq: Optional[int] = None) -> None:
+        """
+        Called by the writer after a send completed, with the seq it sent.
+        """
+        if self.ack_window and seq is not None:
+            self._in_flight.append(seq)
+        if not self._entries:
+            self._set_lagging(False)
+
+    def acknowledge(self, seq: int) -> None:
+        """
+        The client has received everything up to ``seq``.
+        """
+        while self._in_flight and self._in_flight[0] <= seq:
+            self._in_flight.popleft()
+        self._wakeup.set()
+
+    def _window_full(self) -> bool:
+        return bool(self.ack_window) and len(self._in_flight) >= self.ack_window
+
+    def stalled_for(self) -> float:
+        if self.pending_since is None:
+            return 0.0
+        return time.monotonic() - self.pending_since
+
+    def close(self) -> None:
+        self._set_lagging(False)
+
+    def _set_lagging(self, lagging: bool) -> None:
+        if lagging != self.lagging:
+            self.lagging = lagging
+            stats['lagging_connections'] += 1 if lagging else -1
@@ -0,0 +1,126 @@
+# bus_tracking/read_cache.py
+"""
+Response cache for the read endpoints of the static data (bus lines, stops,
+buses), invalidated by model version counters.
+
+Every cached model has a version number in the Django cache, bumped by the
+``post_save``/``post_delete`` handlers in ``signals.py`` once the transaction
+commits. A cached response's
+key contains the versions of every model it was built from, so any change
+to one of them makes the old entries unreachable (they expire after
+``BUS_TRACKING_READ_CACHE_TTL``); nothing has to be deleted explicitly.
+
+With the default per-process cache (locmem) each worker invalidates only its
+own entries; configure a shared cache (``CACHE_BACKEND=redis``) when running
+several processes. Hit/miss counters per endpoint are in ``stats`` (this
+process) and in ``/api/live-stats/``.
+"""
+
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from . import fastjson
+
+MODEL_VERSION_KEY = 'bus_tracking:model_version:{label}'
+RESPONSE_KEY = 'bus_tracking:read:{name}:{versions}:{path}'
+
+
+def read_cache_ttl() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_READ_CACHE_TTL', 300))
+
+
+def _version_key(model) -> str:
+    return MODEL_VERSION_KEY.format(label=model._meta.label_lower)
+
+
+def model_versions(models: Iterable) -> str:
+    """
+    The current versions of ``models`` as one key fragment (one cache round trip).
+    """
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A lost counter restarts from the clock, never from a value an
+            # older cached response was keyed with
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def bump_model_version(model) -> None:
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def count(self, name: str, outcome: str) -> None:
+        with self._lock:
+            self._counts[name][outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+stats = _Stats()
+
+
+def cached_response(request, name: str, models: Iterable, build: Callable[[], Response]) -> Response:
+    """
+    ``build()``'s response for this request, from the cache when none of
+    ``models`` changed since it was stored. Only 200 responses are cached.
+    """
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    key = RESPONSE_KEY.format(name=name, versions=model_versions(models), path=path)
+    data = cache.get(key)
+    if data is not None:
+        stats.count(name, 'hits')
+        return Response(data)
+
+    stats.count(name, 'misses')
+    response = build()
+    if response.status_code == 200:
+        # Plain lists/dicts (serializer output holds a reference to its serializer)
+        cache.set(key, fastjson.loads(fastjson.dumps_bytes(response.data)), timeout=read_cache_ttl())
+    return response
+
+
+class CachedReadMixin:
+    """
+    ViewSet mixin: caches ``list``/``retrieve`` (and any action named in
+    ``cache_models``) with ``cached_response``. ``cache_models`` maps the
+    action name to the models its response is built from.
+    """
+    cache_models: Dict[str, tuple] = {}
+
+    def cached(self, request, build: Callable[[], Response]) -> Response:
+        models = self.cache_models.get(self.action)
+        if models is None:
+            return build()
+        name = f'{self.basename}-{self.action}'
+        return cached_response(request, name, models, build)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,270 @@
+# bus_tracking/search.py
+"""
+Server-side search over stop names, line names and license plates.
+
+    GET /api/search/?q=<text>[&type=all|bus_stops|buses|bus_lines][&limit=<per type>]
+
+Names are normalized before indexing and querying (``normalize``): case,
+Arabic diacritics and tatweel are dropped, alef/ya/ta-marbuta variants are
+folded (أ إ آ ٱ -> ا, ى -> ي, ة -> ه) and Arabic-Indic digits become 0-9, so
+"مدرسة" finds "مَدْرَسه" and "١٢٣" finds plate "123".
+
+Every query word must match a word of the name: exactly (3 points), as a
+prefix (2) or inside it (1, words of 3+ letters). Names that equal or start
+with the whole query get a bonus; ties go to the shorter name. Prefixes are
+looked up in a prefix map, infixes through a trigram map, so no name is
+scanned.
+
+The index is held per process and follows the network change log
+(``NetworkChange``, see network.py): on a new network version only the
+changed stops, lines and buses are re-indexed, including the ones logged in
+the overlap window below the index's version (``network.changes_since``). A
+full rebuild happens when the log no longer reaches back to the index's
+version, and at least every ``BUS_TRACKING_NETWORK_INDEX_TTL`` seconds.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .network import changes_since, index_ttl
+
+KIND_STOP = 'bus_stops'
+KIND_BUS = 'buses'
+KIND_LINE = 'bus_lines'
+KINDS = (KIND_STOP, KIND_BUS, KIND_LINE)
+
+# Longest prefix kept in the prefix map; longer query words are checked
+# against the candidates of their first MAX_PREFIX letters
+MAX_PREFIX = 12
+NGRAM = 3
+
+Key = Tuple[str, int]  # (kind, id)
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')  # harakat, Quranic marks, tatweel
+_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # ٠-٩
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # ۰-۹ (Persian)
+})
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text: Optional[str]) -> str:
+    """
+    Search form of a name: folded, without diacritics, words separated by single spaces.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _DIACRITICS.sub('', text).translate(_FOLD)
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def _ngrams(word: str) -> Set[str]:
+    return {word[i:i + NGRAM] for i in range(len(word) - NGRAM + 1)}
+
+
+class _Entry:
+    __slots__ = ('text', 'words')
+
+    def __init__(self, text: str, words: Tuple[str, ...]):
+        self.text = text
+        self.words = words
+
+
+class SearchIndex:
+    """
+    Normalized names of stops, lines and buses with prefix and trigram maps.
+    """
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.entries: Dict[Key, _Entry] = {}
+        self.prefixes: Dict[str, Set[Key]] = defaultdict(set)
+        self.ngrams: Dict[str, Set[Key]] = defaultdict(set)
+
+    # --- building ---
+
+    def add(self, kind: str, obj_id: int, name: Optional[str]) -> None:
+        key = (kind, obj_id)
+        self.remove(key)
+        text = normalize(name)
+        if not text:
+            return
+        words = text.split()
+        if kind == KIND_BUS and len(words) > 1:
+            words.append(''.join(words))  # plates are often typed without separators
+        entry = self.entries[key] = _Entry(text, tuple(words))
+        for word in self._grams(entry):
+            self.ngrams[word].add(key)
+        for prefix in self._prefixes(entry):
+            self.prefixes[prefix].add(key)
+
+    def remove(self, key: Key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for gram_map, grams in ((self.prefixes, self._prefixes(entry)), (self.ngrams, self._grams(entry))):
+            for gram in grams:
+                keys = gram_map.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del gram_map[gram]
+
+    @staticmethod
+    def _prefixes(entry: _Entry) -> Set[str]:
+        return {word[:length] for word in entry.words for length in range(1, min(len(word), MAX_PREFIX) + 1)}
+
+    @staticmethod
+    def _grams(entry: _Entry) -> Set[str]:
+        return set().union(*(_ngrams(word) for word in entry.words))
+
+    def load(self, kinds_and_ids: Optional[Dict[str, Iterable[int]]] = None) -> None:
+        """
+        (Re-)indexes the given ids per kind from the database, or everything.
+        Ids that no longer exist are dropped from the index.
+        """
+        from .models import Bus, BusLine, BusStop
+
+        sources = {
+            KIND_STOP: (BusStop, 'stop_id', 'stop_name'),
+            KIND_BUS: (Bus, 'bus_id', 'license_plate'),
+            KIND_LINE: (BusLine, 'route_id', 'route_name'),
+        }
+        for kind, (model, id_field, name_field) in sources.items():
+            queryset = model.objects.all()
+            if kinds_and_ids is not None:
+                ids = set(kinds_and_ids.get(kind, ()))
+                if not ids:
+                    continue
+                for obj_id in ids:
+                    self.remove((kind, obj_id))
+                queryset = queryset.filter(**{f'{id_field}__in': ids})
+            for obj_id, name in queryset.values_list(id_field, name_field):
+                self.add(kind, obj_id, name)
+
+    def refresh(self, version: int) -> bool:
+        """
+        Brings the index to ``version`` by re-indexing what the change log
+        lists since the index's own version. False when the log no longer
+        reaches back that far (the index must be rebuilt).
+        """
+        from django.db.models import Min
+        from .models import NetworkChange
+
+        if version == self.version:
+            return True
+        first = NetworkChange.objects.aggregate(first=Min('id'))['first']
+        if version < self.version or first is None or first > self.version + 1:
+            return False
+        kinds = {
+            NetworkChange.ENTITY_STOP: KIND_STOP,
+            NetworkChange.ENTITY_BUS: KIND_BUS,
+            NetworkChange.ENTITY_LINE: KIND_LINE,
+        }
+        changed = defaultdict(set)
+        for entity, entity_id in changes_since(self.version).filter(
+                id__lte=version).values_list('entity', 'entity_id'):
+            if entity in kinds:  # line stops/segments do not change any name
+                changed[kinds[entity]].add(entity_id)
+        self.load(changed)
+        self.version = version
+        return True
+
+    # --- querying ---
+
+    def _candidates(self, word: str) -> Set[Key]:
+        candidates = set(self.prefixes.get(word[:MAX_PREFIX], ()))
+        if len(word) >= NGRAM:
+            grams = sorted(_ngrams(word), key=lambda gram: len(self.ngrams.get(gram, ())))
+            infix = set(self.ngrams.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not infix:
+                    break
+                infix &= self.ngrams.get(gram, set())
+            candidates |= infix
+        return candidates
+
+    @staticmethod
+    def _word_score(query_word: str, words: Tuple[str, ...]) -> int:
+        best = 0
+        for word in words:
+            if word == query_word:
+                return 3
+            if word.startswith(query_word):
+                best = 2
+            elif best == 0 and len(query_word) >= NGRAM and query_word in word:
+                best = 1
+        return best
+
+    def search(self, query: str, kinds: Iterable[str] = KINDS, limit: int = 10) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        ``{kind: [(id, score), ...]}``, best first, at most ``limit`` per kind.
+        """
+        kinds = tuple(kinds)
+        results = {kind: [] for kind in kinds}
+        text = normalize(query)
+        if not text:
+            return results
+        query_words = sorted(set(text.split()), key=len, reverse=True)
+
+        candidates = None
+        for word in query_words:  # the longest word usually narrows the most
+            found = self._candidates(word)
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return results
+
+        ranked = defaultdict(list)
+        for key in candidates:
+            kind, obj_id = key
+            if kind not in results:
+                continue
+            entry = self.entries[key]
+            score = 0
+            for word in query_words:
+                word_score = self._word_score(word, entry.words)
+                if not word_score:
+                    break
+                score += word_score
+            else:
+                if entry.text == text:
+                    score += 3
+                elif entry.text.startswith(text):
+                    score += 1
+                ranked[kind].append((-score, len(entry.text), obj_id))
+
+        for kind, rows in ranked.items():
+            rows.sort()
+            results[kind] = [(obj_id, -neg_score) for neg_score, _, obj_id in rows[:limit]]
+        return results
+
+
+_lock = threading.Lock()
+_index: Optional[SearchIndex] = None
+
+
+def search(query: str, version: int, kinds: Iterable[str] = KINDS, limit: int = 10) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    ``SearchIndex.search`` on the per-process index, first brought up to ``version``.
+    """
+    global _index
+    with _lock:
+        if (_index is None or time.monotonic() - _index.built_at >= index_ttl()
+                or not _index.refresh(version)):
+            _index = SearchIndex(version)
+            _index.load()
+        return _index.search(query, kinds, limit)
+
+
+def clear_index() -> None:
+    global _index
+    with _lock:
+        _index = None
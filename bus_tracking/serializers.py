@@ -1,5 +1,6 @@
 # bus_tracking/serializers.py
 
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import (
     Bus,
@@ -8,8 +9,10 @@ from .models import (
     Location,
     BusLocationLog,
     Alert,
-    BusLineStop
+    BusLineStop,
+    RouteSegment
 )
+from .geometry import SNAPSHOT_ZOOM, level_for_zoom
 
 # This serializer must be defined BEFORE BusSerializer uses it.
 class BusLineSerializer(serializers.ModelSerializer):
@@ -20,15 +23,37 @@ class BusLineSerializer(serializers.ModelSerializer):
 # Extended serializer that includes stops (for initial-data endpoint)
 class BusLineWithStopsSerializer(serializers.ModelSerializer):
     stops = serializers.SerializerMethodField()
+    geometry = serializers.SerializerMethodField()
     
     class Meta:
         model = BusLine
-        fields = ['route_id', 'route_name', 'route_description', 'stops']
+        fields = ['route_id', 'route_name', 'route_description', 'stops', 'geometry']
     
+    @staticmethod
+    def prefetch_stops(queryset):
+        """
+        Loads the ordered stops and route segments of every line in one extra
+        query each (instead of one query per line in get_stops/get_geometry).
+        """
+        return queryset.prefetch_related(
+            Prefetch(
+                'buslinestop_set',
+                queryset=BusLineStop.objects.select_related('bus_stop__location').order_by('order'),
+                to_attr='ordered_line_stops',
+            ),
+            Prefetch(
+                'segments',
+                # Only the encodings: polyline_points can be large and is not sent
+                queryset=RouteSegment.objects.only('bus_line_id', 'order', 'encoded_polylines').order_by('order'),
+                to_attr='ordered_segments',
+            ),
+        )
+
     def get_stops(self, obj):
-        # Get all stops for this bus line in order
-        from .models import BusLineStop
-        bus_line_stops = BusLineStop.objects.filter(bus_line=obj).select_related('bus_stop', 'bus_stop__location').order_by('order')
+        # Get all stops for this bus line in order (prefetched by prefetch_stops when possible)
+        bus_line_stops = getattr(obj, 'ordered_line_stops', None)
+        if bus_line_stops is None:
+            bus_line_stops = BusLineStop.objects.filter(bus_line=obj).select_related('bus_stop', 'bus_stop__location').order_by('order')
         stops_data = []
         for bls in bus_line_stops:
             stop = bls.bus_stop
@@ -43,6 +68,14 @@ class BusLineWithStopsSerializer(serializers.ModelSerializer):
             })
         return stops_data
 
+    def get_geometry(self, obj):
+        # Encoded polyline of every segment in route order, at street level (see geometry.py)
+        segments = getattr(obj, 'ordered_segments', None)
+        if segments is None:
+            segments = RouteSegment.objects.filter(bus_line=obj).only('encoded_polylines').order_by('order')
+        level = level_for_zoom(SNAPSHOT_ZOOM)
+        return [segment.encoded_polyline(level) for segment in segments]
+
 # Define LocationSerializer before BusSerializer uses it
 class LocationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -90,13 +123,30 @@ class BusStopWithOrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'bus_stop', 'order']
 
 class BusLocationLogSerializer(serializers.ModelSerializer):
+    # Flat: bus and location are ids, the coordinates come from the (select_related) location
+    latitude = serializers.FloatField(source='location.latitude', read_only=True)
+    longitude = serializers.FloatField(source='location.longitude', read_only=True)
+
     class Meta:
         model = BusLocationLog
-        fields = '__all__'
-        depth = 1
+        fields = ['id', 'bus', 'location', 'latitude', 'longitude', 'speed', 'timestamp']
+
+class BusLocationHistorySerializer(serializers.Serializer):
+    """
+    Lean, read-only history row: works on the flat dicts of
+    location_history.history_rows (no nested Bus/Location).
+    """
+    id = serializers.IntegerField(read_only=True)
+    bus_id = serializers.IntegerField(read_only=True)
+    timestamp = serializers.DateTimeField(read_only=True)
+    latitude = serializers.FloatField(read_only=True)
+    longitude = serializers.FloatField(read_only=True)
+    speed = serializers.FloatField(read_only=True)
 
 class AlertSerializer(serializers.ModelSerializer):
+    # Flat: bus is an id; the plate is all the dashboard shows (needs select_related('bus'))
+    bus_license_plate = serializers.CharField(source='bus.license_plate', read_only=True, default=None)
+
     class Meta:
         model = Alert
-        fields = '__all__'
-        depth = 1
\ No newline at end of file
+        fields = ['alert_id', 'bus', 'bus_license_plate', 'alert_type', 'message', 'timestamp', 'is_resolved']
\ No newline at end of file
@@ -0,0 +1,118 @@
+# bus_tracking/signals.py
+"""
+Model signal handlers. Connected in BusTrackingConfig.ready().
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .live_state import live_state
+from .middleware import token_cache
+from .models import Bus, BusLine, BusLineStop, BusStop, Location, NetworkChange, RouteSegment
+from .network import record_change
+from .read_cache import bump_model_version
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    # Also covers a new token whose key was cached as invalid
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens(sender, instance, **kwargs):
+    # e.g. a deactivated user must not keep connecting with a cached token
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Bus)
+def drop_deleted_bus_from_live_state(sender, instance, **kwargs):
+    # Keeps deleted buses out of WebSocket snapshots
+    live_state.remove(instance.bus_id)
+
+
+# --- Network change log (initial-data snapshot and delta sync, see network.py) ---
+
+def _action(signal):
+    return NetworkChange.ACTION_DELETE if signal is post_delete else NetworkChange.ACTION_UPSERT
+
+
+@receiver(post_save, sender=BusStop)
+@receiver(post_delete, sender=BusStop)
+def record_stop_change(sender, instance, signal, **kwargs):
+    record_change(NetworkChange.ENTITY_STOP, instance.stop_id, _action(signal))
+
+
+@receiver(post_save, sender=BusLine)
+@receiver(post_delete, sender=BusLine)
+def record_line_change(sender, instance, signal, **kwargs):
+    record_change(NetworkChange.ENTITY_LINE, instance.route_id, _action(signal))
+
+
+@receiver(pre_delete, sender=BusLine)
+def record_line_delete_buses(sender, instance, **kwargs):
+    # Deleting a line sets its buses' bus_line to NULL with a bulk update
+    # (no Bus signals); read the ids while the buses still point to it
+    for bus_id in instance.bus_set.values_list('bus_id', flat=True):
+        record_change(NetworkChange.ENTITY_BUS, bus_id)
+
+
+@receiver(post_save, sender=BusLineStop)
+@receiver(post_delete, sender=BusLineStop)
+@receiver(post_save, sender=RouteSegment)
+@receiver(post_delete, sender=RouteSegment)
+def record_line_part_change(sender, instance, **kwargs):
+    # Line stops and segments are sent as part of their line; logged apart
+    # from the line row, which buses embed too
+    record_change(NetworkChange.ENTITY_LINE_PART, instance.bus_line_id)
+
+
+@receiver(post_delete, sender=Bus)
+def record_bus_delete(sender, instance, **kwargs):
+    record_change(NetworkChange.ENTITY_BUS, instance.bus_id, NetworkChange.ACTION_DELETE)
+
+
+@receiver(post_save, sender=Bus)
+def record_bus_save(sender, instance, update_fields=None, **kwargs):
+    # Position fixes only save current_location; the snapshot TTL covers those
+    if update_fields is not None and set(update_fields) <= {'current_location'}:
+        return
+    record_change(NetworkChange.ENTITY_BUS, instance.bus_id)
+
+
+@receiver(post_save, sender=Location)
+def record_location_edit(sender, instance, created, **kwargs):
+    # Every position fix creates a new Location; only edits (e.g. moving a stop) matter
+    if created:
+        return
+    for stop_id in BusStop.objects.filter(location=instance).values_list('stop_id', flat=True):
+        record_change(NetworkChange.ENTITY_STOP, stop_id)
+
+
+# --- Read cache model versions (see read_cache.py) ---
+
+@receiver(post_save, sender=BusStop)
+@receiver(post_delete, sender=BusStop)
+@receiver(post_save, sender=BusLine)
+@receiver(post_delete, sender=BusLine)
+@receiver(post_save, sender=BusLineStop)
+@receiver(post_delete, sender=BusLineStop)
+@receiver(post_save, sender=Bus)
+@receiver(post_delete, sender=Bus)
+@receiver(post_delete, sender=Location)
+def bump_read_cache_version(sender, **kwargs):
+    # After commit: a response rebuilt in between would be cached under the
+    # new version with the old data
+    transaction.on_commit(lambda: bump_model_version(sender))
+
+
+@receiver(post_save, sender=Location)
+def bump_read_cache_version_on_location_edit(sender, created, **kwargs):
+    # A new Location (every position fix) is not in any cached response until
+    # the stop/bus pointing to it is saved, which bumps that model
+    if not created:
+        transaction.on_commit(lambda: bump_model_version(sender))
@@ -0,0 +1,191 @@
+# bus_tracking/spatial.py
+"""
+Spatial helpers shared by the live tracking pipeline.
+
+The map is divided into a fixed grid of square cells (in degrees). Buses are
+bucketed into the cell that contains their last position, and map clients
+subscribe to the cells covered by their visible viewport. The same grid
+indexes bus stops for nearby-stop lookups (``StopIndex``).
+"""
+
+import heapq
+import math
+import threading
+import time
+from typing import Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+
+from .network import index_is_current
+
+Cell = Tuple[int, int]
+
+# ~1.1 km at the equator. Small enough that a city viewport covers a few dozen
+# cells, large enough that a moving bus does not change cell on every fix.
+DEFAULT_CELL_DEG = 0.01
+
+
+def grid_cell_deg() -> float:
+    return float(getattr(settings, 'BUS_TRACKING_GRID_CELL_DEG', DEFAULT_CELL_DEG))
+
+
+def cell_for(lat: float, lon: float, cell_deg: Optional[float] = None) -> Cell:
+    """
+    Returns the (row, col) grid cell containing the given point.
+    """
+    size = cell_deg or grid_cell_deg()
+    return int(math.floor(lat / size)), int(math.floor(lon / size))
+
+
+def cells_for_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                   cell_deg: Optional[float] = None) -> Set[Cell]:
+    """
+    Returns every grid cell that intersects the bounding box (inclusive).
+    """
+    size = cell_deg or grid_cell_deg()
+    row_min, col_min = cell_for(min_lat, min_lon, size)
+    row_max, col_max = cell_for(max_lat, max_lon, size)
+    return {
+        (row, col)
+        for row in range(row_min, row_max + 1)
+        for col in range(col_min, col_max + 1)
+    }
+
+
+def bbox_cell_count(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                    cell_deg: Optional[float] = None) -> int:
+    """
+    Number of cells a bounding box covers, without materializing them.
+    """
+    size = cell_deg or grid_cell_deg()
+    row_min, col_min = cell_for(min_lat, min_lon, size)
+    row_max, col_max = cell_for(max_lat, max_lon, size)
+    return (row_max - row_min + 1) * (col_max - col_min + 1)
+
+
+def parse_bbox(data) -> Tuple[float, float, float, float]:
+    """
+    Parses a bounding box sent by a client into (min_lat, min_lon, max_lat, max_lon).
+
+    Accepts either a list ``[south, west, north, east]`` or a dict with
+    ``south/west/north/east`` keys. Raises ValueError on malformed input.
+    """
+    if isinstance(data, dict):
+        values = [data.get('south'), data.get('west'), data.get('north'), data.get('east')]
+    elif isinstance(data, (list, tuple)) and len(data) == 4:
+        values = list(data)
+    else:
+        raise ValueError('bbox must be [south, west, north, east]')
+
+    try:
+        south, west, north, east = (float(v) for v in values)
+    except (TypeError, ValueError):
+        raise ValueError('bbox values must be numbers')
+
+    if not all(math.isfinite(v) for v in (south, west, north, east)):
+        raise ValueError('bbox values must be finite')
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= east <= 180):
+        raise ValueError('bbox must satisfy south <= north and west <= east')
+    return south, west, north, east
+
+
+def cell_group_name(cell: Cell) -> str:
+    """
+    Channel-layer group for a grid cell (e.g. ``bus_cell_3552_3579``).
+    """
+    row, col = cell
+    return f'bus_cell_{row}_{col}'
+
+
+def cell_group_names(cells: Iterable[Cell]) -> Set[str]:
+    return {cell_group_name(cell) for cell in cells}
+
+
+# --- Nearby stops -----------------------------------------------------------
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG_LAT = 111320.0
+
+
+def radius_bbox(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """
+    Bounding box (min_lat, min_lon, max_lat, max_lon) of a circle, clamped to valid coordinates.
+    """
+    pad_lat = radius_m / METERS_PER_DEG_LAT
+    pad_lon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return (max(lat - pad_lat, -90.0), max(lon - pad_lon, -180.0),
+            min(lat + pad_lat, 90.0), min(lon + pad_lon, 180.0))
+
+
+class StopIndex:
+    """
+    Stops of one network version bucketed into the grid cells above, for
+    ``nearby`` lookups without scanning every stop.
+
+    ``rows`` are ``(stop_id, stop_name, location_id, lat, lon)`` tuples. Only
+    the stops in the cells covering the search circle are measured, then
+    ranked by distance.
+    """
+
+    def __init__(self, version: int, rows: Iterable[tuple], cell_deg: Optional[float] = None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.cell_deg = cell_deg or grid_cell_deg()
+        self.stops = []
+        self.cells = {}
+        for stop_id, name, location_id, lat, lon in rows:
+            if lat is None or lon is None:
+                continue
+            # radians and cos(lat) precomputed once, the haversine below only does the rest
+            rad_lat, rad_lon = math.radians(lat), math.radians(lon)
+            self.cells.setdefault(cell_for(lat, lon, self.cell_deg), []).append(
+                (rad_lat, rad_lon, math.cos(rad_lat), len(self.stops)))
+            self.stops.append((stop_id, name, location_id, lat, lon))
+
+    @classmethod
+    def load(cls, version: int) -> 'StopIndex':
+        from .models import BusStop
+
+        return cls(version, BusStop.objects.values_list(
+            'stop_id', 'stop_name', 'location_id', 'location__latitude', 'location__longitude'))
+
+    def nearby(self, lat: float, lon: float, radius_m: float, limit: int) -> list:
+        """
+        Up to ``limit`` ``(distance_m, stop row)`` pairs within ``radius_m``, nearest first.
+        """
+        rad_lat, rad_lon = math.radians(lat), math.radians(lon)
+        cos_lat = math.cos(rad_lat)
+        # Compare haversine's ``a`` term instead of the distance: no sqrt/asin per stop
+        max_a = math.sin(min(radius_m / EARTH_RADIUS_M, math.pi) / 2) ** 2
+        sin, candidates = math.sin, []
+        for cell in cells_for_bbox(*radius_bbox(lat, lon, radius_m), self.cell_deg):
+            for s_lat, s_lon, s_cos, position in self.cells.get(cell, ()):
+                a = sin((s_lat - rad_lat) / 2) ** 2 + cos_lat * s_cos * sin((s_lon - rad_lon) / 2) ** 2
+                if a <= max_a:
+                    candidates.append((a, position))
+        return [
+            (2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0))), self.stops[position])
+            for a, position in heapq.nsmallest(limit, candidates)
+        ]
+
+    def __len__(self):
+        return len(self.stops)
+
+
+_stop_index_lock = threading.Lock()
+_stop_index: Optional[StopIndex] = None
+
+
+def get_stop_index(version: int) -> StopIndex:
+    """
+    The per-process StopIndex, rebuilt when the network version changes and
+    at least every ``BUS_TRACKING_NETWORK_INDEX_TTL`` seconds.
+    """
+    global _stop_index
+    index = _stop_index
+    if index_is_current(index, version):
+        return index
+    with _stop_index_lock:
+        if not index_is_current(_stop_index, version):
+            _stop_index = StopIndex.load(version)
+        return _stop_index
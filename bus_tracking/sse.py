@@ -0,0 +1,182 @@
+# bus_tracking/sse.py
+"""
+Server-Sent Events stream of live bus positions.
+
+For clients that cannot use WebSockets (e.g. behind proxies that break the
+upgrade) and would otherwise poll ``/api/buses/``. The stream is fed from the
+same channel-layer groups as ``BusLocationConsumer``, so every event carries
+the frame the broadcast pipeline already serialized.
+
+    GET /api/stream/positions/
+        ?bbox=south,west,north,east   only buses inside this area (grid cells)
+        ?bus_id=1,2                   only these buses
+        ?bus_line_id=3                only buses of these lines
+
+Every event's ``data`` is a JSON message (``fleet_snapshot`` first, then
+``bus_locations_batch``) and its ``id`` is the broadcast sequence number, so
+the browser's automatic reconnect (``Last-Event-ID``) resumes where the
+stream stopped, or starts over with a snapshot if that is too far back.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Set
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from . import fastjson
+from .broadcast import FLEET_GROUP, batch_frame, follower, frame_data_json, message_entries, scheduler
+from .history import history
+from .live_state import live_state
+from .spatial import bbox_cell_count, cells_for_bbox, cell_group_name, parse_bbox
+
+logger = logging.getLogger(__name__)
+
+# Comment line sent when nothing happened for a while, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+RECONNECT_MS = 5000
+
+
+def _parse_ids(value: Optional[str]) -> Optional[Set[int]]:
+    if not value:
+        return None
+    return {int(item) for item in value.split(',') if item.strip()}
+
+
+def _event(data: str, seq: Optional[int] = None) -> str:
+    if seq is None:
+        return f'data: {data}\n\n'
+    return f'id: {seq}\ndata: {data}\n\n'
+
+
+class PositionFilter:
+    """
+    Keeps only the requested buses / lines. Works on quantized records
+    ``(bus_id, lat, lon, speed, ts, license_plate, bus_line_id)`` and on
+    state dicts.
+    """
+
+    def __init__(self, bus_ids: Optional[Set[int]] = None, line_ids: Optional[Set[int]] = None):
+        self.bus_ids = bus_ids
+        self.line_ids = line_ids
+
+    def __bool__(self):
+        return self.bus_ids is not None or self.line_ids is not None
+
+    def match(self, bus_id, bus_line_id) -> bool:
+        if self.bus_ids is not None and bus_id not in self.bus_ids:
+            return False
+        if self.line_ids is not None and bus_line_id not in self.line_ids:
+            return False
+        return True
+
+
+def message_event(message: dict, position_filter: PositionFilter) -> Optional[str]:
+    """
+    SSE event for a broadcast group message, or None if the filter leaves
+    nothing in it.
+    """
+    seq = message.get('seq')
+    if message.get('type') == 'bus_locations_batch' and message.get('text') and not position_filter:
+        return _event(message['text'], seq)
+
+    entries = message_entries(message)
+    if position_filter:
+        entries = [entry for entry in entries if position_filter.match(entry[1][1][0], entry[1][1][6])]
+    if not entries:
+        return None
+    return _event(batch_frame([frame_data_json(text) for _, (text, _) in entries], seq), seq)
+
+
+async def snapshot_event(cells, position_filter: PositionFilter) -> str:
+    if not live_state.loaded:
+        await database_sync_to_async(live_state.ensure_loaded)()
+    seq = history.last_seq
+    if cells is None and not position_filter:
+        buses_json = live_state.snapshot_json()
+    else:
+        buses = live_state.snapshot(cells)
+        if position_filter:
+            buses = [bus for bus in buses if position_filter.match(bus['bus_id'], bus.get('bus_line_id'))]
+        buses_json = fastjson.dumps(buses)
+    return _event('{"type": "fleet_snapshot", "seq": ' + str(seq) + ', "buses": ' + buses_json + '}', seq)
+
+
+async def event_stream(channel_layer, topics, cells, position_filter, last_event_id):
+    channel = await channel_layer.new_channel()
+    for topic in topics:
+        await channel_layer.group_add(topic, channel)
+    await scheduler.ensure_running()
+    await follower.ensure_running()
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+
+        missed = None
+        if last_event_id:
+            try:
+                missed = history.since(topics, int(last_event_id))
+            except ValueError:
+                missed = None
+        if missed is None:
+            yield await snapshot_event(cells, position_filter)
+        else:
+            for message in missed:
+                event = message_event(message, position_filter)
+                if event:
+                    yield event
+
+        while True:
+            try:
+                message = await asyncio.wait_for(channel_layer.receive(channel), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            event = message_event(message, position_filter)
+            if event:
+                yield event
+    finally:
+        for topic in topics:
+            try:
+                await channel_layer.group_discard(topic, channel)
+            except Exception as e:
+                logger.error(f"SSE cleanup error for group {topic}: {e}")
+
+
+@require_GET
+async def stream_positions_view(request):
+    """
+    Live positions as text/event-stream (see module docstring).
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return JsonResponse({'error': 'Live tracking is not configured'}, status=503)
+
+    try:
+        position_filter = PositionFilter(
+            bus_ids=_parse_ids(request.GET.get('bus_id')),
+            line_ids=_parse_ids(request.GET.get('bus_line_id')),
+        )
+        cells = None
+        bbox = request.GET.get('bbox')
+        if bbox:
+            south, west, north, east = parse_bbox(bbox.split(','))
+            max_cells = getattr(settings, 'BUS_TRACKING_MAX_VIEWPORT_CELLS', 400)
+            if bbox_cell_count(south, west, north, east) <= max_cells:
+                cells = cells_for_bbox(south, west, north, east)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    topics = [FLEET_GROUP] if cells is None else [cell_group_name(cell) for cell in cells]
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+
+    response = StreamingHttpResponse(
+        event_stream(channel_layer, topics, cells, position_filter, last_event_id),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
@@ -1,3 +1,1201 @@
+import asyncio
+import copy
+import csv
+import gzip
+import io
+import json
+import math
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .broadcast import FLEET_GROUP, batch_message, follower, frame_data_json, message_entries, message_states, scheduler
+from .consumers import BusLocationConsumer
+from .geometry import decode, encode_levels, simplify
+from .history import UpdateHistory, history
+from .live_state import LiveStateStore, live_state
+from .location_history import iter_history
+from .middleware import _MISSING, TokenCache, get_user_for_token, token_cache
+from .read_cache import stats as read_cache_stats
+from .search import clear_index as clear_search_index, normalize
+from .models import Alert, Bus, BusLine, BusLineStop, BusLocationLog, BusStop, Location, NetworkChange, RouteSegment
+from .network import _publish_version, clear_snapshot_cache, network_version
+from .outbox import Outbox, stats as outbox_stats
+from . import search as search_module, spatial
+from .spatial import StopIndex, cell_for, cell_group_name
+from .sse import PositionFilter, event_stream, message_event
+from .journeys import JourneyGraph, get_graph as get_journey_graph
+from .tiles import get_index as get_tile_index, tile_bounds
+from .views import haversine
+from .wire import FORMAT_BINARY, FORMAT_COMPACT, DeltaEncoder, decode_binary_frame, quantize_state
+
+
+class InitialDataQueryCountTests(TestCase):
+    """
+    initial-data must issue a fixed number of queries whatever the network size:
+    stops, buses, lines and one prefetch each for all line stops and segments.
+    """
+
+    EXPECTED_QUERIES = 5
+
+    def setUp(self):
+        clear_snapshot_cache()  # the endpoint is served from a cached snapshot
+
+    def create_network(self, lines, stops_per_line):
+        for line_index in range(lines):
+            line = BusLine.objects.create(route_name=f'Line {line_index}')
+            Bus.objects.create(license_plate=f'BUS-{line_index}', bus_line=line)
+            for order in range(1, stops_per_line + 1):
+                stop = BusStop.objects.create(
+                    stop_name=f'Stop {line_index}-{order}',
+                    location=Location.objects.create(latitude=33.5 + order / 1000, longitude=36.3),
+                )
+                BusLineStop.objects.create(bus_line=line, bus_stop=stop, order=order)
+
+    def fetch_initial_data(self):
+        clear_snapshot_cache()
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/initial-data/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_small_network(self):
+        self.create_network(lines=2, stops_per_line=3)
+        data = self.fetch_initial_data()
+        self.assertEqual(data['count']['bus_lines'], 2)
+        self.assertEqual([stop['stop_name'] for stop in data['bus_lines'][0]['stops']],
+                         ['Stop 0-1', 'Stop 0-2', 'Stop 0-3'])
+
+    def test_query_count_does_not_grow_with_network(self):
+        self.create_network(lines=15, stops_per_line=6)
+        data = self.fetch_initial_data()
+        self.assertEqual(data['count']['bus_lines'], 15)
+        self.assertTrue(all(len(line['stops']) == 6 for line in data['bus_lines']))
+
+
+class InitialDataSnapshotTests(TestCase):
+    """
+    initial-data is served from a gzipped snapshot with a content ETag, answering 304 while nothing changed.
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_snapshot_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stop = BusStop.objects.create(
+                stop_name='Stop A', location=Location.objects.create(latitude=33.5, longitude=36.3))
+
+    def test_etag_and_gzip(self):
+        response = self.client.get('/api/initial-data/')
+        etag = response['ETag']
+        self.assertEqual(response.json()['bus_stops'][0]['stop_name'], 'Stop A')
+        self.assertEqual(response.json()['network_version'], network_version())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/initial-data/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            zipped = self.client.get('/api/initial-data/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual((zipped['Content-Encoding'], zipped['ETag']), ('gzip', etag))
+        self.assertEqual(gzip.decompress(zipped.content), response.content)
+
+        # A rebuild with the same content keeps the ETag; a change does not
+        clear_snapshot_cache()
+        self.assertEqual(self.client.get('/api/initial-data/')['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stop.stop_name = 'Stop B'
+            self.stop.save()
+        response = self.client.get('/api/initial-data/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class InitialDataDeltaTests(TestCase):
+    """
+    initial-data?since= returns only what changed after a network version.
+    """
+
+    def setUp(self):
+        clear_snapshot_cache()
+        self.line = BusLine.objects.create(route_name='Line 1')
+        self.stop = BusStop.objects.create(
+            stop_name='Stop A', location=Location.objects.create(latitude=33.5, longitude=36.3),
+        )
+        BusLineStop.objects.create(bus_line=self.line, bus_stop=self.stop, order=1)
+        self.bus = Bus.objects.create(license_plate='BUS-1', bus_line=self.line)
+
+    def get(self, since):
+        response = self.client.get('/api/initial-data/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def current_version(self):
+        return NetworkChange.objects.latest('id').id
+
+    def age_log(self):
+        NetworkChange.objects.exclude(id=self.current_version()).update(changed_at=timezone.now() - timedelta(hours=1))
+
+    def test_no_changes(self):
+        self.age_log()
+        data = self.get(self.current_version())
+        self.assertFalse(data['full'])
+        self.assertEqual((data['bus_stops'], data['buses'], data['bus_lines']), ([], [], []))
+
+    def test_resends_the_overlap_window(self):
+        # A change logged shortly before the client's version may have
+        # committed after the client read it
+        self.age_log()
+        self.stop.stop_name = 'Stop B'
+        self.stop.save()
+        self.bus.save()
+        data = self.get(self.current_version())
+        self.assertEqual([stop['stop_name'] for stop in data['bus_stops']], ['Stop B'])
+        self.assertEqual(data['network_version'], self.current_version())
+
+    def test_published_version_never_goes_back(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stop.save()
+        version = self.current_version()
+        self.assertEqual(network_version(), version)
+        _publish_version(version - 1)  # an older transaction committing last
+        self.assertEqual(network_version(), version)
+
+    def test_updates_and_deletes(self):
+        self.age_log()
+        version = self.current_version()
+        self.stop.stop_name = 'Stop B'
+        self.stop.save()
+        other = BusStop.objects.create(stop_name='Gone', location=self.stop.location)
+        other_id = other.stop_id
+        other.delete()
+
+        data = self.get(version)
+        self.assertFalse(data['full'])
+        self.assertEqual([stop['stop_name'] for stop in data['bus_stops']], ['Stop B'])
+        # The line embeds the renamed stop; the bus only embeds the line's own fields
+        self.assertEqual([line['stops'][0]['stop_name'] for line in data['bus_lines']], ['Stop B'])
+        self.assertEqual(data['buses'], [])
+        self.assertEqual(data['deleted']['bus_stops'], [other_id])
+        self.assertEqual(data['network_version'], self.current_version())
+
+    def test_buses_follow_their_line_row_only(self):
+        self.age_log()
+        version = self.current_version()
+        other = BusStop.objects.create(stop_name='Stop C', location=self.stop.location)
+        BusLineStop.objects.create(bus_line=self.line, bus_stop=other, order=2)
+        data = self.get(version)
+        self.assertEqual([len(line['stops']) for line in data['bus_lines']], [2])
+        self.assertEqual(data['buses'], [])
+
+        version = self.current_version()
+        self.line.route_name = 'Line 1b'
+        self.line.save()
+        data = self.get(version)
+        self.assertEqual([bus['bus_line']['route_name'] for bus in data['buses']], ['Line 1b'])
+
+    def test_line_delete_reports_its_buses(self):
+        version = self.current_version()
+        line_id = self.line.route_id
+        self.line.delete()
+        data = self.get(version)
+        self.assertEqual(data['deleted']['bus_lines'], [line_id])
+        self.assertEqual([(bus['bus_id'], bus['bus_line']) for bus in data['buses']], [(self.bus.bus_id, None)])
+
+    def test_position_fixes_are_not_changes(self):
+        version = self.current_version()
+        self.bus.current_location = Location.objects.create(latitude=33.6, longitude=36.4)
+        self.bus.save(update_fields=['current_location'])
+        self.assertEqual(self.current_version(), version)
+
+    def test_compacted_log_falls_back_to_snapshot(self):
+        version = self.current_version()
+        self.stop.save()
+        NetworkChange.objects.filter(id__lte=version).delete()
+        self.assertTrue(self.get(version - 1)['full'])
+        self.assertFalse(self.get(version)['full'])
+
+    def test_future_or_invalid_version(self):
+        self.assertTrue(self.get(self.current_version() + 1)['full'])
+        response = self.client.get('/api/initial-data/', {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RouteGeometryTests(TestCase):
+    """
+    Route segments are served as encoded polylines, simplified per zoom level.
+    """
+
+    def setUp(self):
+        self.line = BusLine.objects.create(route_name='Line 1')
+        stops = [
+            BusStop.objects.create(
+                stop_name=f'Stop {index}',
+                location=Location.objects.create(latitude=33.5, longitude=36.3 + index / 100),
+            )
+            for index in range(2)
+        ]
+        # A straight road with a small kink in the middle
+        self.points = [[33.5, round(36.3 + step / 1000, 5)] for step in range(11)]
+        self.points[5] = [33.5001, 36.305]
+        self.segment = RouteSegment.objects.create(
+            bus_line=self.line, from_stop=stops[0], to_stop=stops[1], order=1,
+            distance_meters=900, polyline_points=self.points,
+        )
+
+    def test_simplify_keeps_endpoints_and_significant_points(self):
+        self.assertEqual(simplify(self.points, 10), [self.points[0], self.points[5], self.points[-1]])
+        self.assertEqual(simplify(self.points, 50), [self.points[0], self.points[-1]])
+
+    def test_encodings_are_precomputed_on_save(self):
+        levels = self.segment.encoded_polylines
+        self.assertEqual(levels, encode_levels(self.points))
+        self.assertEqual(decode(levels['full']), self.points)
+        self.assertEqual(len(decode(levels['10'])), 2)
+
+        self.segment.polyline_points = self.points[:3]
+        self.segment.save(update_fields=['polyline_points'])
+        self.segment.refresh_from_db()
+        self.assertEqual(len(decode(self.segment.encoded_polylines['full'])), 3)
+
+    def test_geometry_endpoint(self):
+        url = f'/api/bus-lines/{self.line.route_id}/geometry/'
+        data = self.client.get(url).json()
+        self.assertEqual(data['level'], 'full')
+        self.assertEqual(decode(data['segments'][0]['polyline']), self.points)
+        data = self.client.get(url, {'zoom': 9}).json()
+        self.assertEqual(data['level'], '10')
+        self.assertEqual(self.client.get(url, {'zoom': 'x'}).status_code, 400)
+
+
+class NetworkTileTests(TestCase):
+    """
+    /tiles/<z>/<x>/<y> returns the stops and segments on that tile, cached per network version.
+    """
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            line = BusLine.objects.create(route_name='Line 1')
+            stops = [
+                BusStop.objects.create(
+                    stop_name=f'Stop {index}',
+                    location=Location.objects.create(latitude=33.5, longitude=36.3 + index / 100),
+                )
+                for index in range(2)
+            ]
+            RouteSegment.objects.create(
+                bus_line=line, from_stop=stops[0], to_stop=stops[1], order=1,
+                distance_meters=900, polyline_points=[[33.5, 36.3], [33.5, 36.31]],
+            )
+
+    def tile_for(self, z, lat, lon):
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        south, west, north, east = tile_bounds(z, x, y)
+        self.assertTrue(south <= lat <= north and west <= lon <= east)
+        return f'/tiles/{z}/{x}/{y}'
+
+    def kinds(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(feature['properties']['k'] for feature in response.json()['features'])
+
+    def test_tile_contents(self):
+        self.assertEqual(self.kinds(self.tile_for(14, 33.5, 36.3)), ['segment', 'stop', 'stop'])
+        self.assertEqual(self.kinds(self.tile_for(10, 33.5, 36.3)), ['segment'])  # no stops below zoom 12
+        self.assertEqual(self.kinds(self.tile_for(14, 34.5, 37.3)), [])
+
+    def test_tile_is_cached_per_network_version(self):
+        url = self.tile_for(14, 33.5, 36.3)
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            BusStop.objects.filter(stop_name='Stop 0').get().delete()
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+        self.assertEqual(self.kinds(url), ['stop'])  # the segment went with its stop
+
+    def test_index_expires_and_loads_geometry_lazily(self):
+        version = network_version()
+        index = get_tile_index(version)
+        self.assertIs(get_tile_index(version), index)
+        self.assertEqual([segment.bbox for segment in index.segments], [(33.5, 36.3, 33.5, 36.31)])
+        self.assertIsNone(index.segments[0].encodings)
+        self.assertEqual(index.features(14, 0, 0), [])
+        self.assertIsNone(index.segments[0].encodings)  # not on that tile
+        with self.settings(BUS_TRACKING_NETWORK_INDEX_TTL=1):
+            index.built_at -= 1
+            self.assertIsNot(get_tile_index(version), index)
+
+    def test_index_buckets_features_by_cell(self):
+        index = get_tile_index(network_version())
+        self.assertEqual(sorted(len(positions) for positions in index.stop_cells.values()), [2])
+        # A miss only looks at the cells the tile covers, zoomed in or far out
+        self.assertEqual(index._in_cells(index.stop_cells, *tile_bounds(14, 0, 0)), [])
+        self.assertEqual(index._in_cells(index.stop_cells, *tile_bounds(0, 0, 0)), [0, 1])
+        self.assertEqual(index._in_cells(index.segment_cells, 33.49, 36.29, 33.51, 36.32), [0])
+
+    def test_out_of_range(self):
+        self.assertEqual(self.client.get('/tiles/2/4/0').status_code, 404)
+
+
+class LocationHistoryData:
+    """
+    Two buses with 25 logs each, one minute apart (speed = minute).
+    """
+
+    def setUp(self):
+        self.bus = Bus.objects.create(license_plate='BUS-1')
+        other = Bus.objects.create(license_plate='BUS-2')
+        self.start = timezone.now() - timedelta(hours=1)
+        for minute in range(25):
+            for bus in (self.bus, other):
+                log = BusLocationLog.objects.create(
+                    bus=bus, location=Location.objects.create(latitude=33.5, longitude=36.3 + minute / 1000),
+                    speed=minute,
+                )
+                # timestamp is auto_now_add
+                BusLocationLog.objects.filter(pk=log.pk).update(timestamp=self.start + timedelta(minutes=minute))
+
+
+class LocationHistoryTests(LocationHistoryData, TestCase):
+    """
+    /api/location-logs/ pages through one bus's history by cursor, newest first.
+    """
+
+    def fetch_all(self, **params):
+        url, query, rows = '/api/location-logs/', {'bus': self.bus.bus_id, 'page_size': 10, **params}, []
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url, query).json()
+            rows.extend(data['results'])
+            url, query = data['next'], None
+        return rows
+
+    def test_pages_cover_the_range_newest_first(self):
+        rows = self.fetch_all()
+        self.assertEqual([row['speed'] for row in rows], list(range(24, -1, -1)))
+        self.assertEqual({row['bus_id'] for row in rows}, {self.bus.bus_id})
+        self.assertEqual(set(rows[0]), {'id', 'bus_id', 'timestamp', 'latitude', 'longitude', 'speed'})
+
+    def test_time_range(self):
+        rows = self.fetch_all(
+            since=(self.start + timedelta(minutes=5)).isoformat(),
+            until=(self.start + timedelta(minutes=8)).isoformat(),
+        )
+        self.assertEqual([row['speed'] for row in rows], [7, 6, 5])
+
+    def test_bus_is_required(self):
+        self.assertEqual(self.client.get('/api/location-logs/').status_code, 400)
+        self.assertEqual(self.client.get('/api/location-logs/', {'bus': 1, 'since': 'x'}).status_code, 400)
+
+
+class LocationHistoryExportTests(LocationHistoryData, TestCase):
+    """
+    /api/export/location-logs/ streams the same rows as NDJSON or CSV.
+    """
+
+    def setUp(self):
+        super().setUp()
+        staff = get_user_model().objects.create_user('analyst', password='pw', is_staff=True)
+        self.client.force_login(staff)
+
+    def export(self, **params):
+        response = self.client.get('/api/export/location-logs/', params, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        return gzip.decompress(b''.join(response.streaming_content)).decode()
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export(bus=self.bus.bus_id).splitlines()]
+        self.assertEqual([row['speed'] for row in rows], list(range(25)))
+
+    def test_csv_all_buses_in_small_batches(self):
+        rows = list(iter_history(batch_size=4))
+        self.assertEqual(len(rows), 50)
+        reader = csv.DictReader(io.StringIO(self.export(output='csv')))
+        self.assertEqual([(int(row['bus_id']), float(row['speed'])) for row in reader],
+                         [(row['bus_id'], row['speed']) for row in rows])
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertIn(self.client.get('/api/export/location-logs/').status_code, (401, 403))
+
+
+class BusTrackTests(TestCase):
+    """
+    /api/buses/<id>/track/ returns the simplified path; closed days are cached.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.bus = Bus.objects.create(license_plate='BUS-1')
+        start = timezone.make_aware(datetime(2025, 3, 1, 10, 0))
+        # East along a street, then a turn north
+        path = [(33.5, 36.3 + step / 1000) for step in range(20)] + [(33.5 + step / 1000, 36.319) for step in range(1, 10)]
+        for index, (lat, lon) in enumerate(path):
+            log = BusLocationLog.objects.create(bus=self.bus, location=Location.objects.create(latitude=lat, longitude=lon))
+            BusLocationLog.objects.filter(pk=log.pk).update(timestamp=start + timedelta(seconds=10 * index))
+        self.url = f'/api/buses/{self.bus.bus_id}/track/'
+        self.day = {'from': '2025-03-01T00:00:00Z', 'to': '2025-03-02T00:00:00Z'}
+
+    def test_simplified_track(self):
+        data = self.client.get(self.url, self.day).json()
+        self.assertEqual(decode(data['polyline']), [[33.5, 36.3], [33.5, 36.319], [33.509, 36.319]])
+        self.assertEqual(len(data['timestamps']), 3)
+        self.assertEqual(data['timestamps'][1] - data['timestamps'][0], 190)
+
+        raw = self.client.get(self.url, {**self.day, 'tolerance': 0}).json()
+        self.assertEqual(len(raw['timestamps']), 29)
+
+    def test_closed_day_is_cached(self):
+        first = self.client.get(self.url, self.day).json()
+        with self.assertNumQueries(1):  # the bus itself
+            self.assertEqual(self.client.get(self.url, self.day).json(), first)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'tolerance': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': '2025-03-02T00:00:00Z', 'to': '2025-03-01T00:00:00Z'}).status_code, 400)
+
+
+class AlertListTests(TestCase):
+    """
+    /api/alerts/ lists unresolved alerts by default, flat, in one query.
+    """
+
+    def setUp(self):
+        for index in range(30):
+            bus = Bus.objects.create(license_plate=f'BUS-{index}')
+            Alert.objects.create(bus=bus, alert_type='OFF_ROUTE', message=f'Alert {index}', is_resolved=index % 3 == 0)
+
+    def test_unresolved_by_default_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/alerts/', {'page_size': 5}).json()
+        self.assertEqual([alert['message'] for alert in data['results']],
+                         ['Alert 29', 'Alert 28', 'Alert 26', 'Alert 25', 'Alert 23'])
+        self.assertEqual(data['results'][0]['bus_license_plate'], 'BUS-29')
+        self.assertIsInstance(data['results'][0]['bus'], int)
+
+    def test_resolved_filter(self):
+        resolved = self.client.get('/api/alerts/', {'resolved': 'true'}).json()['results']
+        self.assertEqual(len(resolved), 10)
+        self.assertEqual(len(self.client.get('/api/alerts/', {'resolved': 'all'}).json()['results']), 30)
+
+
+class JSONParsingTests(TestCase):
+    """
+    API bodies go through FastJSONParser (orjson when installed).
+    """
+
+    def test_create_and_reject_malformed_json(self):
+        bus = Bus.objects.create(license_plate='BUS-1')
+        response = self.client.post('/api/alerts/', '{"bus": %d, "message": "دمشق"}' % bus.bus_id,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['bus_license_plate'], 'BUS-1')
+        response = self.client.post('/api/alerts/', '{"bus": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReadCacheTests(TestCase):
+    """
+    bus-stops / bus-lines / buses are served from the cache until one of their models changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        read_cache_stats.clear()
+        self.stop = BusStop.objects.create(
+            stop_name='Stop A', location=Location.objects.create(latitude=33.5, longitude=36.3),
+        )
+
+    def test_hit_until_a_model_changes(self):
+        first = self.client.get('/api/bus-stops/').json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/bus-stops/').json(), first)
+
+        # Editing the stop's location invalidates once committed; a position
+        # fix (new Location) does not
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stop.location.latitude = 33.6
+            self.stop.location.save()
+            with self.assertNumQueries(0):
+                self.client.get('/api/bus-stops/')
+        self.assertEqual(self.client.get('/api/bus-stops/').json()[0]['location']['latitude'], 33.6)
+        with self.captureOnCommitCallbacks(execute=True):
+            Location.objects.create(latitude=1, longitude=1)
+        with self.assertNumQueries(0):
+            self.client.get('/api/bus-stops/')
+
+        self.assertEqual(read_cache_stats.snapshot()['busstop-list'], {'hits': 3, 'misses': 2})
+        self.assertEqual(self.client.get('/api/live-stats/').json()['read_cache']['busstop-list']['hits'], 3)
+
+    def test_stops_with_order(self):
+        line = BusLine.objects.create(route_name='Line 1')
+        BusLineStop.objects.create(bus_line=line, bus_stop=self.stop, order=1)
+        url = f'/api/bus-lines/{line.route_id}/stops_with_order/'
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            BusLineStop.objects.create(bus_line=line, bus_stop=self.stop, order=2)
+        self.assertEqual(len(self.client.get(url).json()), 2)
+
+
+class NearbyStopsTests(TestCase):
+    """
+    /api/bus-stops/nearby/ ranks stops by distance from the grid index, rebuilt on stop changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            for index, offset in enumerate((0.001, 0.003, 0.02)):  # ~110 m, ~330 m, ~2.2 km north
+                BusStop.objects.create(
+                    stop_name=f'Stop {index}',
+                    location=Location.objects.create(latitude=33.5 + offset, longitude=36.3),
+                )
+
+    def nearby(self, **params):
+        response = self.client.get('/api/bus-stops/nearby/', {'lat': 33.5, 'lon': 36.3, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(stop['stop_name'], stop['distance_m']) for stop in response.json()]
+
+    def test_ranked_within_radius(self):
+        stops = self.nearby()
+        self.assertEqual([name for name, _ in stops], ['Stop 0', 'Stop 1'])
+        self.assertAlmostEqual(stops[0][1], 111.2, delta=0.5)
+        self.assertEqual([name for name, _ in self.nearby(radius=3000, limit=2)], ['Stop 0', 'Stop 1'])
+        self.assertEqual(len(self.nearby(radius=3000)), 3)
+
+    def test_index_follows_stop_changes(self):
+        self.nearby()
+        with self.captureOnCommitCallbacks(execute=True):
+            BusStop.objects.create(
+                stop_name='Stop 3', location=Location.objects.create(latitude=33.5, longitude=36.3001))
+        self.assertEqual(self.nearby()[0][0], 'Stop 3')
+
+    def test_index_expires(self):
+        self.nearby()
+        # Not in the change log (as if committed below the current version)
+        BusStop.objects.bulk_create([
+            BusStop(stop_name='Stop 3', location=Location.objects.create(latitude=33.5, longitude=36.3001))])
+        self.assertEqual(self.nearby()[0][0], 'Stop 0')
+        with self.settings(BUS_TRACKING_NETWORK_INDEX_TTL=1):
+            spatial._stop_index.built_at -= 1
+            self.assertEqual(self.nearby()[0][0], 'Stop 3')
+
+    def test_invalid_params(self):
+        for params in ({'lat': 33.5}, {'lat': 'x', 'lon': 36.3}, {'lat': 91, 'lon': 0},
+                       {'lat': 33.5, 'lon': 36.3, 'radius': 0}, {'lat': 33.5, 'lon': 36.3, 'limit': 1000}):
+            self.assertEqual(self.client.get('/api/bus-stops/nearby/', params).status_code, 400, params)
+
+    def test_matches_brute_force(self):
+        rows = [(i, f'S{i}', i, 33.4 + (i % 50) / 250, 36.2 + (i // 50) / 250) for i in range(2500)]
+        index = StopIndex(0, rows, cell_deg=0.01)
+        lat, lon, radius = 33.47, 36.31, 1200
+        found = index.nearby(lat, lon, radius, 2500)
+        expected = [row for row in rows if haversine(lat, lon, row[3], row[4]) * 1000 <= radius]
+        self.assertEqual({row[0] for _, row in found}, {row[0] for row in expected})
+        distances = [distance for distance, _ in found]
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(distances[0], haversine(lat, lon, *found[0][1][3:]) * 1000, delta=0.01)
+
+
+class SearchTests(TestCase):
+    """
+    /api/search/ ranks normalized matches and follows model changes through the network change log.
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_search_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.line = BusLine.objects.create(route_name='المزة - البرامكة')
+            for name in ('مَدْرَسة المزة', 'ساحة الأمويين', 'المزة'):
+                BusStop.objects.create(stop_name=name, location=Location.objects.create(latitude=33.5, longitude=36.3))
+            Bus.objects.create(license_plate='١٢٣-456', qr_code_value='QR-1', bus_line=self.line)
+
+    def search(self, q, **params):
+        response = self.client.get('/api/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_normalize(self):
+        self.assertEqual(normalize('مَدْرَسةُ  الـمـزة - أبو رمانة ١٢٣'), 'مدرسه المزه ابو رمانه 123')
+
+    def test_ranked_and_normalized(self):
+        data = self.search('المزه')
+        self.assertEqual([stop['stop_name'] for stop in data['bus_stops']], ['المزة', 'مَدْرَسة المزة'])
+        self.assertEqual([line['route_id'] for line in data['bus_lines']], [self.line.route_id])
+        self.assertEqual(data['buses'], [])
+        self.assertEqual([stop['stop_name'] for stop in self.search('مدرسة الم')['bus_stops']], ['مَدْرَسة المزة'])
+        self.assertEqual(self.search('امويين')['bus_stops'][0]['location']['latitude'], 33.5)
+
+        bus = self.search('123456')['buses'][0]
+        self.assertEqual(bus['bus_line']['route_name'], 'المزة - البرامكة')
+        self.assertEqual(self.search('45', type='bus_stops'),
+                         {'query': '45', 'bus_stops': [], 'buses': [], 'bus_lines': []})
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.search('الشام')['bus_stops'], [])
+        stop = BusStop.objects.get(stop_name='المزة')
+        with self.captureOnCommitCallbacks(execute=True):
+            stop.stop_name = 'الشام'
+            stop.save()
+            self.line.delete()
+        self.assertEqual([s['stop_id'] for s in self.search('الشام')['bus_stops']], [stop.stop_id])
+        self.assertEqual(len(self.search('المزة')['bus_stops']), 1)
+        self.assertEqual(self.search('البرامكة')['bus_lines'], [])
+
+    def test_index_expires(self):
+        self.assertEqual(self.search('الشام')['bus_stops'], [])
+        # Not in the change log (as if committed below the current version)
+        BusStop.objects.bulk_create([
+            BusStop(stop_name='الشام', location=Location.objects.create(latitude=33.5, longitude=36.3))])
+        self.assertEqual(self.search('الشام')['bus_stops'], [])
+        with self.settings(BUS_TRACKING_NETWORK_INDEX_TTL=1):
+            search_module._index.built_at -= 1
+            self.assertEqual(len(self.search('الشام')['bus_stops']), 1)
+
+    def test_invalid_params(self):
+        for params in ({}, {'q': ' '}, {'q': 'x' * 101}, {'q': 'a', 'type': 'drivers'}, {'q': 'a', 'limit': 0}):
+            self.assertEqual(self.client.get('/api/search/', params).status_code, 400, params)
+
+
+class JourneyPlannerTests(TestCase):
+    """
+    /api/journeys/ returns the fastest journey and faster-than-fewer-rides alternatives.
+    """
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            # A-B-C-D ~1.8 km apart along a street, X off it, E ~110 m from D
+            coords = {'A': (33.5, 36.30), 'B': (33.5, 36.32), 'C': (33.5, 36.34), 'D': (33.5, 36.36),
+                      'X': (33.55, 36.33), 'E': (33.501, 36.36)}
+            self.stops = {
+                name: BusStop.objects.create(
+                    stop_name=name, location=Location.objects.create(latitude=lat, longitude=lon))
+                for name, (lat, lon) in coords.items()
+            }
+            self.add_line('1', 'ABC', 100)
+            self.add_line('2', 'CD', 100)
+            self.add_line('3', 'AXD', 1000)
+
+    def add_line(self, name, stops, seconds):
+        line = BusLine.objects.create(route_name=name)
+        for order, stop in enumerate(stops, start=1):
+            BusLineStop.objects.create(bus_line=line, bus_stop=self.stops[stop], order=order)
+        for order, (a, b) in enumerate(zip(stops, stops[1:]), start=1):
+            RouteSegment.objects.create(bus_line=line, from_stop=self.stops[a], to_stop=self.stops[b], order=order,
+                                        distance_meters=1800, typical_duration_seconds=seconds)
+
+    def plan(self, a, b, **params):
+        response = self.client.get('/api/journeys/', {
+            'from': self.stops[a].stop_id, 'to': self.stops[b].stop_id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['journeys']
+
+    @staticmethod
+    def summary(journey):
+        return [leg['line']['route_name'] if leg['type'] == 'ride' else 'walk' for leg in journey['legs']]
+
+    def test_pareto_journeys(self):
+        journeys = self.plan('A', 'E')
+        self.assertEqual([self.summary(j) for j in journeys], [['3', 'walk'], ['1', '2', 'walk']])
+        self.assertEqual([j['rides'] for j in journeys], [1, 2])
+        walk = journeys[1]['legs'][2]
+        self.assertAlmostEqual(walk['distance_m'], 111, delta=2)
+        # 2 waits of 300 s + 3 x 100 s riding + the walk
+        self.assertEqual(journeys[1]['duration_s'], 900 + walk['duration_s'])
+        self.assertEqual(journeys[1]['legs'][0]['stops'], [self.stops[s].stop_id for s in 'ABC'])
+        self.assertEqual([self.summary(j) for j in self.plan('A', 'E', max_transfers=0)], [['3', 'walk']])
+
+    def test_walk_between_rides(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stops['F'] = BusStop.objects.create(
+                stop_name='F', location=Location.objects.create(latitude=33.52, longitude=36.36))
+            self.add_line('5', 'EF', 100)
+        journeys = self.plan('A', 'F')
+        self.assertEqual([self.summary(j) for j in journeys], [['3', 'walk', '5'], ['1', '2', 'walk', '5']])
+        walk = journeys[0]['legs'][1]
+        self.assertEqual((walk['from_stop']['stop_name'], walk['to_stop']['stop_name']), ('D', 'E'))
+
+    def test_unreachable_and_walk_only(self):
+        self.assertEqual(self.plan('D', 'A'), [])  # lines only run in their stop order
+        self.assertEqual([self.summary(j) for j in self.plan('D', 'E')], [['walk']])
+
+    def test_graph_rebuilt_on_network_change(self):
+        self.plan('A', 'E')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_line('4', 'AE', 50)
+        self.assertEqual([self.summary(j) for j in self.plan('A', 'E')], [['4']])
+
+    def test_graph_expires(self):
+        version = network_version()
+        graph = get_journey_graph(version)
+        self.assertIs(get_journey_graph(version), graph)
+        with self.settings(BUS_TRACKING_NETWORK_INDEX_TTL=1):
+            graph.built_at -= 1
+            self.assertIsNot(get_journey_graph(version), graph)
+
+    def test_invalid_params(self):
+        stop_id = self.stops['A'].stop_id
+        for params, code in (({'from': stop_id}, 400), ({'from': stop_id, 'to': 'x'}, 400),
+                             ({'from': stop_id, 'to': stop_id}, 400),
+                             ({'from': stop_id, 'to': 999999}, 404),
+                             ({'from': stop_id, 'to': self.stops['E'].stop_id, 'max_transfers': 9}, 400)):
+            self.assertEqual(self.client.get('/api/journeys/', params).status_code, code, params)
+
+    def test_missing_durations_fall_back_to_distance(self):
+        graph = JourneyGraph(0, [(1, 'A', 33.5, 36.3), (2, 'B', 33.5, 36.31)],
+                             [(1, 'L', [1, 2], [None])], board_wait=0, max_walk=0)
+        # ~927 m at 30 km/h
+        self.assertAlmostEqual(graph.plan(1, 2)[0]['duration_s'], 111, delta=2)
+
+
+class LiveStateTests(TestCase):
+    """
+    The live state store seeds from the database and follows broadcasts of other processes.
+    """
+
+    def state(self, bus_id, latitude, timestamp):
+        return {'bus_id': bus_id, 'license_plate': f'P-{bus_id}', 'bus_line_id': None,
+                'latitude': latitude, 'longitude': 36.3, 'speed': None, 'timestamp': timestamp}
+
+    def test_applies_states_of_other_processes(self):
+        store = LiveStateStore()
+        self.assertEqual(store.apply_states([self.state(1, 33.5, '2024-01-01T10:00:00+00:00')]), 1)
+        self.assertEqual(store.get(1)['latitude'], 33.5)
+
+        # Older fixes do not overwrite newer ones
+        self.assertEqual(store.apply_states([self.state(1, 10.0, '2024-01-01T09:00:00+00:00')]), 0)
+        self.assertEqual(store.get(1)['latitude'], 33.5)
+
+    def test_ensure_loaded_keeps_live_updates(self):
+        line = BusLine.objects.create(route_name='Line 1')
+        for plate, latitude in (('A', 33.1), ('B', 33.2)):
+            Bus.objects.create(license_plate=plate, bus_line=line,
+                               current_location=Location.objects.create(latitude=latitude, longitude=36.3))
+        live = Bus.objects.get(license_plate='A')
+        store = LiveStateStore()
+        store.update(self.state(live.bus_id, 40.0, None))
+        store.ensure_loaded()
+        self.assertTrue(store.loaded)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get(live.bus_id)['latitude'], 40.0)
+        with self.assertNumQueries(0):
+            store.ensure_loaded()
+
+
+class UpdateHistoryTests(TestCase):
+    """
+    Resuming replays missed messages, or refuses when they cannot all be replayed.
+    """
+
+    def send(self, history, topic):
+        message = {'seq': history.next_seq()}
+        history.record(topic, message)
+        return message['seq']
+
+    def test_replays_the_gap_across_topics(self):
+        history = UpdateHistory(max_messages=3)
+        first = self.send(history, 'a')
+        second = self.send(history, 'b')
+        third = self.send(history, 'a')
+        self.assertEqual([m['seq'] for m in history.since(['a', 'b'], first)], [second, third])
+        self.assertEqual(history.since(['a'], third), [])
+        self.assertIsNone(history.since(['a'], third + 1))  # from the future
+
+    def test_refuses_when_the_buffer_dropped_part_of_the_gap(self):
+        history = UpdateHistory(max_messages=2)
+        seqs = [self.send(history, 'a') for _ in range(4)]
+        self.assertIsNone(history.since(['a'], seqs[0]))
+        self.assertEqual([m['seq'] for m in history.since(['a'], seqs[1])], seqs[2:])
+
+    def test_seqs_of_an_earlier_process_are_refused(self):
+        earlier = UpdateHistory()
+        seqs = [self.send(earlier, 'a') for _ in range(1000)]
+        self.assertEqual(seqs, sorted(set(seqs)))
+        later = UpdateHistory()
+        self.assertGreater(later.last_seq, seqs[-1])  # a burst does not run ahead of the clock
+        self.assertIsNone(later.since(['a'], seqs[-1]))
+
+    def test_seqs_of_another_live_process_are_refused(self):
+        mine, other = UpdateHistory(max_messages=10), UpdateHistory(max_messages=10)
+        first = self.send(mine, 'a')
+        foreign = self.send(other, 'a')
+        last = self.send(mine, 'a')
+        self.assertLess(first, foreign)
+        self.assertLess(foreign, last)  # inside this history's range...
+        self.assertIsNone(mine.since(['a'], foreign))  # ...but not issued by it
+        self.assertEqual([m['seq'] for m in mine.since(['a'], first)], [last])
+        self.assertEqual(mine.since(['b'], mine.last_seq), [])
+
+
+class TokenCacheTests(TestCase):
+    """
+    WebSocket token lookups are cached with a TTL and LRU bound, and dropped when the token or user changes.
+    """
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user('driver', password='x')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_ttl_and_lru(self):
+        tokens = TokenCache(max_size=2, ttl=60, negative_ttl=10)
+        with mock.patch('bus_tracking.middleware.time.monotonic', return_value=1000.0):
+            tokens.set('a', self.user)
+            tokens.set('b', None)
+            self.assertIs(tokens.get('a'), self.user)  # a is now the most recently used
+            tokens.set('c', self.user)
+            self.assertIs(tokens.get('b'), _MISSING)
+        with mock.patch('bus_tracking.middleware.time.monotonic', return_value=1061.0):
+            self.assertIs(tokens.get('a'), _MISSING)
+        self.assertEqual((tokens.hits, tokens.misses), (1, 2))
+
+    def test_lookups_hit_the_database_once_until_invalidated(self):
+        lookup = async_to_sync(get_user_for_token)
+        self.assertEqual(lookup(self.token.key), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup(self.token.key), self.user)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(lookup(self.token.key))
+
+        self.token.delete()
+        self.assertIsNone(lookup(self.token.key))
+        token = Token.objects.create(user=self.user, key=self.token.key)  # cached as invalid until recreated
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(lookup(token.key), self.user)
+
+
+class WireFormatTests(TestCase):
+    """
+    Compact and binary frames carry only what changed per connection and decode back to the records.
+    """
+
+    state = {'bus_id': 7, 'license_plate': 'P-7', 'bus_line_id': 3, 'latitude': 33.51234,
+             'longitude': 36.29876, 'speed': 42.5, 'timestamp': '2024-01-01T10:00:00+00:00'}
+
+    def test_quantize(self):
+        self.assertEqual(quantize_state(self.state), (7, 3351234, 3629876, 425, 1704103200000, 'P-7', 3))
+        self.assertEqual(quantize_state(dict(self.state, speed=None, timestamp='bad'))[3:5], (None, None))
+
+    def test_compact_deltas(self):
+        encoder = DeltaEncoder(FORMAT_COMPACT)
+        record = quantize_state(self.state)
+        self.assertEqual(json.loads(encoder.encode([record], seq=5)), {'k': 'b', 's': 5, 'u': [
+            {'i': 7, 'y': 3351234, 'x': 3629876, 'v': 425, 't': 1704103200000, 'p': 'P-7', 'l': 3}]})
+        self.assertIsNone(encoder.encode([record]))
+        moved = quantize_state(dict(self.state, latitude=33.6))
+        self.assertEqual(json.loads(encoder.encode([list(moved)])), {'k': 'b', 'u': [{'i': 7, 'y': 3360000}]})
+        # A new plate or line is sent with the next delta
+        relined = quantize_state(dict(self.state, latitude=33.6, bus_line_id=4))
+        self.assertEqual(json.loads(encoder.encode([relined])), {'k': 'b', 'u': [{'i': 7, 'l': 4}]})
+        encoder.forget(7)
+        self.assertIn('p', json.loads(encoder.encode([moved]))['u'][0])
+
+    def test_binary_round_trip(self):
+        encoder = DeltaEncoder(FORMAT_BINARY)
+        record = quantize_state(dict(self.state, speed=None))
+        seq, updates = decode_binary_frame(encoder.encode([record], seq=2 ** 40))
+        self.assertEqual(seq, 2 ** 40)
+        self.assertEqual(updates, [{'i': 7, 'y': 3351234, 'x': 3629876, 'v': None, 't': 1704103200000,
+                                    'p': 'P-7', 'l': 3}])
+
+        faster = quantize_state(dict(self.state, speed=50))
+        seq, updates = decode_binary_frame(encoder.encode([faster]))
+        self.assertIsNone(seq)
+        self.assertEqual(updates, [{'i': 7, 'v': 500}])
+
+        replated = quantize_state(dict(self.state, speed=50, license_plate='ب-7', bus_line_id=None))
+        self.assertEqual(decode_binary_frame(encoder.encode([replated]))[1], [{'i': 7, 'p': 'ب-7', 'l': None}])
+
+        encoder.remember([quantize_state(dict(self.state, bus_id=8))])
+        self.assertIsNone(encoder.encode([quantize_state(dict(self.state, bus_id=8))]))
+
+
+class BroadcastFrameTests(TestCase):
+    """
+    Broadcast messages are serialized once by the producer; every frame variant carries the same states.
+    """
+
+    def states(self):
+        return [{'bus_id': bus_id, 'license_plate': f'P-{bus_id}', 'bus_line_id': None, 'latitude': 33.5,
+                 'longitude': 36.3, 'speed': 10, 'timestamp': None} for bus_id in (1, 2)]
+
+    def test_batch_message(self):
+        states = self.states()
+        encoded = {}
+        fleet = batch_message(states, encoded, seq=11)
+        cell = batch_message(states[1:], encoded, seq=12)
+        self.assertEqual(len(encoded), 2)  # each state encoded once across groups
+        self.assertEqual(set(fleet), {'type', 'seq', 'text', 'origin'})
+        self.assertEqual(json.loads(fleet['text']), {'type': 'bus_locations_batch', 'seq': 11, 'updates': states})
+
+        # Legacy frames and records are rebuilt from the text on the receiving side
+        [(bus_id, (frame, record))] = message_entries(cell)
+        self.assertEqual((bus_id, record), (2, quantize_state(states[1])))
+        self.assertEqual(json.loads(frame), {'type': 'bus_location_update', 'seq': 12, 'data': states[1]})
+        self.assertEqual(json.loads(frame_data_json(frame)), states[1])
+        self.assertEqual(message_states(fleet), states)
+
+    def test_entries_are_decoded_once_per_process(self):
+        message = batch_message(self.states(), seq=11)
+        entries = message_entries(message)
+        self.assertEqual([bus_id for bus_id, _ in entries], [1, 2])
+        # Another subscriber's copy of the same message (as the channel layer delivers it)
+        self.assertIs(message_entries(copy.deepcopy(message)), entries)
+
+    def test_entries_of_single_updates_and_unserialized_batches(self):
+        state = self.states()[0]
+        [(bus_id, (text, record))] = message_entries({'type': 'bus_location_update', 'data': state})
+        self.assertEqual((bus_id, json.loads(text)['data'], record), (1, state, quantize_state(state)))
+        entries = message_entries({'type': 'bus_locations_batch', 'updates': self.states()})
+        self.assertEqual([json.loads(text)['data']['bus_id'] for _, (text, _) in entries], [1, 2])
+
+
+class OutboxTests(TestCase):
+    """
+    A slow connection's outbox keeps the latest update per bus, bounded, and reports how long it has stalled.
+    """
+
+    def entries(self, *bus_ids, version=0):
+        return [(bus_id, (f'{bus_id}:{version}', (bus_id,))) for bus_id in bus_ids]
+
+    def test_latest_wins(self):
+        outbox = Outbox(max_buses=10)
+        first = {'seq': 1}
+        outbox.put_message(first, self.entries(1, 2))
+        message, entries, seq = async_to_sync(outbox.take)()
+        self.assertIs(message, first)  # untouched: the pre-serialized message can be sent as-is
+        self.assertEqual((len(entries), seq), (2, 1))
+
+        outbox.put_message({'seq': 3}, self.entries(1, 2, version=1))
+        outbox.put_message({'seq': 2}, self.entries(2, version=2))
+        self.assertTrue(outbox.lagging)
+        message, entries, seq = async_to_sync(outbox.take)()
+        self.assertIsNone(message)
+        self.assertEqual([text for text, _ in entries], ['1:1', '2:2'])
+        self.assertEqual((seq, outbox.coalesced), (3, 1))
+        outbox.sent()
+        self.assertFalse(outbox.lagging)
+
+    def test_bounded_and_stall_time(self):
+        outbox = Outbox(max_buses=2)
+        with mock.patch('bus_tracking.outbox.time.monotonic', return_value=100.0):
+            outbox.put_message({}, self.entries(1, 2, 3))
+        self.assertEqual((len(outbox), outbox.dropped), (2, 1))  # the bus updated longest ago goes
+        with mock.patch('bus_tracking.outbox.time.monotonic', return_value=131.0):
+            self.assertEqual(outbox.stalled_for(), 31.0)
+        outbox.discard([2, 3])
+        self.assertEqual(outbox.stalled_for(), 0.0)
+        outbox.close()
+
+
+class PositionStreamTests(TestCase):
+    """
+    The SSE stream filters by bus and line, and resumes from Last-Event-ID or starts with a snapshot.
+    """
+
+    def setUp(self):
+        live_state.clear()
+        history.clear()
+        self.states = [
+            {'bus_id': bus_id, 'license_plate': f'P-{bus_id}', 'bus_line_id': line_id, 'latitude': 33.5,
+             'longitude': 36.3, 'speed': None, 'timestamp': None}
+            for bus_id, line_id in ((1, 10), (2, 20))
+        ]
+
+    def tearDown(self):
+        live_state.clear()
+        history.clear()
+
+    @staticmethod
+    def data(event):
+        fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+        return int(fields['id']), json.loads(fields['data'])
+
+    def test_filters(self):
+        message = batch_message(self.states, seq=5)
+        self.assertEqual(message_event(message, PositionFilter()), f'id: 5\ndata: {message["text"]}\n\n')
+        seq, data = self.data(message_event(message, PositionFilter(line_ids={20})))
+        self.assertEqual((seq, [update['bus_id'] for update in data['updates']]), (5, [2]))
+        self.assertIsNone(message_event(message, PositionFilter(bus_ids={3})))
+        single = {'type': 'bus_location_update', 'seq': 6, 'data': self.states[0]}
+        self.assertEqual(self.data(message_event(single, PositionFilter(bus_ids={1})))[1]['updates'], [self.states[0]])
+
+    def stream(self, last_event_id, count, send=None):
+        async def run():
+            layer = InMemoryChannelLayer()
+            stream = event_stream(layer, [FLEET_GROUP], None, PositionFilter(), last_event_id)
+            events = [await stream.__anext__() for _ in range(count)]
+            if send is not None:
+                await layer.group_send(FLEET_GROUP, send)
+                events.append(await stream.__anext__())
+            await stream.aclose()
+            await scheduler.stop()
+            await follower.stop()
+            return events
+        return async_to_sync(run)()
+
+    def test_resumes_from_last_event_id(self):
+        live_state.update(self.states[0])
+        seen = history.next_seq()
+        history.record(FLEET_GROUP, batch_message(self.states[:1], seq=seen))
+        missed = batch_message(self.states[1:], seq=history.next_seq())
+        history.record(FLEET_GROUP, missed)
+
+        retry, replayed = self.stream(str(seen), 2)
+        self.assertTrue(retry.startswith('retry: '))
+        self.assertEqual(self.data(replayed), (missed['seq'], json.loads(missed['text'])))
+
+        # Unknown or unparsable ids start over with a snapshot, then live messages follow
+        live = batch_message(self.states[:1], seq=history.next_seq())
+        for last_event_id in ('garbage', str(seen - 10 ** 9)):
+            _, snapshot, event = self.stream(last_event_id, 2, send=live)
+            seq, data = self.data(snapshot)
+            self.assertEqual((data['type'], [bus['bus_id'] for bus in data['buses']]), ('fleet_snapshot', [1]))
+            self.assertEqual(self.data(event)[0], live['seq'])
+
+
+class BusLocationConsumerTests(TestCase):
+    """
+    WebSocket clients get a snapshot, then coalesced batches for the fleet or for their viewport's cells.
+    """
+
+    def setUp(self):
+        live_state.clear()
+        history.clear()
+        self.bus = {'bus_id': 1, 'license_plate': 'P-1', 'bus_line_id': None, 'latitude': 33.5,
+                    'longitude': 36.3, 'speed': None, 'timestamp': '2024-01-01T10:00:00+00:00'}
+        live_state.update(self.bus)
+
+    def tearDown(self):
+        live_state.clear()
+        history.clear()
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(BusLocationConsumer.as_asgi(), '/ws/bus-locations/' + query)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def close(self, communicator):
+        await communicator.disconnect()
+        await scheduler.stop()
+        await follower.stop()
+
+    async def test_snapshot_then_latest_state_per_tick(self):
+        communicator = await self.connect('?batch=1')
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['buses']), ('fleet_snapshot', [self.bus]))
+
+        first, latest = dict(self.bus, latitude=33.51), dict(self.bus, latitude=33.52)
+        scheduler.publish([FLEET_GROUP], first)
+        scheduler.publish([FLEET_GROUP], latest)
+        await scheduler.flush()
+        batch = await communicator.receive_json_from()
+        self.assertEqual((batch['type'], batch['updates']), ('bus_locations_batch', [latest]))
+        self.assertEqual(batch['seq'], history.last_seq)
+        await self.close(communicator)
+
+    async def test_states_from_other_processes_reach_live_state(self):
+        communicators = [await self.connect('?snapshot=0') for _ in range(2)]
+        applied = follower.applied
+        other = dict(self.bus, bus_id=2, license_plate='P-2')
+        message = batch_message([other], seq=1)
+        message['origin'] = 'another-process'
+        await get_channel_layer().group_send(FLEET_GROUP, message)
+        for communicator in communicators:
+            self.assertEqual((await communicator.receive_json_from())['data'], other)
+        self.assertEqual(live_state.get(2), other)
+        self.assertEqual(follower.applied, applied + 1)  # once per process, not per connection
+
+        # The process's own broadcasts are already in the store
+        await get_channel_layer().group_send(FLEET_GROUP, batch_message([dict(other, latitude=1.0)], seq=2))
+        for communicator in communicators:
+            await communicator.receive_json_from()
+        self.assertEqual(follower.applied, applied + 1)
+        for communicator in communicators[1:]:
+            await communicator.disconnect()
+        await self.close(communicators[0])
+
+    async def test_viewport_receives_only_its_cells(self):
+        communicator = await self.connect('?snapshot=0')
+        await communicator.send_json_to({'type': 'set_viewport', 'bbox': [33.49, 36.29, 33.505, 36.305]})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['buses']), ('viewport_snapshot', [self.bus]))
+
+        far = dict(self.bus, bus_id=2, latitude=34.5)
+        near = dict(self.bus, latitude=33.501)
+        for state in (far, near):
+            await get_channel_layer().group_send(FLEET_GROUP, batch_message([state]))
+            group = cell_group_name(cell_for(state['latitude'], state['longitude']))
+            await get_channel_layer().group_send(group, batch_message([state]))
+        self.assertEqual((await communicator.receive_json_from())['data'], near)
+        self.assertTrue(await communicator.receive_nothing())
+        await self.close(communicator)
+
+    async def publish(self, state):
+        scheduler.publish([FLEET_GROUP], state)
+        await scheduler.flush()
+
+    async def test_ack_window_holds_updates_until_acknowledged(self):
+        with self.settings(BUS_TRACKING_ACK_WINDOW=1):
+            communicator = await self.connect('?snapshot=0&batch=1&ack=1')
+        states = [dict(self.bus, latitude=33.5 + i / 1000) for i in range(1, 4)]
+        await self.publish(states[0])
+        first = await communicator.receive_json_from()
+        for state in states[1:]:
+            await self.publish(state)
+        self.assertTrue(await communicator.receive_nothing())  # one frame unacknowledged: hold on
+
+        await communicator.send_json_to({'type': 'ack', 'seq': first['seq']})
+        latest = await communicator.receive_json_from()
+        self.assertEqual((latest['updates'], latest['seq']), ([states[2]], history.last_seq))
+        await self.close(communicator)
+
+    async def test_blocking_send_coalesces_then_closes_the_stalled_client(self):
+        released, sent = asyncio.Event(), []
+        send = BusLocationConsumer.send
+
+        async def blocking_send(consumer, text_data=None, bytes_data=None, close=False):
+            sent.append(text_data)
+            await released.wait()
+            await send(consumer, text_data=text_data, bytes_data=bytes_data, close=close)
+
+        async def settle(condition):
+            for _ in range(100):
+                if condition():
+                    return
+                await asyncio.sleep(0.01)
+
+        coalesced, stalled = outbox_stats['coalesced_updates'], outbox_stats['stalled_disconnects']
+        with mock.patch.object(BusLocationConsumer, 'send', blocking_send):
+            communicator = await self.connect('?snapshot=0&batch=1')
+            await self.publish(dict(self.bus, latitude=33.501))
+            await settle(lambda: sent)
+            for latitude in (33.502, 33.503):
+                await self.publish(dict(self.bus, latitude=latitude))
+            await settle(lambda: outbox_stats['coalesced_updates'] > coalesced)
+            self.assertEqual((len(sent), outbox_stats['coalesced_updates']), (1, coalesced + 1))
 
-# Create your tests here.
+            with self.settings(BUS_TRACKING_STALL_TIMEOUT=30), \
+                    mock.patch('bus_tracking.outbox.time.monotonic', return_value=time.monotonic() + 31):
+                await self.publish(dict(self.bus, latitude=33.504))
+                self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4008})
+            self.assertEqual(outbox_stats['stalled_disconnects'], stalled + 1)
+            released.set()
+            await self.close(communicator)
@@ -0,0 +1,243 @@
+# bus_tracking/tiles.py
+"""
+Map tiles of the static network: stops and route lines per XYZ tile.
+
+    GET /tiles/<z>/<x>/<y>
+
+Returns a compact GeoJSON FeatureCollection (Web Mercator XYZ scheme, the one
+Leaflet and Mapbox use) so map clients only load what is on screen instead of
+every stop and route:
+
+- stops (from zoom ``STOP_MIN_ZOOM``): ``Point`` with ``{"k": "stop", "id", "name"}``
+- route segments: ``LineString`` with ``{"k": "segment", "line", "order"}``,
+  drawn from the segment's encoding for that zoom (see geometry.py). A segment
+  is sent whole to every tile it touches, so lines are not cut at tile edges.
+
+Coordinates are ``[lon, lat]`` rounded to 5 decimals (~1 m). Tiles are built
+from a per-process index of the network and kept gzipped in the Django cache
+per network version, so a tile is generated about once per network change.
+The index holds the stops and each segment's bounding box
+(``RouteSegment.bbox``), bucketed into grid cells about one zoom-12 tile wide
+(as ``spatial.StopIndex`` does), so a cache miss only looks at the features
+in the cells the tile covers; a segment's encodings are only loaded once a
+tile needs them. Index and cached tiles are rebuilt when the network version
+changes and at least every ``BUS_TRACKING_NETWORK_INDEX_TTL`` seconds (see
+``network.index_is_current``). The ETag is a hash of the tile, so a rebuild
+that changes nothing keeps it.
+"""
+
+import gzip
+import hashlib
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.views.decorators.http import require_GET
+
+from . import fastjson
+from .geometry import decode, level_for_zoom
+from .network import etag_matches, index_is_current, index_ttl, network_version
+from .spatial import Cell, bbox_cell_count, cell_for, cells_for_bbox
+
+MAX_ZOOM = 22
+STOP_MIN_ZOOM = 12
+# Features this far outside the tile (fraction of the tile size) are included
+# too, so symbols on the edge are not clipped
+TILE_BUFFER = 1 / 16
+TILE_KEY = 'bus_tracking:tile:{version}:{z}:{x}:{y}'
+# Segment ids per query when loading encodings (SQL Server allows ~2100 parameters)
+ENCODING_BATCH = 1000
+# Grid cell of the index buckets, in degrees: the width of a zoom-12 tile
+INDEX_CELL_DEG = 360.0 / 2 ** STOP_MIN_ZOOM
+
+
+def tile_ttl() -> int:
+    return int(getattr(settings, 'BUS_TRACKING_TILE_TTL', 3600))
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    ``(south, west, north, east)`` of an XYZ tile.
+    """
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def _round(lat: float, lon: float) -> List[float]:
+    return [round(lon, 5), round(lat, 5)]
+
+
+class _Segment:
+    __slots__ = ('id', 'line_id', 'order', 'bbox', 'encodings', '_coordinates')
+
+    def __init__(self, segment_id, line_id, order, bbox):
+        self.id = segment_id
+        self.line_id = line_id
+        self.order = order
+        self.bbox = tuple(bbox)
+        self.encodings: Optional[Dict[str, str]] = None  # loaded by TileIndex.features
+        self._coordinates: Dict[str, List[List[float]]] = {}
+
+    def coordinates(self, level: str) -> List[List[float]]:
+        coords = self._coordinates.get(level)
+        if coords is None:
+            encoded = self.encodings.get(level) or self.encodings.get('full', '')
+            coords = self._coordinates[level] = [_round(lat, lon) for lat, lon in decode(encoded)]
+        return coords
+
+
+class TileIndex:
+    """
+    Stops and segments of one network version, ready to be cut into tiles.
+    """
+
+    def __init__(self, version: int):
+        from .models import BusStop, RouteSegment
+
+        self.version = version
+        self.built_at = time.monotonic()
+        self.stops = [
+            (stop_id, name, lat, lon)
+            for stop_id, name, lat, lon in BusStop.objects.values_list(
+                'stop_id', 'stop_name', 'location__latitude', 'location__longitude')
+            if lat is not None and lon is not None
+        ]
+        self.segments = [
+            _Segment(segment_id, line_id, order, bbox)
+            for segment_id, line_id, order, bbox in RouteSegment.objects.order_by('bus_line_id', 'order')
+            .values_list('id', 'bus_line_id', 'order', 'bbox')
+            if bbox
+        ]
+        # Positions in ``stops`` / ``segments`` per grid cell; a segment is in
+        # every cell its bounding box touches
+        self.stop_cells: Dict[Cell, List[int]] = {}
+        for position, (_, _, lat, lon) in enumerate(self.stops):
+            self.stop_cells.setdefault(cell_for(lat, lon, INDEX_CELL_DEG), []).append(position)
+        self.segment_cells: Dict[Cell, List[int]] = {}
+        for position, segment in enumerate(self.segments):
+            for cell in cells_for_bbox(*segment.bbox, INDEX_CELL_DEG):
+                self.segment_cells.setdefault(cell, []).append(position)
+
+    @staticmethod
+    def _in_cells(cells: Dict[Cell, List[int]], south, west, north, east) -> List[int]:
+        """
+        Sorted positions of the features bucketed in the cells the box covers.
+        """
+        if bbox_cell_count(south, west, north, east, INDEX_CELL_DEG) > len(cells):
+            # Zoomed far out: fewer occupied cells than covered ones
+            row_min, col_min = cell_for(south, west, INDEX_CELL_DEG)
+            row_max, col_max = cell_for(north, east, INDEX_CELL_DEG)
+            keys = [cell for cell in cells if row_min <= cell[0] <= row_max and col_min <= cell[1] <= col_max]
+        else:
+            keys = cells_for_bbox(south, west, north, east, INDEX_CELL_DEG)
+        positions = set()
+        for cell in keys:
+            positions.update(cells.get(cell, ()))
+        return sorted(positions)
+
+    @staticmethod
+    def _load_encodings(segments: List[_Segment]) -> None:
+        from .models import RouteSegment
+
+        missing = {segment.id: segment for segment in segments if segment.encodings is None}
+        ids = list(missing)
+        for start in range(0, len(ids), ENCODING_BATCH):
+            for segment_id, encodings in RouteSegment.objects.filter(
+                    id__in=ids[start:start + ENCODING_BATCH]).values_list('id', 'encoded_polylines'):
+                missing.pop(segment_id).encodings = encodings or {}
+        for segment in missing.values():
+            segment.encodings = {}  # deleted since the index was built
+
+    def features(self, z: int, x: int, y: int) -> List[dict]:
+        south, west, north, east = tile_bounds(z, x, y)
+        pad_lat = (north - south) * TILE_BUFFER
+        pad_lon = (east - west) * TILE_BUFFER
+        south, west, north, east = south - pad_lat, west - pad_lon, north + pad_lat, east + pad_lon
+
+        features = []
+        level = level_for_zoom(z)
+        segments = [
+            segment for segment in (
+                self.segments[position] for position in self._in_cells(self.segment_cells, south, west, north, east)
+            )
+            if not (segment.bbox[2] < south or segment.bbox[0] > north
+                    or segment.bbox[3] < west or segment.bbox[1] > east)
+        ]
+        self._load_encodings(segments)
+        for segment in segments:
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': segment.coordinates(level)},
+                'properties': {'k': 'segment', 'line': segment.line_id, 'order': segment.order},
+            })
+        if z >= STOP_MIN_ZOOM:
+            for position in self._in_cells(self.stop_cells, south, west, north, east):
+                stop_id, name, lat, lon = self.stops[position]
+                if south <= lat <= north and west <= lon <= east:
+                    features.append({
+                        'type': 'Feature',
+                        'geometry': {'type': 'Point', 'coordinates': _round(lat, lon)},
+                        'properties': {'k': 'stop', 'id': stop_id, 'name': name},
+                    })
+        return features
+
+
+_lock = threading.Lock()
+_index: Optional[TileIndex] = None
+
+
+def get_index(version: int) -> TileIndex:
+    global _index
+    index = _index
+    if index_is_current(index, version):
+        return index
+    with _lock:
+        if not index_is_current(_index, version):
+            _index = TileIndex(version)
+        return _index
+
+
+def render_tile(z: int, x: int, y: int) -> Tuple[bytes, str]:
+    """
+    Gzipped GeoJSON of a tile and its ETag, from the cache when possible.
+    """
+    version = network_version()
+    key = TILE_KEY.format(version=version, z=z, x=x, y=y)
+    cached = cache.get(key)
+    if cached is None:
+        collection = {'type': 'FeatureCollection', 'features': get_index(version).features(z, x, y)}
+        body = fastjson.dumps_bytes(collection)
+        cached = (gzip.compress(body, compresslevel=6), '"' + hashlib.sha1(body).hexdigest() + '"')
+        # No longer than the index it was cut from may be stale
+        cache.set(key, cached, timeout=min(tile_ttl(), index_ttl()))
+    return cached
+
+
+@require_GET
+def tile_view(request, z, x, y):
+    """
+    One network tile as GeoJSON (see module docstring).
+    """
+    if z > MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JsonResponse({'error': 'Tile out of range'}, status=404)
+
+    gzip_body, etag = render_tile(z, x, y)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(gzip_body, content_type='application/geo+json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(gzip_body), content_type='application/geo+json')
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'no-cache'  # the network version changes the ETag
+    return response
@@ -7,6 +7,8 @@ from .views import (BusViewSet, BusLineViewSet, BusStopViewSet,
                     LocationViewSet, BusLocationLogViewSet, AlertViewSet)
 from .frontend_views import (admin_dashboard, manage_buses_view, manage_routes_view, 
                              manage_stops_view, manage_drivers_view, route_detail_view)
+from .sse import stream_positions_view
+from .tiles import tile_view
 from django.views.generic import TemplateView
 
 router = DefaultRouter()
@@ -22,6 +24,12 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')), 
     path('api/', include(router.urls)),
     path('api/initial-data/', views.initial_data_view, name='initial-data'),  # NEW: Combined endpoint
+    path('api/search/', views.search_view, name='search'),
+    path('api/journeys/', views.journey_view, name='journeys'),
+    path('api/export/location-logs/', views.export_location_history_view, name='export-location-logs'),
+    path('api/live-stats/', views.live_stats_view, name='live-stats'),
+    path('api/stream/positions/', stream_positions_view, name='stream-positions'),
+    path('tiles/<int:z>/<int:x>/<int:y>', tile_view, name='network-tile'),
     path('', admin_dashboard, name='admin-dashboard'),
     path('buses/', manage_buses_view, name='manage-buses'),
     path('routes/', manage_routes_view, name='manage-routes'),
@@ -4,15 +4,27 @@ from rest_framework import viewsets, status
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action, api_view, permission_classes # <-- IMPORT ADDED HERE
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny, IsAdminUser
 from django.utils import timezone
+from datetime import timedelta
 from .models import Bus, BusLine, BusStop, Location, BusLocationLog, Alert, BusLineStop, RouteSegment
 from .serializers import (BusSerializer, BusLineSerializer, BusStopSerializer,
                           LocationSerializer, BusLocationLogSerializer, AlertSerializer,
-                          BusStopWithOrderSerializer)
+                          BusStopWithOrderSerializer, BusLocationHistorySerializer)
+from .broadcast import broadcast_bus_location
+from .live_state import state_from_bus
+from .geometry import encode as encode_polyline, level_for_zoom, parse_zoom
+from .location_history import (EXPORT_CONTENT_TYPES, EXPORT_FORMATS, export_chunks, gzip_chunks,
+                               history_queryset, history_rows, iter_history, parse_history_params,
+                               parse_timestamp, simplified_track)
+from .read_cache import CachedReadMixin
+from .network import build_delta, etag_matches, get_snapshot as get_network_snapshot, network_version
+from .spatial import get_stop_index
+from . import search as network_search
+from .journeys import MAX_TRANSFERS as JOURNEY_MAX_TRANSFERS, get_graph as get_journey_graph
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 import math
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from typing import List, Dict, Optional, Tuple
 
 # --- Helper function for calculating distance ---
@@ -51,6 +63,21 @@ def _latest_speed_kmh(bus: Bus, default_speed_kmh: float = 30.0) -> float:
 def _ordered_stops_for_line(bus_line: BusLine) -> List[BusLineStop]:
     return list(BusLineStop.objects.filter(bus_line=bus_line).select_related('bus_stop__location').order_by('order'))
 
+# Bus track replay (BusViewSet.track)
+TRACK_DEFAULT_TOLERANCE = 10.0  # meters
+TRACK_MAX_RANGE = timedelta(days=31)
+
+# Nearby stops (BusStopViewSet.nearby)
+NEARBY_DEFAULT_RADIUS = 500.0  # meters
+NEARBY_MAX_RADIUS = 5000.0
+NEARBY_DEFAULT_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+
+# Search (search_view)
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_QUERY_LENGTH = 100
+
 # --- Segment-Based Tracking Functions ---
 
 def _project_point_onto_segment(point_lat, point_lon, segment_polyline):
@@ -390,9 +417,13 @@ class LocationViewSet(viewsets.ModelViewSet):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
 
-class BusStopViewSet(viewsets.ModelViewSet):
-    queryset = BusStop.objects.all()
+class BusStopViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = BusStop.objects.select_related('location')
     serializer_class = BusStopSerializer
+    cache_models = {
+        'list': (BusStop, Location),
+        'retrieve': (BusStop, Location),
+    }
 
     def create(self, request, *args, **kwargs):
         stop_name = request.data.get('stop_name')
@@ -419,9 +450,53 @@ class BusStopViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-class BusLineViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Stops around a point, nearest first:
+        GET /api/bus-stops/nearby/?lat=&lon=[&radius=<meters, default 500>][&limit=<default 20>]
+        Served from an in-memory grid index of the stops (spatial.StopIndex),
+        rebuilt when the network version changes.
+        """
+        params = request.query_params
+        try:
+            lat = float(params['lat'])
+            lon = float(params['lon'])
+            radius = float(params.get('radius', NEARBY_DEFAULT_RADIUS))
+            limit = int(params.get('limit', NEARBY_DEFAULT_LIMIT))
+        except KeyError:
+            return Response({'error': 'lat and lon are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'error': 'lat, lon, radius and limit must be numbers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({'error': 'lat/lon out of range.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius <= NEARBY_MAX_RADIUS:
+            return Response({'error': f'radius must be between 0 and {NEARBY_MAX_RADIUS:g} meters.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= NEARBY_MAX_LIMIT:
+            return Response({'error': f'limit must be between 1 and {NEARBY_MAX_LIMIT}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = get_stop_index(network_version()).nearby(lat, lon, radius, limit)
+        return Response([
+            {
+                'stop_id': stop_id,
+                'stop_name': name,
+                'location': {'id': location_id, 'latitude': stop_lat, 'longitude': stop_lon},
+                'distance_m': round(distance, 1),
+            }
+            for distance, (stop_id, name, location_id, stop_lat, stop_lon) in results
+        ])
+
+class BusLineViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = BusLine.objects.all()
     serializer_class = BusLineSerializer
+    cache_models = {
+        'list': (BusLine,),
+        'retrieve': (BusLine,),
+        'stops_with_order': (BusLine, BusLineStop, BusStop, Location),
+    }
     
     @action(detail=True, methods=['post'], url_path='add-stop')
     def add_stop(self, request, pk=None):
@@ -444,13 +519,47 @@ class BusLineViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def stops_with_order(self, request, pk=None):
+        def build():
+            try:
+                bus_line = BusLine.objects.get(pk=pk)
+                bus_line_stops = (BusLineStop.objects.filter(bus_line=bus_line)
+                                  .select_related('bus_stop__location').order_by('order'))
+                serializer = BusStopWithOrderSerializer(bus_line_stops, many=True)
+                return Response(serializer.data, status=status.HTTP_200_OK)
+            except BusLine.DoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+        return self.cached(request, build)
+
+    @action(detail=True, methods=['get'])
+    def geometry(self, request, pk=None):
+        """
+        Route geometry as Google encoded polylines, one per segment in route
+        order, simplified for the map zoom given as ?zoom= (full detail without it).
+        """
+        bus_line = self.get_object()
         try:
-            bus_line = BusLine.objects.get(pk=pk)
-            bus_line_stops = BusLineStop.objects.filter(bus_line=bus_line).order_by('order')
-            serializer = BusStopWithOrderSerializer(bus_line_stops, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except BusLine.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            zoom = parse_zoom(request.query_params.get('zoom'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        level = level_for_zoom(zoom)
+        segments = (
+            RouteSegment.objects.filter(bus_line=bus_line)
+            .only('order', 'from_stop_id', 'to_stop_id', 'distance_meters', 'encoded_polylines')
+            .order_by('order')
+        )
+        return Response({
+            'route_id': bus_line.route_id,
+            'zoom': zoom,
+            'level': level,
+            'segments': [{
+                'order': segment.order,
+                'from_stop_id': segment.from_stop_id,
+                'to_stop_id': segment.to_stop_id,
+                'distance_meters': segment.distance_meters,
+                'polyline': segment.encoded_polyline(level),
+            } for segment in segments],
+        })
 
     @action(detail=True, methods=['get'], url_path='stops-with-eta')
     def stops_with_eta(self, request, pk=None):
@@ -606,9 +715,14 @@ class BusLineViewSet(viewsets.ModelViewSet):
             'dwell_time_seconds': dwell_time_per_stop
         }, status=status.HTTP_200_OK)
 
-class BusViewSet(viewsets.ModelViewSet):
-    queryset = Bus.objects.all()
+class BusViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = Bus.objects.select_related('bus_line', 'current_location')
     serializer_class = BusSerializer
+    # Position fixes bump Bus too, so these entries live until the next fix
+    cache_models = {
+        'list': (Bus, BusLine, Location),
+        'retrieve': (Bus, BusLine, Location),
+    }
 
     @permission_classes([AllowAny])
     @action(detail=True, methods=['post'], url_path='update-location')
@@ -629,35 +743,14 @@ class BusViewSet(viewsets.ModelViewSet):
 
         location = Location.objects.create(latitude=lat, longitude=lon)
         bus.current_location = location
-        bus.save()
+        bus.save(update_fields=['current_location'])  # a position fix does not change the network version
         
         BusLocationLog.objects.create(
             bus=bus, location=location, speed=speed, timestamp=timezone.now()
         )
         
-        # Broadcast the location update via WebSocket
-        try:
-            channel_layer = get_channel_layer()
-            if channel_layer:
-                print(f"[WebSocket] Broadcasting location update for bus {bus.bus_id}: lat={lat}, lon={lon}")
-                async_to_sync(channel_layer.group_send)(
-                    'bus_locations',
-                    {
-                        'type': 'bus_location_update',
-                        'data': {
-                            'bus_id': bus.bus_id,
-                            'license_plate': bus.license_plate,
-                            'latitude': lat,
-                            'longitude': lon,
-                            'speed': speed,
-                            'timestamp': timezone.now().isoformat(),
-                        }
-                    }
-                )
-                print(f"[WebSocket] Broadcast completed for bus {bus.bus_id}")
-        except Exception as e:
-            # Log the error but don't fail the request
-            print(f"WebSocket broadcast error: {e}")
+        # Broadcast the location update via WebSocket (fleet + viewport cell groups)
+        broadcast_bus_location(state_from_bus(bus, speed=speed, timestamp=timezone.now()))
         
         # Check if bus is off route
         try:
@@ -798,13 +891,133 @@ class BusViewSet(viewsets.ModelViewSet):
             'eta_to_each_stop': eta_list
         }, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        """
+        The bus's path for replay: GET /api/buses/<id>/track/?from=<iso>&to=<iso>&tolerance=<meters>
+        (default: today so far, 10 m). Returns the simplified path as an
+        encoded polyline and the epoch-second timestamp of each vertex.
+        """
+        bus = self.get_object()
+        try:
+            until = parse_timestamp(request.query_params.get('to')) or timezone.now()
+            since = parse_timestamp(request.query_params.get('from')) or timezone.localtime(until).replace(
+                hour=0, minute=0, second=0, microsecond=0)
+            tolerance = float(request.query_params.get('tolerance', TRACK_DEFAULT_TOLERANCE))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if since >= until or until - since > TRACK_MAX_RANGE:
+            return Response({'error': f'from must be before to, at most {TRACK_MAX_RANGE.days} days apart'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= tolerance <= 1000:
+            return Response({'error': 'tolerance must be between 0 and 1000 meters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        points = simplified_track(bus.bus_id, since, until, tolerance)
+        return Response({
+            'bus_id': bus.bus_id,
+            'from': since.isoformat(),
+            'to': until.isoformat(),
+            'tolerance': tolerance,
+            'polyline': encode_polyline(points),
+            'timestamps': [ts for _, _, ts in points],
+        })
+
+
+class LocationHistoryPagination(CursorPagination):
+    """
+    Cursor pages over one bus's history, newest first. Each page is an
+    index range scan on (bus, timestamp), however deep the client pages.
+    """
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+    ordering = ('-timestamp', '-id')
+
+
 class BusLocationLogViewSet(viewsets.ModelViewSet):
-    queryset = BusLocationLog.objects.all()
+    """
+    List: GET /api/location-logs/?bus=<id>[&since=<iso>][&until=<iso>][&page_size=]
+    returns cursor-paginated lean rows (id, bus_id, timestamp, latitude,
+    longitude, speed); follow ``next`` for older rows. ``bus`` is required:
+    an unfiltered scan of the whole table does not scale.
+    """
+    queryset = BusLocationLog.objects.select_related('bus', 'location')
     serializer_class = BusLocationLogSerializer
+    pagination_class = LocationHistoryPagination
+
+    def list(self, request, *args, **kwargs):
+        try:
+            bus_id, since, until = parse_history_params(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if bus_id is None:
+            return Response({'error': 'bus is required (e.g. ?bus=1&since=2025-01-01T00:00:00Z)'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = history_rows(history_queryset(bus_id, since, until))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(BusLocationHistorySerializer(page, many=True).data)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_location_history_view(request):
+    """
+    Streams the location history as NDJSON (default) or CSV:
+    GET /api/export/location-logs/?output=ndjson|csv[&bus=<id>][&since=<iso>][&until=<iso>]
+    Rows are read in batches and written as they go (constant memory);
+    gzipped on the fly when the client accepts it. Staff only.
+    """
+    output = request.query_params.get('output', 'ndjson')
+    if output not in EXPORT_FORMATS:
+        return Response({'error': f'output must be one of {", ".join(EXPORT_FORMATS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        bus_id, since, until = parse_history_params(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    chunks = export_chunks(iter_history(bus_id, since, until), output)
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = StreamingHttpResponse(
+        gzip_chunks(chunks) if gzipped else (chunk.encode() for chunk in chunks),
+        content_type=EXPORT_CONTENT_TYPES[output],
+    )
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    name = f"location-history-{bus_id if bus_id is not None else 'all'}.{output}"
+    response['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+class AlertPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-timestamp', '-alert_id')
+
 
 class AlertViewSet(viewsets.ModelViewSet):
-    queryset = Alert.objects.all()
+    """
+    List: GET /api/alerts/ returns unresolved alerts, newest first, in cursor
+    pages (one query per page, served by the partial index on open alerts).
+    ?resolved=true for resolved alerts, ?resolved=all for both; ?bus=<id>.
+    """
+    queryset = Alert.objects.select_related('bus')
     serializer_class = AlertSerializer
+    pagination_class = AlertPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        resolved = self.request.query_params.get('resolved', 'false').lower()
+        if resolved != 'all':
+            queryset = queryset.filter(is_resolved=resolved in ('true', '1'))
+        bus_id = self.request.query_params.get('bus')
+        if bus_id and bus_id.isdigit():
+            queryset = queryset.filter(bus_id=int(bus_id))
+        return queryset
 
 
 # --- NEW VIEW FOR GETTING ALL INITIAL DATA IN ONE REQUEST ---
@@ -815,37 +1028,27 @@ def initial_data_view(request):
     This reduces the number of requests from 3 to 1, helping with rate limits.
     
     OPTIMIZED FOR PRODUCTION:
-    - Single database query with select_related/prefetch_related
-    - Efficient serialization
+    - Served from a pre-serialized, pre-gzipped snapshot cached per network
+      version (see bus_tracking/network.py); the ORM is only hit when the
+      network changed or the snapshot expired
+    - ETag / If-None-Match: unchanged data is answered with 304 Not Modified
+    - ?since=<network_version>: only what changed since that version (falls
+      back to the full snapshot when the change log no longer reaches back)
     - Proper error handling
     """
+    since = request.query_params.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'since must be a network_version'}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        # Get all data with optimized queries
-        # select_related: للعلاقات ForeignKey
-        # prefetch_related: للعلاقات ManyToMany
-        bus_stops = BusStop.objects.select_related('location').all()
-        buses = Bus.objects.select_related('current_location', 'bus_line').all()
-        bus_lines = BusLine.objects.all()  # Fixed: removed incorrect prefetch
-        
-        # Serialize data
-        bus_stops_data = BusStopSerializer(bus_stops, many=True).data
-        buses_data = BusSerializer(buses, many=True).data
-        # Use BusLineWithStopsSerializer to include stops in each bus line
-        from .serializers import BusLineWithStopsSerializer
-        bus_lines_data = BusLineWithStopsSerializer(bus_lines, many=True).data
-        
-        # Return combined response
-        return Response({
-            'bus_stops': bus_stops_data,
-            'buses': buses_data,
-            'bus_lines': bus_lines_data,
-            'timestamp': timezone.now().isoformat(),
-            'count': {
-                'bus_stops': len(bus_stops_data),
-                'buses': len(buses_data),
-                'bus_lines': len(bus_lines_data)
-            }
-        }, status=status.HTTP_200_OK)
+        if since is not None:
+            delta = build_delta(since)
+            if delta is not None:
+                return Response(delta)
+        snapshot = get_network_snapshot()
     except Exception as e:
         print(f"[ERROR] initial_data_view: {str(e)}")
         return Response({
@@ -853,6 +1056,103 @@ def initial_data_view(request):
             'detail': str(e) if request.user.is_staff else None
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    if etag_matches(request.headers.get('If-None-Match'), snapshot.etag):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(snapshot.gzip_body, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(snapshot.body, content_type='application/json')
+    response['ETag'] = snapshot.etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'no-cache'  # always revalidate with the ETag
+    return response
+
+
+# --- SEARCH OVER STOPS, LINES AND BUSES ---
+@api_view(['GET'])
+def search_view(request):
+    """
+    GET /api/search/?q=<text>[&type=all|bus_stops|buses|bus_lines][&limit=<per type, default 10>]
+
+    Ranked matches from the in-memory search index (see bus_tracking/search.py),
+    grouped like initial-data: ``bus_stops``, ``buses`` and ``bus_lines``, each
+    item as in the list endpoints plus its ``score``.
+    """
+    query = request.query_params.get('q', '').strip()
+    kind = request.query_params.get('type', 'all')
+    if not query or len(query) > SEARCH_MAX_QUERY_LENGTH:
+        return Response({'error': f'q is required (at most {SEARCH_MAX_QUERY_LENGTH} characters).'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if kind != 'all' and kind not in network_search.KINDS:
+        return Response({'error': f"type must be one of: all, {', '.join(network_search.KINDS)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = int(request.query_params.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return Response({'error': f'limit must be between 1 and {SEARCH_MAX_LIMIT}.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    kinds = network_search.KINDS if kind == 'all' else (kind,)
+    matches = network_search.search(query, network_version(), kinds, limit)
+    sources = {
+        network_search.KIND_STOP: (BusStop.objects.select_related('location'), BusStopSerializer),
+        network_search.KIND_BUS: (Bus.objects.select_related('bus_line', 'current_location'), BusSerializer),
+        network_search.KIND_LINE: (BusLine.objects.all(), BusLineSerializer),
+    }
+    data = {'query': query}
+    for kind_name in network_search.KINDS:
+        ranked = matches.get(kind_name)
+        if not ranked:
+            data[kind_name] = []
+            continue
+        queryset, serializer_class = sources[kind_name]
+        objects = queryset.in_bulk([obj_id for obj_id, _ in ranked])
+        data[kind_name] = [
+            {**serializer_class(objects[obj_id]).data, 'score': score}
+            for obj_id, score in ranked if obj_id in objects
+        ]
+    return Response(data)
+
+
+# --- JOURNEY PLANNER ---
+@api_view(['GET'])
+def journey_view(request):
+    """
+    GET /api/journeys/?from=<stop_id>&to=<stop_id>[&max_transfers=<0-5, default 3>]
+
+    Ways to get from one stop to another (see bus_tracking/journeys.py): the
+    fastest journey and any with fewer rides, each as ride/walk legs.
+    """
+    try:
+        from_stop = int(request.query_params['from'])
+        to_stop = int(request.query_params['to'])
+        max_transfers = int(request.query_params.get('max_transfers', 3))
+    except KeyError:
+        return Response({'error': 'from and to (stop ids) are required.'}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({'error': 'from, to and max_transfers must be integers.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if from_stop == to_stop:
+        return Response({'error': 'from and to must be different stops.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= max_transfers <= JOURNEY_MAX_TRANSFERS:
+        return Response({'error': f'max_transfers must be between 0 and {JOURNEY_MAX_TRANSFERS}.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    version = network_version()
+    try:
+        journeys = get_journey_graph(version).plan(from_stop, to_stop, max_transfers)
+    except KeyError:
+        return Response({'error': 'Bus stop not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        'from': from_stop,
+        'to': to_stop,
+        'network_version': version,
+        'journeys': journeys,
+    })
+
 
 # --- NEW VIEW FOR DELETING A BUS LINE STOP ---
 @api_view(['DELETE'])
@@ -869,4 +1169,24 @@ def bus_line_stop_detail_view(request, pk):
     if request.method == 'DELETE':
         bus_line_stop.delete()
         # A 204 response means success but no content to return
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# --- LIVE TRACKING COUNTERS (per process) ---
+@api_view(['GET'])
+def live_stats_view(request):
+    """
+    Fan-out health of this process: connections, lagging clients, updates
+    coalesced/dropped for slow clients and stalled disconnects; read cache
+    hits/misses per endpoint.
+    """
+    from .broadcast import scheduler
+    from .live_state import live_state
+    from .outbox import stats as outbox_stats
+    from .read_cache import stats as read_cache_stats
+
+    return Response({
+        'websocket': dict(outbox_stats),
+        'broadcast_frames_sent': scheduler.frames_sent,
+        'live_buses': len(live_state),
+        'read_cache': read_cache_stats.snapshot(),
+    })
@@ -0,0 +1,248 @@
+# bus_tracking/wire.py
+"""
+WebSocket wire formats for live bus positions.
+
+Clients pick a format at connect time with ``?format=``:
+
+- ``verbose`` (default): the original JSON messages,
+  ``{"type": "bus_location_update", "data": {...}}``.
+- ``compact``: one JSON text frame per batch, ``{"k": "b", "s": seq, "u": [...]}``.
+  Each update is an object with short keys and only the fields that changed
+  since this connection last received the bus:
+    i = bus_id, y = latitude * 1e5, x = longitude * 1e5 (integers),
+    v = speed * 10 (integer, km/h), t = epoch milliseconds,
+    p = license_plate, l = bus_line_id.
+  A bus's first update carries every field; later ones only what changed,
+  including a new plate or line.
+  ``s`` is the broadcast sequence number (see ``bus_tracking/history.py``).
+- ``binary``: the same deltas packed into a binary frame (little-endian):
+    header:  u8 frame kind, u16 update count, and for kind 2 a u64 sequence
+             number (1 = updates, 2 = updates with sequence number)
+    update:  u32 bus_id, u8 field mask, then the present fields in order
+             i32 latitude*1e5 (bit 0), i32 longitude*1e5 (bit 1),
+             u16 speed*10 (bit 2, 0xFFFF = unknown), i64 epoch ms (bit 3),
+             license plate as u8 length + UTF-8 bytes (bit 4, length 0xFF =
+             none), i32 bus_line_id (bit 5, -1 = none)
+
+Quantized records are built once per broadcast by the producer (see
+``quantize_state``); each connection only computes its own deltas.
+"""
+
+import json
+import struct
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FORMAT_VERBOSE = 'verbose'
+FORMAT_COMPACT = 'compact'
+FORMAT_BINARY = 'binary'
+FORMATS = (FORMAT_VERBOSE, FORMAT_COMPACT, FORMAT_BINARY)
+
+COORD_SCALE = 100000  # 1e-5 degrees ≈ 1.1 m
+SPEED_SCALE = 10      # 0.1 km/h
+SPEED_UNKNOWN = 0xFFFF
+PLATE_NONE = 0xFF
+LINE_NONE = -1
+
+BINARY_FRAME_UPDATES = 1
+BINARY_FRAME_SEQ_UPDATES = 2
+
+# Field positions in a quantized record, and the matching binary mask bits
+# (bus_id, lat, lon, speed, ts_ms, license_plate, bus_line_id)
+_FIELD_KEYS = ('y', 'x', 'v', 't', 'p', 'l')
+_FIELD_BITS = (1, 2, 4, 8, 16, 32)
+_PLATE = 5
+
+_HEADER = struct.Struct('<BH')
+_SEQ = struct.Struct('<Q')
+_UPDATE_HEAD = struct.Struct('<IB')
+# The plate (variable length) is packed by _pack_plate
+_FIELD_STRUCTS = (struct.Struct('<i'), struct.Struct('<i'), struct.Struct('<H'), struct.Struct('<q'),
+                  None, struct.Struct('<i'))
+_PLATE_LENGTH = struct.Struct('<B')
+
+Record = Tuple[int, int, int, Optional[int], Optional[int], Optional[str], Optional[int]]
+
+
+def negotiate_format(value: Optional[str]) -> str:
+    if value in FORMATS:
+        return value
+    return FORMAT_VERBOSE
+
+
+def _timestamp_ms(value) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+def _speed(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        speed = int(round(float(value) * SPEED_SCALE))
+    except (TypeError, ValueError):
+        return None
+    return speed if 0 <= speed < SPEED_UNKNOWN else None
+
+
+def quantize_state(state: dict) -> Record:
+    """
+    Turns a broadcast state dict into a fixed-point record.
+    """
+    return (
+        state['bus_id'],
+        int(round(state['latitude'] * COORD_SCALE)),
+        int(round(state['longitude'] * COORD_SCALE)),
+        _speed(state.get('speed')),
+        _timestamp_ms(state.get('timestamp')),
+        state.get('license_plate'),
+        state.get('bus_line_id'),
+    )
+
+
+def quantize_states(states: Iterable[dict]) -> List[Record]:
+    return [quantize_state(state) for state in states]
+
+
+class DeltaEncoder:
+    """
+    Per-connection delta state: remembers the last record sent for each bus
+    and emits only the fields that changed.
+    """
+
+    def __init__(self, wire_format: str):
+        self.wire_format = wire_format
+        self._last: Dict[int, Record] = {}
+
+    def remember(self, records: Iterable[Record]) -> None:
+        """
+        Marks records as known to the client (e.g. after a full snapshot).
+        """
+        for record in records:
+            self._last[record[0]] = tuple(record)
+
+    def forget(self, bus_id: int) -> None:
+        self._last.pop(bus_id, None)
+
+    def encode(self, records: Iterable[Record], seq: Optional[int] = None):
+        """
+        Returns a text frame (compact) or bytes frame (binary), or None if
+        nothing changed. ``seq`` is carried in the frame when given.
+        """
+        if self.wire_format == FORMAT_BINARY:
+            return self._encode_binary(records, seq)
+        return self._encode_compact(records, seq)
+
+    def _changes(self, records):
+        for record in records:
+            record = tuple(record)  # records arrive as lists through Redis
+            bus_id = record[0]
+            previous = self._last.get(bus_id)
+            if previous == record:
+                continue
+            self._last[bus_id] = record
+            yield record, previous
+
+    def _encode_compact(self, records, seq=None) -> Optional[str]:
+        updates = []
+        for record, previous in self._changes(records):
+            update = {'i': record[0]}
+            for pos, key in enumerate(_FIELD_KEYS, start=1):
+                if previous is None or previous[pos] != record[pos]:
+                    update[key] = record[pos]
+            updates.append(update)
+        if not updates:
+            return None
+        frame = {'k': 'b'}
+        if seq is not None:
+            frame['s'] = seq
+        frame['u'] = updates
+        return json.dumps(frame, separators=(',', ':'))
+
+    def _encode_binary(self, records, seq=None) -> Optional[bytes]:
+        parts = []
+        count = 0
+        for record, previous in self._changes(records):
+            mask = 0
+            fields = []
+            for pos, bit in enumerate(_FIELD_BITS, start=1):
+                value = record[pos]
+                if previous is not None and previous[pos] == value:
+                    continue
+                if pos == _PLATE:
+                    fields.append(_pack_plate(value))
+                else:
+                    if value is None:
+                        if pos == 3:
+                            value = SPEED_UNKNOWN
+                        elif pos == 6:
+                            value = LINE_NONE
+                        else:
+                            continue  # unknown position/timestamp: leave it out
+                    fields.append(_FIELD_STRUCTS[pos - 1].pack(value))
+                mask |= bit
+            parts.append(_UPDATE_HEAD.pack(record[0], mask))
+            parts.extend(fields)
+            count += 1
+        if not count:
+            return None
+        if seq is None:
+            return _HEADER.pack(BINARY_FRAME_UPDATES, count) + b''.join(parts)
+        return _HEADER.pack(BINARY_FRAME_SEQ_UPDATES, count) + _SEQ.pack(seq) + b''.join(parts)
+
+
+def _pack_plate(plate: Optional[str]) -> bytes:
+    if plate is None:
+        return _PLATE_LENGTH.pack(PLATE_NONE)
+    data = plate.encode()[:PLATE_NONE - 1]
+    return _PLATE_LENGTH.pack(len(data)) + data
+
+
+def decode_binary(frame: bytes) -> List[dict]:
+    """
+    Reference decoder for binary frames (see scripts/bench_wire_format.py).
+    """
+    return decode_binary_frame(frame)[1]
+
+
+def decode_binary_frame(frame: bytes) -> Tuple[Optional[int], List[dict]]:
+    """
+    Decodes a binary frame into ``(seq, updates)``; seq is None for kind 1.
+    """
+    kind, count = _HEADER.unpack_from(frame, 0)
+    offset = _HEADER.size
+    seq = None
+    if kind == BINARY_FRAME_SEQ_UPDATES:
+        (seq,) = _SEQ.unpack_from(frame, offset)
+        offset += _SEQ.size
+    elif kind != BINARY_FRAME_UPDATES:
+        raise ValueError(f'Unknown frame kind {kind}')
+    updates = []
+    for _ in range(count):
+        bus_id, mask = _UPDATE_HEAD.unpack_from(frame, offset)
+        offset += _UPDATE_HEAD.size
+        update = {'i': bus_id}
+        for pos, (key, bit) in enumerate(zip(_FIELD_KEYS, _FIELD_BITS)):
+            if not mask & bit:
+                continue
+            if key == 'p':
+                (length,) = _PLATE_LENGTH.unpack_from(frame, offset)
+                offset += _PLATE_LENGTH.size
+                if length == PLATE_NONE:
+                    update[key] = None
+                else:
+                    update[key] = frame[offset:offset + length].decode(errors='replace')
+                    offset += length
+                continue
+            fmt = _FIELD_STRUCTS[pos]
+            (value,) = fmt.unpack_from(frame, offset)
+            offset += fmt.size
+            if (key == 'v' and value == SPEED_UNKNOWN) or (key == 'l' and value == LINE_NONE):
+                value = None
+            update[key] = value
+        updates.append(update)
+    return seq, updates
@@ -0,0 +1,119 @@
+"""
+Benchmark: per-fix group_send (old behaviour) vs tick-based coalesced batches.
+
+Simulates a fleet reporting positions into an InMemoryChannelLayer while N
+subscribers drain their channels and encode every frame with json.dumps,
+like BusLocationConsumer does. Reports group messages/sec, frames/sec
+delivered to clients and CPU usage for each mode.
+
+Usage:
+    python scripts/bench_broadcast.py [--buses 300] [--interval 3] [--clients 200] [--seconds 5] [--tick-ms 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from channels.layers import InMemoryChannelLayer
+
+from bus_tracking.broadcast import FLEET_GROUP, BroadcastScheduler, message_states
+
+
+def make_state(bus_id):
+    return {
+        'bus_id': bus_id,
+        'license_plate': f'BUS-{bus_id:04d}',
+        'bus_line_id': bus_id % 20,
+        'latitude': 35.5 + random.random() / 10,
+        'longitude': 35.8 + random.random() / 10,
+        'speed': round(random.uniform(0, 60), 1),
+        'timestamp': '2025-01-01T12:00:00.000000+00:00',
+    }
+
+
+async def run_clients(layer, clients, batch_frames, stop, counters):
+    async def client():
+        channel = await layer.new_channel()
+        await layer.group_add(FLEET_GROUP, channel)
+        while not stop.is_set():
+            try:
+                event = await asyncio.wait_for(layer.receive(channel), timeout=0.2)
+            except asyncio.TimeoutError:
+                continue
+            if event['type'] == 'bus_location_update':
+                json.dumps({'type': 'bus_location_update', 'data': event['data']})
+                counters['frames'] += 1
+            elif batch_frames:
+                json.dumps({'type': 'bus_locations_batch', 'updates': message_states(event)})
+                counters['frames'] += 1
+            else:
+                for data in message_states(event):
+                    json.dumps({'type': 'bus_location_update', 'data': data})
+                    counters['frames'] += 1
+
+    return [asyncio.create_task(client()) for _ in range(clients)]
+
+
+async def run_mode(mode, args):
+    layer = InMemoryChannelLayer(capacity=100000)
+    counters = {'frames': 0, 'group_sends': 0}
+    stop = asyncio.Event()
+    tasks = await run_clients(layer, args.clients, mode == 'tick-batch', stop, counters)
+    await asyncio.sleep(0.1)
+
+    scheduler = BroadcastScheduler(tick_seconds=args.tick_ms / 1000.0, channel_layer=layer)
+    if mode != 'per-fix':
+        await scheduler.ensure_running()
+
+    fixes_per_sec = args.buses / args.interval
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    fixes = 0
+    while time.perf_counter() - wall_start < args.seconds:
+        state = make_state(random.randrange(args.buses))
+        if mode == 'per-fix':
+            await layer.group_send(FLEET_GROUP, {'type': 'bus_location_update', 'data': state})
+            counters['group_sends'] += 1
+        else:
+            scheduler.publish([FLEET_GROUP], state)
+        fixes += 1
+        await asyncio.sleep(1.0 / fixes_per_sec)
+
+    await scheduler.stop()
+    await scheduler.flush()
+    await asyncio.sleep(0.5)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    group_sends = counters['group_sends'] or scheduler.frames_sent
+    print(f"{mode:>14}: fixes={fixes:6d}  group_sends/s={group_sends / wall:8.1f}  "
+          f"frames/s={counters['frames'] / wall:10.1f}  cpu={cpu:6.2f}s ({100 * cpu / wall:5.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buses', type=int, default=300)
+    parser.add_argument('--interval', type=float, default=3.0, help='seconds between fixes per bus')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--tick-ms', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{args.buses} buses every {args.interval}s, {args.clients} clients, tick={args.tick_ms}ms")
+    for mode in ('per-fix', 'tick-legacy', 'tick-batch'):
+        asyncio.run(run_mode(mode, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: end-to-end broadcast latency and throughput per channel layer.
+
+Compares channels_redis's RedisChannelLayer ("core", a Redis list per
+channel) with RedisPubSubChannelLayer ("pubsub") for the position broadcast
+pattern: one group, N subscribed channels, a batch message every tick.
+The publisher and the subscribers use separate layer instances, like the
+ingest path and the ASGI server, so every message goes through Redis.
+"memory" (InMemoryChannelLayer, single instance) is included as a baseline
+and is the only layer that runs without Redis.
+
+Reports, per layer and subscriber count: deliveries/sec, message loss and
+p50/p95/p99 latency from group_send to receive.
+
+Needs a local redis-server and channels_redis (requirements.txt):
+    redis-server --save '' --appendonly no &
+
+Usage:
+    python scripts/bench_channel_layers.py [--redis redis://127.0.0.1:6379/0]
+        [--layers core pubsub] [--subscribers 1000 10000] [--messages 20] [--tick-ms 500] [--buses 50]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from channels.layers import InMemoryChannelLayer
+
+from bus_tracking.broadcast import batch_message
+
+
+def make_layer(name, redis_url):
+    if name == 'memory':
+        return InMemoryChannelLayer(capacity=1000)
+    if name == 'core':
+        from channels_redis.core import RedisChannelLayer
+        return RedisChannelLayer(hosts=[redis_url], capacity=1000, expiry=10)
+    if name == 'pubsub':
+        from channels_redis.pubsub import RedisPubSubChannelLayer
+        return RedisPubSubChannelLayer(hosts=[redis_url])
+    raise ValueError(name)
+
+
+def make_updates(buses):
+    return [{
+        'bus_id': bus_id,
+        'license_plate': f'BUS-{bus_id:04d}',
+        'bus_line_id': bus_id % 20,
+        'latitude': 33.5 + random.random() / 10,
+        'longitude': 36.3 + random.random() / 10,
+        'speed': round(random.uniform(0, 60), 1),
+        'timestamp': '2025-01-01T12:00:00.000000+00:00',
+    } for bus_id in range(buses)]
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_case(layer_name, subscribers, args):
+    sub_layer = make_layer(layer_name, args.redis)
+    pub_layer = sub_layer if layer_name == 'memory' else make_layer(layer_name, args.redis)
+    group = f'bench_{uuid.uuid4().hex[:8]}'
+
+    channels = [await sub_layer.new_channel() for _ in range(subscribers)]
+    for channel in channels:
+        await sub_layer.group_add(group, channel)
+
+    latencies = []
+    expected = subscribers * args.messages
+    done = asyncio.Event()
+
+    async def drain(channel):
+        while True:
+            message = await sub_layer.receive(channel)
+            latencies.append(time.perf_counter() - message['sent_at'])
+            if len(latencies) >= expected:
+                done.set()
+
+    tasks = [asyncio.ensure_future(drain(channel)) for channel in channels]
+    await asyncio.sleep(0.5)  # let subscriptions settle
+
+    message = batch_message(make_updates(args.buses))
+    publish_times = []
+    started = time.perf_counter()
+    for _ in range(args.messages):
+        message['sent_at'] = time.perf_counter()
+        await pub_layer.group_send(group, message)
+        publish_times.append(time.perf_counter() - message['sent_at'])
+        await asyncio.sleep(args.tick_ms / 1000.0)
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    wall = time.perf_counter() - started
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for channel in channels:
+        await sub_layer.group_discard(group, channel)
+    for layer in {id(sub_layer): sub_layer, id(pub_layer): pub_layer}.values():
+        if hasattr(layer, 'flush'):
+            await layer.flush()
+
+    delivered = len(latencies)
+    latencies.sort()
+    publish_times.sort()
+    print(f"{layer_name:>7} {subscribers:7d} subs: deliveries/s={delivered / wall:10.1f}  "
+          f"loss={100.0 * (expected - delivered) / expected:6.2f}%  "
+          f"p50={1000 * percentile(latencies, 50):8.2f}ms  p95={1000 * percentile(latencies, 95):8.2f}ms  "
+          f"p99={1000 * percentile(latencies, 99):8.2f}ms  "
+          f"group_send p50={1000 * percentile(publish_times, 50):7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis', default='redis://127.0.0.1:6379/0')
+    parser.add_argument('--layers', nargs='+', choices=('core', 'pubsub', 'memory'), default=['core', 'pubsub'])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--messages', type=int, default=20, help='broadcasts per case')
+    parser.add_argument('--tick-ms', type=int, default=500)
+    parser.add_argument('--buses', type=int, default=50, help='buses per batch message')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for stragglers')
+    args = parser.parse_args()
+
+    print(f"{args.messages} broadcasts of {args.buses} buses every {args.tick_ms}ms")
+    for subscribers in args.subscribers:
+        for layer_name in args.layers:
+            asyncio.run(run_case(layer_name, subscribers, args))
+
+
+if __name__ == '__main__':
+    main()
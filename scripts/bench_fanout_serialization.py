@@ -0,0 +1,177 @@
+"""
+Cost of fanning one broadcast out to 1,000 connected clients, end to end.
+
+Publishes with ``channel_layer.group_send`` to a group of N channels, then
+receives every channel's copy and runs it through BusLocationConsumer's
+group handler and the outbox writer step (``send`` is a no-op). Compares
+three message shapes:
+- states: the event only carries the states, every consumer encodes them
+- fat: batch text + per-bus frames + records + states in the message
+- text: the event built by broadcast.batch_message (batch text only)
+
+Runs on the InMemory channel layer, and on Redis when channels_redis is
+installed and ``--redis`` (or REDIS_URL) is given. Reports the message size
+as msgpack (what channels_redis puts on the wire) and CPU/wall time, both
+in total and above the layer's own cost for an empty message (the InMemory
+layer scans every channel for expired messages on each receive, which
+dwarfs everything else at 1,000 channels).
+
+Usage:
+    python scripts/bench_fanout_serialization.py [--clients 1000] [--buses 50] [--rounds 20] [--redis URL]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from channels.layers import InMemoryChannelLayer
+
+from bus_tracking import fastjson
+from bus_tracking.broadcast import batch_message, update_frame
+from bus_tracking.consumers import BusLocationConsumer
+from bus_tracking.outbox import Outbox
+from bus_tracking.wire import FORMAT_VERBOSE, quantize_states
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+GROUP = 'bench_fanout'
+
+
+def make_consumers(count, batch_frames):
+    consumers = []
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        return None
+
+    for _ in range(count):
+        consumer = BusLocationConsumer()
+        consumer.wire_format = FORMAT_VERBOSE
+        consumer.encoder = None
+        consumer.batch_frames = batch_frames
+        consumer.outbox = Outbox()
+        consumer.stalled = False
+        consumer.user = None
+        consumer.send = send
+        consumers.append(consumer)
+    return consumers
+
+
+def make_updates(buses):
+    return [{
+        'bus_id': bus_id,
+        'license_plate': f'BUS-{bus_id:04d}',
+        'bus_line_id': bus_id % 20,
+        'latitude': 33.5 + random.random() / 10,
+        'longitude': 36.3 + random.random() / 10,
+        'speed': round(random.uniform(0, 60), 1),
+        'timestamp': '2025-01-01T12:00:00.000000+00:00',
+    } for bus_id in range(buses)]
+
+
+def states_message(updates, seq):
+    return {'type': 'bus_locations_batch', 'seq': seq, 'updates': updates}
+
+
+def fat_message(updates, seq):
+    # The shape batch_message had before the per-bus frames and records were dropped
+    message = batch_message(updates, seq=seq)
+    message.update(
+        frames=[update_frame(fastjson.dumps(state), seq) for state in updates],
+        records=quantize_states(updates),
+        updates=updates,
+    )
+    return message
+
+
+def text_message(updates, seq):
+    return batch_message(updates, seq=seq)
+
+
+def empty_message(updates, seq):
+    return {'type': 'bench.noop', 'seq': seq}
+
+
+def size(message):
+    if msgpack is None:
+        return None
+    return len(msgpack.packb(message, use_bin_type=True))
+
+
+async def measure(layer, channels, consumers, make_message, updates, rounds):
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for round_no in range(rounds):
+        # A fresh seq/content per round, as in production
+        await layer.group_send(GROUP, make_message(updates, round_no + 1))
+        for channel, consumer in zip(channels, consumers):
+            event = await layer.receive(channel)
+            if event['type'] == 'bench.noop':
+                continue
+            await consumer.bus_locations_batch(event)
+            await consumer.deliver(*await consumer.outbox.take())
+            consumer.outbox.sent()
+    return (time.process_time() - cpu_start) / rounds, (time.perf_counter() - wall_start) / rounds
+
+
+async def run(label, layer, args):
+    channels = [await layer.new_channel() for _ in range(args.clients)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    updates = make_updates(args.buses)
+    per_1000 = 1000.0 / args.clients
+    print(f"\n{label}: {args.clients} clients, {args.buses} buses per batch, {args.rounds} rounds")
+    try:
+        base_cpu, base_wall = await measure(layer, channels, [None] * args.clients, empty_message, updates, args.rounds)
+        print(f"  layer only: {1000 * base_cpu * per_1000:8.2f} ms CPU, {1000 * base_wall * per_1000:8.2f} ms wall "
+              f"per broadcast per 1k clients")
+        for batch_frames in (False, True):
+            consumers = make_consumers(args.clients, batch_frames)
+            print('  batch frames' if batch_frames else '  legacy frames')
+            for name, make_message in (('states', states_message), ('fat', fat_message), ('text', text_message)):
+                cpu, wall = await measure(layer, channels, consumers, make_message, updates, args.rounds)
+                message_size = size(make_message(updates, 1))
+                print(f"    {name:>6}: {message_size or '-':>6} B msgpack | "
+                      f"{1000 * cpu * per_1000:8.2f} ms CPU, {1000 * wall * per_1000:8.2f} ms wall "
+                      f"per broadcast per 1k clients | above layer: "
+                      f"{1e6 * (cpu - base_cpu) / args.clients:6.1f} us CPU/client")
+    finally:
+        for channel in channels:
+            await layer.group_discard(GROUP, channel)
+
+
+async def main(args):
+    await run('InMemoryChannelLayer', InMemoryChannelLayer(capacity=args.rounds + 10), args)
+
+    redis_url = args.redis or os.getenv('REDIS_URL')
+    if not redis_url:
+        print('\nRedis: skipped (pass --redis URL or set REDIS_URL)')
+        return
+    try:
+        from channels_redis.core import RedisChannelLayer
+    except ImportError:
+        print('\nRedis: skipped (channels_redis is not installed)')
+        return
+    layer = RedisChannelLayer(hosts=[redis_url], capacity=args.rounds + 10)
+    try:
+        await run(f'RedisChannelLayer ({redis_url})', layer, args)
+    finally:
+        await layer.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--buses', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--redis', default=None, help='redis:// URL of a Redis server to also benchmark')
+    asyncio.run(main(parser.parse_args()))
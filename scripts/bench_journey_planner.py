@@ -0,0 +1,159 @@
+"""
+Benchmark: journey planner query latency on a synthetic network.
+
+Builds a grid city (stops ~350 m apart) crossed by a few hundred lines, each
+running in both directions as two lines, then times
+bus_tracking.journeys.JourneyGraph (compiled once, as per network version)
+against a per-request baseline: a Dijkstra search over (stop, line) states
+whose graph is built from the line/stop lists on every request, which is
+what planning straight from BusLineStop rows would cost. As a correctness
+check, the planner's fastest journey with no transfer limit is compared
+with Dijkstra's on every query.
+
+Usage:
+    python scripts/bench_journey_planner.py [--grid 60] [--lines 300] [--stops-per-line 30] [--queries 200]
+"""
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from bus_tracking.journeys import JourneyGraph
+
+SPACING_DEG = 0.0032  # ~350 m
+BOARD_WAIT = 300
+MAX_WALK = 400
+
+
+def make_network(grid, line_count, stops_per_line):
+    random.seed(1)
+    stops = [
+        (row * grid + col + 1, f'Stop {row}/{col}', 33.4 + row * SPACING_DEG, 36.2 + col * SPACING_DEG)
+        for row in range(grid) for col in range(grid)
+    ]
+    lines = []
+    moves = ((0, 1), (1, 0), (0, -1), (-1, 0))
+    for number in range(line_count // 2):
+        row, col = random.randrange(grid), random.randrange(grid)
+        heading = random.randrange(4)
+        path = [(row, col)]
+        while len(path) < stops_per_line:
+            if random.random() < 0.2:
+                heading = (heading + random.choice((1, 3))) % 4
+            d_row, d_col = moves[heading]
+            if not (0 <= row + d_row < grid and 0 <= col + d_col < grid) or (row + d_row, col + d_col) in path:
+                heading = (heading + 1) % 4
+                if len(path) > 1 and all(
+                        not (0 <= row + r < grid and 0 <= col + c < grid) or (row + r, col + c) in path
+                        for r, c in moves):
+                    break
+                continue
+            row, col = row + d_row, col + d_col
+            path.append((row, col))
+        stop_ids = [r * grid + c + 1 for r, c in path]
+        seconds = [random.randint(50, 90) for _ in stop_ids[1:]]
+        lines.append((2 * number + 1, f'Line {number}', stop_ids, seconds))
+        lines.append((2 * number + 2, f'Line {number} back', stop_ids[::-1], seconds[::-1]))
+    return stops, lines
+
+
+def dijkstra_per_request(stops, lines, graph, origin, target):
+    # Per-request adjacency from the raw line lists (walking transfers reused from the graph)
+    boarding = {}
+    for route_index, (_, _, stop_ids, seconds) in enumerate(lines):
+        for index, stop_id in enumerate(stop_ids):
+            boarding.setdefault(stop_id, []).append((route_index, index))
+
+    # States: ('at', stop, walked) or ('on', route, index)
+    start = ('at', origin, False)
+    best = {start: 0.0}
+    heap = [(0.0, start)]
+    while heap:
+        cost, state = heapq.heappop(heap)
+        if cost > best.get(state, float('inf')):
+            continue
+        moves = []
+        if state[0] == 'at':
+            _, stop_id, walked = state
+            if stop_id == target:
+                return cost
+            for route_index, index in boarding.get(stop_id, ()):
+                # Boarding rides at least to the next stop
+                if index + 1 < len(lines[route_index][2]):
+                    moves.append((BOARD_WAIT + lines[route_index][3][index], ('on', route_index, index + 1)))
+            if not walked:
+                for other, seconds, _ in graph.transfers[graph.position[stop_id]]:
+                    moves.append((seconds, ('at', graph.stop_ids[other], True)))
+        else:
+            _, route_index, index = state
+            _, _, stop_ids, seconds = lines[route_index]
+            if index + 1 < len(stop_ids):
+                moves.append((seconds[index], ('on', route_index, index + 1)))
+            moves.append((0, ('at', stop_ids[index], False)))
+        for step, next_state in moves:
+            next_cost = cost + step
+            if next_cost < best.get(next_state, float('inf')):
+                best[next_state] = next_cost
+                heapq.heappush(heap, (next_cost, next_state))
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', type=int, default=60)
+    parser.add_argument('--lines', type=int, default=300)
+    parser.add_argument('--stops-per-line', type=int, default=30)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--max-transfers', type=int, default=3)
+    args = parser.parse_args()
+
+    stops, lines = make_network(args.grid, args.lines, args.stops_per_line)
+    started = time.perf_counter()
+    graph = JourneyGraph(0, stops, lines, board_wait=BOARD_WAIT, max_walk=MAX_WALK)
+    compile_ms = (time.perf_counter() - started) * 1000
+    transfers = sum(len(t) for t in graph.transfers)
+    print(f'{len(stops)} stops, {len(graph.routes)} lines, {transfers} walking transfers '
+          f'(graph compiled in {compile_ms:.0f} ms)')
+
+    served = [stop_id for stop_id, _, _, _ in stops if graph.stop_routes[graph.position[stop_id]]]
+    pairs = [tuple(random.sample(served, 2)) for _ in range(args.queries)]
+
+    raptor_times, baseline_times, same, found = [], [], 0, 0
+    for origin, target in pairs:
+        started = time.perf_counter()
+        journeys = graph.plan(origin, target, args.max_transfers)
+        raptor_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        optimum = dijkstra_per_request(stops, lines, graph, origin, target)
+        baseline_times.append(time.perf_counter() - started)
+
+        # Same answer as Dijkstra when the planner may use as many rides as needed
+        unlimited = graph.plan(origin, target, 20)
+        fastest = unlimited[-1]['duration_s'] if unlimited else None
+        found += bool(journeys)
+        same += (fastest is None and optimum is None) or (
+            fastest is not None and optimum is not None and abs(fastest - optimum) <= 1)
+
+    def line(name, times):
+        times = sorted(times)
+        p95 = times[int(len(times) * 0.95) - 1]
+        return f'{name:<26} p50 {statistics.median(times) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms'
+
+    print(f'{args.queries} random stop pairs, {found} reachable with <= {args.max_transfers} transfers; '
+          f'fastest journey (any number of transfers) equal to Dijkstra: {same}/{args.queries}')
+    print(line('per-request Dijkstra', baseline_times))
+    print(line('compiled graph (RAPTOR)', raptor_times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark: JSON encode time of a large synthetic network snapshot.
+
+Compares DRF's stdlib-based JSONRenderer with bus_tracking.fastjson's
+FastJSONRenderer (orjson) on an initial-data shaped payload (stops, buses,
+lines with their stops and encoded geometry), plus the per-update state
+encoding of the broadcast pipeline (json.dumps vs fastjson.dumps) and
+request parsing (JSONParser vs FastJSONParser).
+
+Without orjson installed the fast path falls back to the stdlib and both
+columns measure the same thing.
+
+Usage:
+    python scripts/bench_json_render.py [--lines 200] [--stops-per-line 40] [--buses 1500] [--repeat 20]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from bus_tracking import fastjson
+
+
+def make_snapshot(lines, stops_per_line, buses):
+    random.seed(1)
+    stop_count = lines * stops_per_line // 2
+    stops = [{
+        'stop_id': stop_id,
+        'stop_name': f'موقف {stop_id} - Stop {stop_id}',
+        'location': {'id': stop_id, 'latitude': 33.4 + random.random() / 5, 'longitude': 36.2 + random.random() / 5},
+    } for stop_id in range(1, stop_count + 1)]
+    bus_lines = [{
+        'route_id': route_id,
+        'route_name': f'خط {route_id}',
+        'route_description': 'Synthetic line ' * 3,
+        'stops': [stops[random.randrange(stop_count)] for _ in range(stops_per_line)],
+        'geometry': ['_~mkE_zp|E' + 'o}@o}@' * 20 for _ in range(stops_per_line - 1)],
+    } for route_id in range(1, lines + 1)]
+    fleet = [{
+        'bus_id': bus_id,
+        'license_plate': f'{random.randint(100000, 999999)} دمشق',
+        'qr_code_value': f'QR-{bus_id:06d}',
+        'bus_line': {'route_id': bus_id % lines + 1, 'route_name': f'خط {bus_id % lines + 1}', 'route_description': ''},
+        'current_location': {'id': bus_id, 'latitude': 33.5 + random.random() / 10, 'longitude': 36.3 + random.random() / 10},
+    } for bus_id in range(1, buses + 1)]
+    return {
+        'full': True,
+        'bus_stops': stops,
+        'buses': fleet,
+        'bus_lines': bus_lines,
+        'network_version': 12345,
+        'count': {'bus_stops': len(stops), 'buses': len(fleet), 'bus_lines': len(bus_lines)},
+    }
+
+
+def make_states(buses):
+    return [{
+        'bus_id': bus_id,
+        'license_plate': f'BUS-{bus_id:04d}',
+        'bus_line_id': bus_id % 20,
+        'latitude': 33.5 + random.random() / 10,
+        'longitude': 36.3 + random.random() / 10,
+        'speed': round(random.uniform(0, 60), 1),
+        'timestamp': '2025-01-01T12:00:00.000000+00:00',
+    } for bus_id in range(buses)]
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report(name, baseline, fast, unit='ms'):
+    scale = 1000 if unit == 'ms' else 1e6
+    print(f'{name:<34} stdlib {baseline * scale:9.2f}{unit}  fast {fast * scale:9.2f}{unit}  '
+          f'speedup x{baseline / fast:5.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--stops-per-line', type=int, default=40)
+    parser.add_argument('--buses', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    snapshot = make_snapshot(args.lines, args.stops_per_line, args.buses)
+    stdlib_renderer, fast_renderer = JSONRenderer(), fastjson.FastJSONRenderer()
+    body = stdlib_renderer.render(snapshot)
+    print(f'orjson available: {fastjson.is_available()}')
+    print(f'snapshot: {args.lines} lines x {args.stops_per_line} stops, {args.buses} buses, '
+          f'{len(body) / 1e6:.2f} MB as JSON')
+    assert json.loads(fast_renderer.render(snapshot)) == json.loads(body)
+
+    report('render initial-data snapshot',
+           best_of(args.repeat, lambda: stdlib_renderer.render(snapshot)),
+           best_of(args.repeat, lambda: fast_renderer.render(snapshot)))
+
+    stdlib_parser, fast_parser = JSONParser(), fastjson.FastJSONParser()
+    report('parse initial-data snapshot',
+           best_of(args.repeat, lambda: stdlib_parser.parse(io.BytesIO(body))),
+           best_of(args.repeat, lambda: fast_parser.parse(io.BytesIO(body))))
+
+    states = make_states(args.buses)
+    per_state = len(states)
+    report('encode one bus state (broadcast)',
+           best_of(args.repeat, lambda: [json.dumps(state) for state in states]) / per_state,
+           best_of(args.repeat, lambda: [fastjson.dumps(state) for state in states]) / per_state,
+           unit='us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: nearby-stop lookups on a large synthetic stop set.
+
+Compares a full scan (haversine to every stop, then sort, as the apps do on
+the phone today) with spatial.StopIndex, the grid index behind
+/api/bus-stops/nearby/. Also reports the time to build the index, which is
+paid once per network version change.
+
+Usage:
+    python scripts/bench_nearby_stops.py [--stops 20000] [--radius 500] [--limit 20] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BusTrackingSystem.settings')
+
+import django
+django.setup()
+
+from bus_tracking.spatial import StopIndex
+from bus_tracking.views import haversine
+
+# Roughly the Damascus urban area
+SOUTH, WEST, NORTH, EAST = 33.40, 36.15, 33.60, 36.45
+
+
+def make_rows(count):
+    random.seed(1)
+    return [
+        (stop_id, f'Stop {stop_id}', stop_id, random.uniform(SOUTH, NORTH), random.uniform(WEST, EAST))
+        for stop_id in range(1, count + 1)
+    ]
+
+
+def full_scan(rows, lat, lon, radius_m, limit):
+    ranked = sorted(
+        (distance, row) for distance, row in
+        ((haversine(lat, lon, row[3], row[4]) * 1000, row) for row in rows)
+        if distance <= radius_m
+    )
+    return ranked[:limit]
+
+
+def timed(queries, func):
+    started = time.perf_counter()
+    for lat, lon in queries:
+        func(lat, lon)
+    return (time.perf_counter() - started) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=20000)
+    parser.add_argument('--radius', type=float, default=500)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.stops)
+    queries = [(random.uniform(SOUTH, NORTH), random.uniform(WEST, EAST)) for _ in range(args.queries)]
+
+    started = time.perf_counter()
+    index = StopIndex(0, rows)
+    build = time.perf_counter() - started
+    print(f'{args.stops} stops, radius {args.radius:g} m, limit {args.limit}, '
+          f'{len(index.cells)} grid cells of {index.cell_deg:g} deg (index built in {build * 1000:.1f} ms)')
+
+    for lat, lon in queries[:50]:
+        expected = full_scan(rows, lat, lon, args.radius, args.limit)
+        found = index.nearby(lat, lon, args.radius, args.limit)
+        assert [round(d, 3) for d, _ in found] == [round(d, 3) for d, _ in expected]
+
+    scan_queries = queries[:max(len(queries) // 20, 20)]
+    scan = timed(scan_queries, lambda lat, lon: full_scan(rows, lat, lon, args.radius, args.limit))
+    grid = timed(queries, lambda lat, lon: index.nearby(lat, lon, args.radius, args.limit))
+    print(f'full scan  {scan * 1e6:10.1f} us/query')
+    print(f'grid index {grid * 1e6:10.1f} us/query  (x{scan / grid:.0f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measure bytes on the wire for the WebSocket location formats.
+
+Simulates a fleet moving along straight lines and reporting every few
+seconds, then encodes the same stream as:
+- verbose: one {"type": "bus_location_update", "data": {...}} frame per fix
+- verbose batch: one {"type": "bus_locations_batch", ...} frame per tick
+- compact: short-key JSON deltas (?format=compact)
+- binary: packed binary deltas (?format=binary)
+
+Usage:
+    python scripts/bench_wire_format.py [--buses 300] [--ticks 120] [--report-every 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bus_tracking.wire import (FORMAT_BINARY, FORMAT_COMPACT, DeltaEncoder,
+                               decode_binary, quantize_states)
+
+
+def simulate(buses, ticks, report_every, tick_seconds):
+    random.seed(1)
+    fleet = []
+    for bus_id in range(1, buses + 1):
+        fleet.append({
+            'bus_id': bus_id,
+            'license_plate': f'{random.randint(100000, 999999)} دمشق',
+            'bus_line_id': random.randint(1, 40),
+            'lat': 33.45 + random.random() * 0.1,
+            'lon': 36.25 + random.random() * 0.1,
+            'dlat': random.uniform(-1, 1) * 1e-4,
+            'dlon': random.uniform(-1, 1) * 1e-4,
+            'speed': round(random.uniform(0, 50), 1),
+            'phase': random.randrange(report_every),
+        })
+
+    start = datetime(2025, 1, 1, 8, 0, tzinfo=timezone.utc)
+    for tick in range(ticks):
+        now = start + timedelta(seconds=tick * tick_seconds)
+        batch = []
+        for bus in fleet:
+            if (tick + bus['phase']) % report_every:
+                continue
+            bus['lat'] += bus['dlat'] * report_every
+            bus['lon'] += bus['dlon'] * report_every
+            if random.random() < 0.3:
+                bus['speed'] = round(max(0.0, bus['speed'] + random.uniform(-5, 5)), 1)
+            batch.append({
+                'bus_id': bus['bus_id'],
+                'license_plate': bus['license_plate'],
+                'bus_line_id': bus['bus_line_id'],
+                'latitude': bus['lat'],
+                'longitude': bus['lon'],
+                'speed': bus['speed'],
+                'timestamp': now.isoformat(),
+            })
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buses', type=int, default=300)
+    parser.add_argument('--ticks', type=int, default=120)
+    parser.add_argument('--report-every', type=int, default=3, help='ticks between fixes per bus')
+    parser.add_argument('--tick-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    totals = {'verbose': 0, 'verbose batch': 0, 'compact': 0, 'binary': 0}
+    compact = DeltaEncoder(FORMAT_COMPACT)
+    binary = DeltaEncoder(FORMAT_BINARY)
+    updates = 0
+    for batch in simulate(args.buses, args.ticks, args.report_every, args.tick_seconds):
+        if not batch:
+            continue
+        updates += len(batch)
+        for data in batch:
+            totals['verbose'] += len(json.dumps({'type': 'bus_location_update', 'data': data}).encode())
+        totals['verbose batch'] += len(json.dumps({'type': 'bus_locations_batch', 'updates': batch}).encode())
+        records = quantize_states(batch)
+        frame = compact.encode(records)
+        totals['compact'] += len(frame.encode()) if frame else 0
+        frame = binary.encode(records)
+        if frame:
+            assert len(decode_binary(frame)) == len(batch)
+            totals['binary'] += len(frame)
+
+    print(f"{args.buses} buses, {args.ticks} ticks, {updates} updates")
+    base = totals['verbose']
+    for name, size in totals.items():
+        print(f"{name:>14}: {size:10d} bytes  {size / updates:7.1f} B/update  "
+              f"{100 * (1 - size / base):5.1f}% smaller than verbose")
+
+
+if __name__ == '__main__':
+    main()
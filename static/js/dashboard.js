@@ -80,19 +80,18 @@ document.addEventListener('DOMContentLoaded', function() {
     async function fetchActiveAlerts() {
         if (!alertsContainer) return;
         try {
-            const response = await fetch('/api/alerts/');
+            // Unresolved alerts only (the API default), newest first, one page
+            const response = await fetch('/api/alerts/?page_size=20');
             if (!response.ok) return;
             const data = await response.json();
-            const alerts = Array.isArray(data) ? data : data.results;
+            const activeAlerts = Array.isArray(data) ? data : data.results;
 
             alertsContainer.innerHTML = ''; 
-            const activeAlerts = alerts.filter(alert => !alert.is_resolved);
 
             if (activeAlerts.length > 0) {
                 activeAlerts.forEach(alert => {
-                    // FIX: Access a specific property like 'license_plate' from the nested 'bus' object.
-                    // This is more user-friendly than just the ID.
-                    const busIdentifier = alert.bus ? alert.bus.license_plate : 'Unknown';
+                    // Show the license plate rather than the bus ID
+                    const busIdentifier = alert.bus_license_plate || 'Unknown';
                     const alertHtml = `
                         <div class="bg-red-100 border-l-4 border-red-500 text-red-700 p-4" role="alert">
                             <p class="font-bold">Bus ${busIdentifier} - [${alert.alert_type}]</p>